@@ -1,8 +1,12 @@
+import ast
+import importlib
 import os
 
 import click
+from click.utils import make_default_short_help
 
 cmd_folder = os.path.join(os.path.dirname(__file__), 'commands')
+cmd_package = 'cli.commands'
 cmd_prefix = 'cmd_'
 
 
@@ -26,21 +30,58 @@ class CLI(click.MultiCommand):
 
     def get_command(self, ctx, name):
         """
-        Get a specific command by looking up the module.
+        Get a specific command by importing its module. Modules are imported
+        once per process and their bytecode is cached like any other module.
 
         :param ctx: Click context
         :param name: Command name
         :return: Module's cli function
         """
-        ns = {}
+        if name not in self.list_commands(ctx):
+            return None
 
+        module = importlib.import_module('{0}.{1}{2}'.format(cmd_package,
+                                                             cmd_prefix,
+                                                             name))
+
+        return module.cli
+
+    def format_commands(self, ctx, formatter):
+        """
+        List every command with its short help without importing any of
+        them, importing a command can be as slow as creating the app.
+
+        :param ctx: Click context
+        :param formatter: Click help formatter
+        :return: None
+        """
+        rows = [(name, make_default_short_help(self.describe(name)))
+                for name in self.list_commands(ctx)]
+
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
+
+        return None
+
+    def describe(self, name):
+        """
+        Read the help of a command from the docstring of its cli function,
+        the module only gets parsed, not executed.
+
+        :param name: Command name
+        :return: str
+        """
         filename = os.path.join(cmd_folder, cmd_prefix + name + '.py')
 
         with open(filename) as f:
-            code = compile(f.read(), filename, 'exec')
-            eval(code, ns, ns)
+            module = ast.parse(f.read(), filename)
+
+        for node in module.body:
+            if isinstance(node, ast.FunctionDef) and node.name == 'cli':
+                return ast.get_docstring(node) or ''
 
-        return ns['cli']
+        return ''
 
 
 @click.command(cls=CLI)
@@ -1,20 +1,20 @@
 import click
 import random
 
+import numpy as np
+
 from datetime import datetime
 
 from faker import Faker
 
-from snakeeyes.app import create_app
+from cli.flask_app import app, with_app
 from snakeeyes.extensions import db
 from snakeeyes.blueprints.user.models import User
 from snakeeyes.blueprints.billing.models.invoice import Invoice
 from snakeeyes.blueprints.bet.models.bet import Bet
-from snakeeyes.blueprints.bet.models.dice import roll
-
-# Create an app context for the database connection.
-app = create_app()
-db.app = app
+from snakeeyes.blueprints.bet.models.dice import roll_pairs
+from snakeeyes.blueprints.bet.models.payout import get_payout_table
+from snakeeyes.blueprints.bet.models.stats import BetStats
 
 fake = Faker()
 
@@ -67,6 +67,7 @@ def cli():
 
 
 @click.command()
+@with_app
 def users():
     """
     Generate fake users.
@@ -147,6 +148,7 @@ def users():
 
 
 @click.command()
+@with_app
 def invoices():
     """
     Generate random invoices.
@@ -203,6 +205,7 @@ def invoices():
 
 
 @click.command()
+@with_app
 def bets():
     """
     Generate random bets.
@@ -210,52 +213,59 @@ def bets():
     data = []
 
     users = db.session.query(User).all()
+    bet_counts = [random.randint(10, 20) for _ in users]
+    total = sum(bet_counts)
+
+    # Roll and settle every bet at once rather than 1 at a time.
+    dice_1, dice_2 = roll_pairs(total)
+    outcomes = dice_1 + dice_2
+    guesses = np.where(np.random.random(total) >= 0.75, outcomes,
+                       np.random.randint(2, 13, size=total))
+    wagered = np.random.randint(1, 101, size=total)
+
+    payout_table = get_payout_table(app.config['DICE_ROLL_PAYOUT'])
+    _, payouts, nets = payout_table.settle(guesses, wagered, outcomes)
+
+    user_ids = [user.id for user, count in zip(users, bet_counts)
+                for _ in range(count)]
+    columns = zip(user_ids, guesses.tolist(), dice_1.tolist(),
+                  dice_2.tolist(), outcomes.tolist(), wagered.tolist(),
+                  payouts.tolist(), nets.tolist())
+
+    for user_id, guess, die_1, die_2, outcome, wager, payout, net in columns:
+        fake_datetime = fake.date_time_between(
+            start_date='-1y', end_date='now').strftime('%s')
 
-    for user in users:
-        for i in range(0, random.randint(10, 20)):
-            fake_datetime = fake.date_time_between(
-                start_date='-1y', end_date='now').strftime('%s')
-
-            created_on = datetime.utcfromtimestamp(
-                float(fake_datetime)).strftime('%Y-%m-%dT%H:%M:%S Z')
-
-            wagered = random.randint(1, 100)
-            die_1 = roll()
-            die_2 = roll()
-            outcome = die_1 + die_2
-
-            random_percent = random.random()
+        created_on = datetime.utcfromtimestamp(
+            float(fake_datetime)).strftime('%Y-%m-%dT%H:%M:%S Z')
 
-            if random_percent >= 0.75:
-                guess = outcome
-            else:
-                guess = random.randint(2, 12)
+        params = {
+            'created_on': created_on,
+            'updated_on': created_on,
+            'user_id': user_id,
+            'guess': guess,
+            'die_1': die_1,
+            'die_2': die_2,
+            'roll': outcome,
+            'wagered': wager,
+            'payout': payout,
+            'net': net
+        }
 
-            payout = float(app.config['DICE_ROLL_PAYOUT'][str(guess)])
-            is_winner = Bet.is_winner(guess, outcome)
-            payout = Bet.determine_payout(payout, is_winner)
-            net = Bet.calculate_net(wagered, payout, is_winner)
+        data.append(params)
 
-            params = {
-                'created_on': created_on,
-                'updated_on': created_on,
-                'user_id': user.id,
-                'guess': guess,
-                'die_1': die_1,
-                'die_2': die_1,
-                'roll': outcome,
-                'wagered': wagered,
-                'payout': payout,
-                'net': net
-            }
+    _bulk_insert(Bet, data, 'bets')
 
-            data.append(params)
+    # The bets were inserted directly, so their stats have to be rolled up.
+    with app.app_context():
+        BetStats.rebuild()
 
-    return _bulk_insert(Bet, data, 'bets')
+    return None
 
 
 @click.command()
 @click.pass_context
+@with_app
 def all(ctx):
     """
     Generate all data.
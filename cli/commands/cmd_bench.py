@@ -0,0 +1,1038 @@
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from logging.handlers import SMTPHandler
+from multiprocessing.pool import ThreadPool
+
+import click
+import numpy as np
+import stripe
+from flask import url_for
+from sqlalchemy import event, or_, text
+
+from lib.error_digest import DigestHandler
+from lib.fakes import FakeSMTP, FakeStripe
+from lib.flask_mailplus import queue_template_message, send_template_message
+from lib.util_export import write_export
+from lib.util_sqlalchemy import (
+    encode_cursor,
+    estimate_count,
+    estimated_paginate,
+    keyset_paginate
+)
+from cli.flask_app import app, with_app
+from snakeeyes.extensions import db, redis
+from snakeeyes.blueprints.user.models import User
+from snakeeyes.blueprints.billing.models.invoice import Invoice
+from snakeeyes.blueprints.billing.models.webhook_event import WebhookEvent
+from snakeeyes.blueprints.billing.gateways import cache as gateway_cache
+from snakeeyes.blueprints.billing.gateways import breaker, transport
+from snakeeyes.blueprints.billing.gateways.stripecom import (
+    Event as PaymentEvent,
+    Invoice as PaymentInvoice
+)
+from snakeeyes.blueprints.user.passwords import hasher
+from snakeeyes.blueprints.user.tasks import deliver_queued_mail
+from snakeeyes.blueprints.bet.models.bet import Bet
+from snakeeyes.blueprints.bet.models.dice import roll, roll_pairs, rolls
+from snakeeyes.blueprints.bet.models.payout import get_payout_table
+from snakeeyes.blueprints.bet.models.settlement import (
+    settle_bet,
+    settle_bets
+)
+
+BENCH_EMAIL = 'bench@local.host'
+
+# Each startup scenario runs in a fresh interpreter which reports how long
+# the code took and the process' peak RSS.
+STARTUP_SCRIPT = """
+import json
+import resource
+import time
+
+start = time.time()
+{0}
+print(json.dumps({{'elapsed': time.time() - start,
+                  'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))
+"""
+
+# A cold start with the startup profile on, it gets written to stderr.
+STARTUP_PROFILE_SCRIPT = """
+from snakeeyes.app import create_app
+create_app({'STARTUP_PROFILE': True})
+"""
+
+STARTUP_SCENARIOS = [
+    ('Web', """
+from snakeeyes.app import create_app
+create_app()
+"""),
+    ('Worker, app per task module', """
+from snakeeyes.app import CELERY_TASK_LIST, create_app, create_celery_app
+for _ in CELERY_TASK_LIST:
+    create_celery_app(create_app())
+"""),
+    ('Worker, shared app', """
+from snakeeyes.worker import celery
+celery.loader.import_default_modules()
+""")
+]
+
+
+def _log_timing(label, count, elapsed):
+    """
+    Log how long a benchmark took and its throughput.
+
+    :param label: What was measured
+    :type label: str
+    :param count: Amount of operations performed
+    :type count: int
+    :param elapsed: Seconds it took
+    :type elapsed: float
+    :return: None
+    """
+    click.echo('{0}: {1} in {2:.3f}s ({3:.1f}/s)'.format(
+        label, count, elapsed, count / elapsed if elapsed else 0))
+
+    return None
+
+
+def _reset_bench_user(coins, email=BENCH_EMAIL):
+    """
+    Delete and re-create the user that benchmarks place their bets with.
+
+    :param coins: Starting coins
+    :type coins: int
+    :param email: E-mail address of the user
+    :type email: str
+    :return: User id
+    """
+    User.query.filter(User.email == email).delete()
+    db.session.commit()
+
+    user = User(email=email, password='password')
+    user.coins = coins
+    user.save()
+
+    return user.id
+
+
+def _delete_bench_user(email=BENCH_EMAIL):
+    """
+    Remove the benchmark user, its bets cascade with it.
+
+    :param email: E-mail address of the user
+    :type email: str
+    :return: None
+    """
+    User.query.filter(User.email == email).delete()
+    db.session.commit()
+
+    return None
+
+
+@click.group()
+def cli():
+    """ Run performance benchmarks. """
+    pass
+
+
+@click.command()
+@click.option('--bets', default=5000, help='How many bets to place?')
+@click.option('--workers', default=32, help='How many concurrent bettors?')
+@click.option('--wagered', default=10, help='Coins wagered per bet')
+@click.option('--guess', default=7, help='Dice guess for every bet')
+@with_app
+def settle(bets, workers, wagered, guess):
+    """
+    Fire concurrent bets at a single user and verify the balance.
+
+    The user only starts with enough coins to cover half of the bets, so a
+    good chunk of them must get rejected once the coins run out.
+
+    :return: None
+    """
+    starting_coins = (bets * wagered) // 2
+    user_id = _reset_bench_user(starting_coins)
+    payout = float(app.config['DICE_ROLL_PAYOUT'][str(guess)])
+
+    def place(_):
+        with app.app_context():
+            try:
+                return settle_bet(user_id, guess, wagered, payout)
+            finally:
+                db.session.remove()
+
+    pool = ThreadPool(workers)
+
+    start = time.time()
+    results = pool.map(place, range(bets))
+    elapsed = time.time() - start
+
+    pool.close()
+    pool.join()
+
+    settled = [result for result in results if result is not None]
+    net = sum(bet.net for bet, _ in settled)
+    lowest = min([coins for _, coins in settled] or [starting_coins])
+
+    db.session.expire_all()
+    coins = User.query.get(user_id).coins
+    rows = Bet.query.filter(Bet.user_id == user_id).count()
+
+    _log_timing('Bets attempted', bets, elapsed)
+    click.echo('Settled: {0}, rejected: {1}'.format(len(settled),
+                                                    bets - len(settled)))
+    click.echo('Lowest balance seen: {0}, final balance: {1}'.format(lowest,
+                                                                     coins))
+
+    _delete_bench_user()
+
+    if lowest < 0 or coins < 0:
+        raise click.ClickException('The balance went negative.')
+
+    if coins != starting_coins + net or rows != len(settled):
+        raise click.ClickException('The balance does not match the bets.')
+
+    return None
+
+
+@click.command()
+@click.option('--bets', default=1000, help='How many bets to place?')
+@click.option('--wagered', default=1, help='Coins wagered per bet')
+@click.option('--guess', default=7, help='Dice guess for every bet')
+@with_app
+def batch(bets, wagered, guess):
+    """
+    Compare placing bets 1 at a time against placing them as 1 batch.
+
+    :return: None
+    """
+    payout_table = get_payout_table(app.config['DICE_ROLL_PAYOUT'])
+
+    user_id = _reset_bench_user(bets * wagered)
+
+    start = time.time()
+    for _ in range(bets):
+        settle_bet(user_id, guess, wagered, payout_table.payout(guess))
+    single_elapsed = time.time() - start
+
+    user_id = _reset_bench_user(bets * wagered)
+
+    start = time.time()
+    settle_bets(user_id, [(guess, wagered)] * bets, payout_table)
+    batch_elapsed = time.time() - start
+
+    _delete_bench_user()
+
+    _log_timing('Single bets', bets, single_elapsed)
+    _log_timing('Batched bets', bets, batch_elapsed)
+    click.echo('Speed up: {0:.1f}x'.format(
+        single_elapsed / batch_elapsed if batch_elapsed else 0))
+
+    return None
+
+
+@click.command()
+@click.option('--bets', default=10000000, help='How many bets to settle?')
+@click.option('--chunk-size', default=1000000, help='Bets per array')
+@click.option('--scalar-bets', default=100000,
+              help='How many bets to settle 1 at a time to compare with?')
+@with_app
+def dice(bets, chunk_size, scalar_bets):
+    """
+    Measure how fast bets can be rolled and settled in memory.
+
+    :return: None
+    """
+    payout_table = get_payout_table(app.config['DICE_ROLL_PAYOUT'])
+
+    start = time.time()
+    for _ in range(scalar_bets):
+        guess = 7
+        outcome = roll() + roll()
+        is_winner = Bet.is_winner(guess, outcome)
+        payout = Bet.determine_payout(payout_table.payout(guess), is_winner)
+        Bet.calculate_net(10, payout, is_winner)
+    scalar_elapsed = time.time() - start
+
+    start = time.time()
+    settled = 0
+    while settled < bets:
+        count = min(chunk_size, bets - settled)
+        guesses = np.random.randint(2, 13, size=count)
+        dice_1, dice_2 = roll_pairs(count)
+        payout_table.settle(guesses, np.full(count, 10), dice_1 + dice_2)
+        settled += count
+    vector_elapsed = time.time() - start
+
+    _log_timing('Scalar bets', scalar_bets, scalar_elapsed)
+    _log_timing('Vectorized bets', bets, vector_elapsed)
+
+    return None
+
+
+@click.command()
+@click.option('--count', default=1000000, help='How many dice to roll?')
+def rng(count):
+    """
+    Compare the buffered secure dice roller against random.randint.
+
+    :return: None
+    """
+    start = time.time()
+    for _ in range(count):
+        random.randint(1, 6)
+    randint_elapsed = time.time() - start
+
+    start = time.time()
+    for _ in range(count):
+        roll()
+    buffered_elapsed = time.time() - start
+
+    _log_timing('random.randint rolls', count, randint_elapsed)
+    _log_timing('Buffered secure rolls', count, buffered_elapsed)
+    click.echo('Buffer hits: {hits}, refills: {refills}'.format(
+        **rolls.stats()))
+
+    return None
+
+
+@click.command()
+@click.option('--bets', default=10000000, help='How many bets to seed?')
+@click.option('--per-page', default=50, help='Bets per page')
+@with_app
+def history(bets, per_page):
+    """
+    Compare OFFSET and keyset pagination on the first and last history page.
+
+    :return: None
+    """
+    user_id = _reset_bench_user(0)
+
+    click.echo('Seeding {0} bets...'.format(bets))
+    db.session.execute(text("""
+        INSERT INTO bets (created_on, updated_on, user_id, guess, die_1,
+                          die_2, roll, wagered, payout, net)
+        SELECT now() - n * interval '1 second', now(), :user_id, 7, 3, 4, 7,
+               1, 6.0, 6
+        FROM generate_series(1, :bets) AS n
+    """), {'user_id': user_id, 'bets': bets})
+    db.session.commit()
+    db.session.execute('ANALYZE bets')
+
+    query = Bet.query.filter(Bet.user_id == user_id)
+    last_page = max(1, bets // per_page)
+
+    # Find the row right before the last page to seek from.
+    before_last_page = query \
+        .order_by(Bet.created_on.desc(), Bet.id.desc()) \
+        .offset(max(0, (last_page - 1) * per_page - 1)).first()
+    last_page_cursor = encode_cursor(False, before_last_page.created_on,
+                                     before_last_page.id)
+
+    for label, page, cursor in (('first page', 1, None),
+                                ('last page', last_page, last_page_cursor)):
+        start = time.time()
+        query.order_by(Bet.created_on.desc()).paginate(page, per_page, True)
+        _log_timing('OFFSET {0}'.format(label), 1, time.time() - start)
+
+        start = time.time()
+        keyset_paginate(query, Bet.created_on, Bet.id, cursor=cursor,
+                        per_page=per_page)
+        _log_timing('Keyset {0}'.format(label), 1, time.time() - start)
+
+    _delete_bench_user()
+
+    return None
+
+
+@click.command()
+@click.option('--requests', default=5, help='Page loads per view')
+@with_app
+def queries(requests):
+    """
+    Count the SQL queries each authenticated page load runs with and without
+    the user cache.
+
+    :return: None
+    """
+    views = ['page.home', 'user.settings', 'bet.place_bet', 'bet.history',
+             'bet.leaderboard_standings', 'billing.purchase_coins']
+
+    user = User.query.get(_reset_bench_user(1000))
+    user.username = 'bench'
+    user.save()
+
+    statements = []
+
+    def count_statement(*args):
+        statements.append(args[2])
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    original_ttl = app.config['USER_CACHE_TTL']
+    results = {}
+
+    with app.app_context():
+        engine = db.get_engine(app)
+        event.listen(engine, 'before_cursor_execute', count_statement)
+
+        with app.test_request_context():
+            urls = [url_for(view) for view in views]
+            login_url = url_for('user.login')
+
+        for label, ttl in (('uncached', 0), ('cached', original_ttl or 120)):
+            app.config['USER_CACHE_TTL'] = ttl
+            client = app.test_client()
+            client.post(login_url, data={'identity': BENCH_EMAIL,
+                                         'password': 'password'})
+
+            for view, url in zip(views, urls):
+                # Prime the cache so only warm page loads get counted.
+                client.get(url)
+
+                del statements[:]
+                for _ in range(requests):
+                    client.get(url)
+
+                results.setdefault(view, {})[label] = \
+                    len(statements) / float(requests)
+
+        event.remove(engine, 'before_cursor_execute', count_statement)
+
+    app.config['USER_CACHE_TTL'] = original_ttl
+
+    click.echo('{0:<28} {1:>9} {2:>9}'.format('View', 'Uncached', 'Cached'))
+    for view in views:
+        click.echo('{0:<28} {1:>9.1f} {2:>9.1f}'.format(
+            view, results[view]['uncached'], results[view]['cached']))
+
+    _delete_bench_user()
+
+    return None
+
+
+@click.command()
+@click.option('--logins', default=200, help='How many sign ins?')
+@click.option('--bets', default=2000, help='How many bets to place?')
+@click.option('--clients', default=16, help='Concurrent clients of each kind')
+@with_app
+def logins(logins, bets, clients):
+    """
+    Measure bet latency during a storm of sign ins, with passwords hashed
+    inline and then in the bounded hashing pool.
+
+    :return: None
+    """
+    bettor_email = 'bench-bets@local.host'
+    _reset_bench_user(0)
+    bettor_id = _reset_bench_user(bets * 2, email=bettor_email)
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    original_workers = app.config['PASSWORD_HASH_WORKERS']
+
+    with app.test_request_context():
+        login_url = url_for('user.login')
+
+    def sign_in(_):
+        client = app.test_client()
+
+        start = time.time()
+        response = client.post(login_url, data={'identity': BENCH_EMAIL,
+                                                'password': 'password'})
+
+        return time.time() - start, response.status_code
+
+    def place(_):
+        with app.app_context():
+            start = time.time()
+            try:
+                settle_bet(bettor_id, 7, 1, 6.0)
+            finally:
+                db.session.remove()
+
+            return time.time() - start
+
+    for label, workers in (('Inline hashing', 0),
+                           ('Pooled hashing', original_workers or 2)):
+        app.config['PASSWORD_HASH_WORKERS'] = workers
+        pool = ThreadPool(clients * 2)
+
+        sign_ins = pool.map_async(sign_in, range(logins))
+        bet_timings = np.array(pool.map(place, range(bets))) * 1000
+        sign_ins = sign_ins.get()
+
+        pool.close()
+        pool.join()
+        hasher.reset()
+
+        login_timings = np.array([elapsed for elapsed, _ in sign_ins]) * 1000
+        rejected = len([code for _, code in sign_ins if code == 429])
+
+        click.echo('{0}: bets p50 {1:.1f}ms p99 {2:.1f}ms, sign ins p50 '
+                   '{3:.1f}ms p99 {4:.1f}ms, {5} turned away'.format(
+                       label,
+                       np.percentile(bet_timings, 50),
+                       np.percentile(bet_timings, 99),
+                       np.percentile(login_timings, 50),
+                       np.percentile(login_timings, 99),
+                       rejected))
+
+    app.config['PASSWORD_HASH_WORKERS'] = original_workers
+
+    _delete_bench_user()
+    _delete_bench_user(email=bettor_email)
+
+    return None
+
+
+@click.command()
+@click.option('--users', default=5000000, help='How many users to seed?')
+@click.option('--seed/--no-seed', default=True,
+              help='Seed the users or reuse a previous run\'s users?')
+@click.option('--cleanup/--no-cleanup', default=True,
+              help='Delete the seeded users afterwards?')
+@with_app
+def search(users, seed, cleanup):
+    """
+    Compare the old unindexed search with trigram search and estimated counts
+    on a page of admin search results.
+
+    :return: None
+    """
+    domain = '@bench-search.local'
+
+    if seed:
+        click.echo('Seeding {0} users...'.format(users))
+        db.session.execute(text("""
+            INSERT INTO users (created_on, updated_on, role, is_active,
+                               username, email, password, coins,
+                               sign_in_count, locale)
+            SELECT now() - n * interval '1 second', now(), 'member', true,
+                   'searcher' || n, 'searcher' || n || :domain, '', 100, 0,
+                   'en'
+            FROM generate_series(1, :users) AS n
+        """), {'users': users, 'domain': domain})
+        db.session.commit()
+        db.session.execute('ANALYZE users')
+
+    terms = ('se', 'searcher4242', '4242', 'nobody-at-all')
+
+    for term in terms:
+        pattern = '%{0}%'.format(term)
+        unindexed = User.query.filter(or_(User.email.ilike(pattern),
+                                          User.username.ilike(pattern))) \
+            .order_by(User.email)
+        indexed = User.query.filter(User.search(term)).order_by(User.email)
+
+        start = time.time()
+        unindexed.paginate(1, 50, True)
+        _log_timing('Unindexed "{0}"'.format(term), 1, time.time() - start)
+
+        start = time.time()
+        indexed.paginate(1, 50, True)
+        _log_timing('Trigram "{0}"'.format(term), 1, time.time() - start)
+
+        start = time.time()
+        estimated_paginate(indexed, 1, 50)
+        _log_timing('Trigram estimated "{0}"'.format(term), 1,
+                    time.time() - start)
+
+        click.echo('  {0} matches, estimated {1}'.format(
+            indexed.order_by(None).count(), estimate_count(indexed)))
+
+    if cleanup:
+        db.session.execute(text('DELETE FROM users WHERE email LIKE :email'),
+                           {'email': '%{0}'.format(domain)})
+        db.session.commit()
+
+    return None
+
+
+@click.command()
+@click.option('--invoices', default=10000000, help='How many invoices?')
+@click.option('--format', 'export_format', default='csv',
+              type=click.Choice(['csv', 'ndjson']), help='Export format')
+@with_app
+def export(invoices, export_format):
+    """
+    Write an export of every invoice and report how much memory it took.
+
+    :return: None
+    """
+    user_id = _reset_bench_user(0)
+
+    click.echo('Seeding {0} invoices...'.format(invoices))
+    db.session.execute(text("""
+        INSERT INTO invoices (created_on, updated_on, user_id, plan,
+                              receipt_number, description, currency, tax,
+                              tax_percent, total)
+        SELECT now() - n * interval '1 second', now(), :user_id, 'gold',
+               'bench-' || n, 'Gold monthly', 'usd', 0, 0, 1999
+        FROM generate_series(1, :invoices) AS n
+    """), {'user_id': user_id, 'invoices': invoices})
+    db.session.commit()
+
+    query = Invoice.query.join(User).order_by(Invoice.created_on.desc(),
+                                              Invoice.id)
+    columns = [('id', Invoice.id), ('created_on', Invoice.created_on),
+               ('email', User.email), ('total', Invoice.total)]
+
+    path = os.path.join(tempfile.gettempdir(),
+                        'bench-invoices.{0}'.format(export_format))
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.time()
+    written = write_export(query, columns, export_format, path)
+    elapsed = time.time() - start
+
+    os.remove(path)
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    _log_timing('Export', invoices, elapsed)
+    click.echo('Wrote {0:.1f}MB, peak RSS grew by {1:.1f}MB'.format(
+        written / 1024.0 / 1024.0, (rss_after - rss_before) / 1024.0))
+
+    _delete_bench_user()
+
+    return None
+
+
+@click.command()
+@click.option('--events', default=5000, help='How many events to deliver?')
+@click.option('--clients', default=16, help='Concurrent deliveries')
+@click.option('--duplicates', default=0.2,
+              help='Fraction of deliveries that repeat an earlier event')
+@with_app
+def webhooks(events, clients, duplicates):
+    """
+    Deliver a sustained burst of Stripe webhook events and measure how fast
+    they are acknowledged.
+
+    :return: None
+    """
+    prefix = 'evt_bench_{0}_'.format(int(time.time()))
+    unique = max(1, int(events * (1 - duplicates)))
+    deliveries = ['{0}{1}'.format(prefix, i % unique) for i in range(events)]
+    random.shuffle(deliveries)
+
+    with app.test_request_context():
+        url = url_for('stripe_webhook.event')
+
+    def deliver(event_id):
+        client = app.test_client()
+
+        start = time.time()
+        response = client.post(url, data=json.dumps({'id': event_id}),
+                               content_type='application/json')
+
+        return time.time() - start, response.status_code
+
+    pool = ThreadPool(clients)
+
+    start = time.time()
+    results = pool.map(deliver, deliveries)
+    elapsed = time.time() - start
+
+    pool.close()
+    pool.join()
+
+    timings = np.array([timing for timing, _ in results]) * 1000
+    errors = len([code for _, code in results if code != 200])
+
+    _log_timing('Webhook deliveries', events, elapsed)
+    click.echo('p50 {0:.1f}ms, p99 {1:.1f}ms, {2} error(s)'.format(
+        np.percentile(timings, 50), np.percentile(timings, 99), errors))
+
+    bench_events = WebhookEvent.query \
+        .filter(WebhookEvent.event_id.like('{0}%'.format(prefix)))
+    click.echo('Recorded {0} of {1} unique event(s).'.format(
+        bench_events.count(), unique))
+
+    # They are not real Stripe events, so they could never be processed.
+    bench_events.delete(synchronize_session=False)
+    db.session.commit()
+
+    return None
+
+
+UPCOMING_INVOICE_API = {
+    'object': 'invoice',
+    'date': 1433018770,
+    'amount_due': 500,
+    'customer': 'cus_bench',
+    'lines': {
+        'object': 'list',
+        'data': [{
+            'object': 'line_item',
+            'plan': {
+                'object': 'plan',
+                'id': 'gold',
+                'name': 'Gold',
+                'interval': 'month',
+                'statement_descriptor': 'GOLD MONTHLY'
+            }
+        }]
+    }
+}
+
+
+@click.command()
+@click.option('--requests', default=50, help='Lookups per scenario')
+@click.option('--latency', default=0.3, help='Stand-in Stripe latency')
+@with_app
+def upcoming(requests, latency):
+    """
+    Measure upcoming invoice lookups against a local stand-in for Stripe,
+    uncached and then served fresh and stale from the cache.
+
+    :return: None
+    """
+    customer_id = 'cus_bench'
+    original = (app.config['GATEWAY_CACHE_TTL'],
+                app.config['GATEWAY_CACHE_FRESH_FOR'])
+
+    scenarios = (('Uncached', 0, 300), ('Cached', 60, 300),
+                 ('Stale while revalidating', 60, 0))
+
+    responses = {'/v1/invoices/upcoming': UPCOMING_INVOICE_API}
+
+    try:
+        with FakeStripe(latency, responses), app.app_context():
+            for label, ttl, fresh_for in scenarios:
+                app.config['GATEWAY_CACHE_TTL'] = ttl
+                app.config['GATEWAY_CACHE_FRESH_FOR'] = fresh_for
+                gateway_cache.invalidate(customer_id)
+
+                if ttl:
+                    Invoice.refresh_upcoming(customer_id)
+
+                timings = []
+                for _ in range(requests):
+                    start = time.time()
+                    Invoice.upcoming(customer_id)
+                    timings.append(time.time() - start)
+
+                timings = np.array(timings) * 1000
+                click.echo('{0}: p50 {1:.2f}ms, p99 {2:.2f}ms'.format(
+                    label, np.percentile(timings, 50),
+                    np.percentile(timings, 99)))
+
+            gateway_cache.invalidate(customer_id)
+    finally:
+        app.config['GATEWAY_CACHE_TTL'] = original[0]
+        app.config['GATEWAY_CACHE_FRESH_FOR'] = original[1]
+
+    return None
+
+
+@click.command()
+@click.option('--calls', default=2000, help='How many gateway calls?')
+@click.option('--clients', default=16, help='Concurrent callers')
+@click.option('--latency', default=0.05, help='Stand-in Stripe latency')
+@click.option('--failure-rate', default=0.05,
+              help='Share of calls the stand-in fails with a 503')
+@with_app
+def gateway(calls, clients, latency, failure_rate):
+    """
+    Load a local stand-in for Stripe through the stock HTTP client and then
+    the pooled gateway client, which keeps connections alive and retries
+    failed calls that are safe to send again.
+
+    :return: None
+    """
+    clients_by_label = (
+        ('Stock client', stripe.http_client.RequestsClient()),
+        ('Gateway client', stripe.default_http_client)
+    )
+    original = stripe.default_http_client
+
+    try:
+        for label, http_client in clients_by_label:
+            stripe.default_http_client = http_client
+            transport.reset_latency_stats()
+
+            with FakeStripe(latency) as fake:
+                fake.fail(*[503] * int(calls * failure_rate))
+
+                def call(i):
+                    start = time.time()
+
+                    try:
+                        PaymentEvent.retrieve('evt_bench_{0}'.format(i))
+                        failed = False
+                    except stripe.error.StripeError:
+                        failed = True
+
+                    return time.time() - start, failed
+
+                pool = ThreadPool(clients)
+                start = time.time()
+                results = pool.map(call, range(calls))
+                elapsed = time.time() - start
+                pool.close()
+                pool.join()
+
+                connections = fake.connections
+
+            timings = np.array([timing for timing, _ in results]) * 1000
+            errors = len([failed for _, failed in results if failed])
+
+            _log_timing(label, calls, elapsed)
+            click.echo('p50 {0:.1f}ms, p99 {1:.1f}ms, {2} error(s), {3} '
+                       'connection(s)'.format(np.percentile(timings, 50),
+                                              np.percentile(timings, 99),
+                                              errors, connections))
+
+        for operation, stats in transport.latency_stats().items():
+            click.echo('{0}: {1} request(s), {2} error(s), mean {3:.1f}ms, '
+                       'p99 <= {4:.0f}ms'.format(operation, stats['count'],
+                                                 stats['errors'],
+                                                 stats['mean_ms'],
+                                                 stats['p99_ms']))
+    finally:
+        stripe.default_http_client = original
+
+    return None
+
+
+@click.command()
+@click.option('--requests', default=400, help='How many requests?')
+@click.option('--workers', default=8, help='Simulated web workers')
+@click.option('--billing-share', default=0.2,
+              help='Share of requests that call the payment gateway')
+@click.option('--latency', default=2.0, help='Stand-in Stripe latency')
+@with_app
+def outage(requests, workers, billing_share, latency):
+    """
+    Measure bets while a stand-in Stripe is too slow to be useful, with a
+    bounded pool of workers serving a mix of bets and billing requests the
+    way gunicorn would. Without the breaker billing requests tie up the
+    workers, with it they fail fast once it opens.
+
+    :return: None
+    """
+    bettor_id = _reset_bench_user(requests * 2)
+    every = max(1, int(round(1 / billing_share))) if billing_share else 0
+    original = (app.config['PAYMENT_GATEWAY_BREAKER_ERROR_RATE'],
+                app.config['PAYMENT_GATEWAY_SLOW_CALL'])
+
+    # Calls over a second are failures as far as the breaker is concerned.
+    app.config['PAYMENT_GATEWAY_SLOW_CALL'] = min(1, latency / 2)
+
+    def handle(i):
+        with app.app_context():
+            start = time.time()
+
+            try:
+                if every and i % every == 0:
+                    try:
+                        PaymentInvoice.upcoming('cus_bench')
+                    except stripe.error.StripeError:
+                        pass
+
+                    return 'billing', time.time() - start
+
+                settle_bet(bettor_id, 7, 1, 6.0)
+
+                return 'bet', time.time() - start
+            finally:
+                db.session.remove()
+
+    try:
+        for label, error_rate in (('Without breaker', 0),
+                                  ('With breaker', original[0] or 0.5)):
+            app.config['PAYMENT_GATEWAY_BREAKER_ERROR_RATE'] = error_rate
+
+            with app.app_context():
+                breaker.reset()
+
+            with FakeStripe(latency):
+                pool = ThreadPool(workers)
+                start = time.time()
+                results = pool.map(handle, range(requests))
+                elapsed = time.time() - start
+                pool.close()
+                pool.join()
+
+            bets = np.array([timing for kind, timing in results
+                             if kind == 'bet']) * 1000
+            billing = np.array([timing for kind, timing in results
+                                if kind == 'billing']) * 1000
+
+            _log_timing(label, requests, elapsed)
+            click.echo('bets: {0} at {1:.1f}/s, p99 {2:.1f}ms; billing: '
+                       'p50 {3:.1f}ms'.format(
+                           len(bets), len(bets) / elapsed,
+                           np.percentile(bets, 99),
+                           np.percentile(billing, 50) if len(billing) else 0))
+    finally:
+        app.config['PAYMENT_GATEWAY_BREAKER_ERROR_RATE'] = original[0]
+        app.config['PAYMENT_GATEWAY_SLOW_CALL'] = original[1]
+
+        with app.app_context():
+            breaker.reset()
+
+        _delete_bench_user()
+
+    return None
+
+
+@click.command()
+@click.option('--runs', default=5, help='Fresh processes per scenario')
+@click.option('--profile/--no-profile', default=False,
+              help='Also time every step of creating the app?')
+def startup(runs, profile):
+    """
+    Measure how long web and worker processes take to start and their peak
+    RSS. Workers used to build the Flask app once per task module, the
+    first worker scenario reproduces that for comparison.
+
+    :return: None
+    """
+    if profile:
+        subprocess.check_call([sys.executable, '-c', STARTUP_PROFILE_SCRIPT])
+
+    for label, code in STARTUP_SCENARIOS:
+        results = []
+
+        for _ in range(runs):
+            output = subprocess.check_output(
+                [sys.executable, '-c', STARTUP_SCRIPT.format(code.strip())])
+            results.append(json.loads(output.decode('utf-8').splitlines()[-1]))
+
+        elapsed = np.median([result['elapsed'] for result in results])
+        rss = np.median([result['rss'] for result in results])
+
+        click.echo('{0}: {1:.3f}s to start, peak RSS {2:.1f}MB'.format(
+            label, elapsed, rss / 1024.0))
+
+    return None
+
+
+@click.command()
+@click.option('--messages', default=5000, help='How many e-mails to send?')
+@click.option('--latency', default=0.002, help='Stand-in SMTP latency')
+@with_app
+def mail(messages, latency):
+    """
+    Send e-mails to a local SMTP sink, first opening a connection per e-mail
+    and then in queued batches.
+
+    :return: None
+    """
+    def message(i):
+        return {'subject': 'Bench', 'body': 'Bench e-mail {0}'.format(i),
+                'recipients': ['bench-{0}@local.host'.format(i)]}
+
+    original_key = app.config['MAIL_QUEUE_KEY']
+    app.config['MAIL_QUEUE_KEY'] = 'bench:mail'
+
+    try:
+        with app.app_context():
+            with FakeSMTP(latency) as fake:
+                start = time.time()
+                for i in range(messages):
+                    send_template_message(**message(i))
+                elapsed = time.time() - start
+
+            _log_timing('Connection per e-mail', messages, elapsed)
+            click.echo('{0:.0f} e-mails/minute over {1} connections'.format(
+                messages / elapsed * 60, fake.connections))
+
+            with FakeSMTP(latency) as fake:
+                start = time.time()
+                for i in range(messages):
+                    queue_template_message(**message(i))
+                outcome = deliver_queued_mail()
+                elapsed = time.time() - start
+
+            _log_timing('Batched', messages, elapsed)
+            click.echo('{0:.0f} e-mails/minute over {1} connections, '
+                       '{2}'.format(messages / elapsed * 60, fake.connections,
+                                    outcome))
+    finally:
+        app.config['MAIL_QUEUE_KEY'] = original_key
+
+    return None
+
+
+@click.command()
+@click.option('--errors', default=200, help='How many errors to log?')
+@click.option('--latency', default=0.5, help='Stand-in SMTP latency')
+@with_app
+def errors(errors, latency):
+    """
+    Log a burst of errors the way a failing view does, first e-mailing each
+    one right away and then recording them for a digest.
+
+    :return: None
+    """
+    logger = logging.getLogger('snakeeyes.bench.errors')
+    logger.propagate = False
+    scheduled = []
+
+    with app.app_context():
+        with FakeSMTP(latency) as fake:
+            handlers = (
+                ('SMTP handler', SMTPHandler(('127.0.0.1', fake.port),
+                                             'bench@local.host',
+                                             ['bench@local.host'],
+                                             '[Exception handler] Bench')),
+                ('Digest handler', DigestHandler(
+                    redis, lambda countdown: scheduled.append(countdown),
+                    app.config['ERROR_DIGEST_WINDOW'],
+                    key_prefix='bench:errors'))
+            )
+
+            for label, handler in handlers:
+                logger.addHandler(handler)
+                timings = []
+
+                for i in range(errors):
+                    start = time.time()
+                    try:
+                        1 / 0
+                    except ZeroDivisionError:
+                        logger.exception('Bench error.')
+                    timings.append(time.time() - start)
+
+                logger.removeHandler(handler)
+                timings = np.array(timings) * 1000
+
+                _log_timing(label, errors, timings.sum() / 1000)
+                click.echo('p50 {0:.2f}ms, p99 {1:.2f}ms per error'.format(
+                    np.percentile(timings, 50), np.percentile(timings, 99)))
+
+            click.echo('{0} e-mails sent, {1} digest(s) scheduled'.format(
+                len(fake.messages), len(scheduled)))
+
+    redis.delete('bench:errors:counts', 'bench:errors:samples',
+                 'bench:errors:scheduled')
+
+    return None
+
+
+cli.add_command(settle)
+cli.add_command(batch)
+cli.add_command(dice)
+cli.add_command(rng)
+cli.add_command(history)
+cli.add_command(queries)
+cli.add_command(logins)
+cli.add_command(search)
+cli.add_command(export)
+cli.add_command(webhooks)
+cli.add_command(upcoming)
+cli.add_command(gateway)
+cli.add_command(outage)
+cli.add_command(startup)
+cli.add_command(mail)
+cli.add_command(errors)
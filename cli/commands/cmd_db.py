@@ -2,14 +2,10 @@ import click
 
 from sqlalchemy_utils import database_exists, create_database
 
-from snakeeyes.app import create_app
+from cli.flask_app import app, with_app
 from snakeeyes.extensions import db
 from snakeeyes.blueprints.user.models import User
 
-# Create an app context for the database connection.
-app = create_app()
-db.app = app
-
 
 @click.group()
 def cli():
@@ -20,6 +16,7 @@ def cli():
 @click.command()
 @click.option('--with-testdb/--no-with-testdb', default=False,
               help='Create a test db too?')
+@with_app
 def init(with_testdb):
     """
     Initialize the database.
@@ -40,6 +37,7 @@ def init(with_testdb):
 
 
 @click.command()
+@with_app
 def seed():
     """
     Seed the database with an initial user.
@@ -62,6 +60,7 @@ def seed():
 @click.option('--with-testdb/--no-with-testdb', default=False,
               help='Create a test db too?')
 @click.pass_context
+@with_app
 def reset(ctx, with_testdb):
     """
     Init and seed automatically.
@@ -0,0 +1,31 @@
+import click
+
+from cli.flask_app import app, with_app
+from snakeeyes.blueprints.bet.models import leaderboard
+
+
+@click.group()
+def cli():
+    """ Manage the Redis backed leaderboards. """
+    pass
+
+
+@click.command()
+@click.option('--chunk-size', default=1000, help='Users to load per query')
+@with_app
+def rebuild(chunk_size):
+    """
+    Backfill every current leaderboard from PostgreSQL.
+
+    :return: None
+    """
+    with app.app_context():
+        counts = leaderboard.rebuild(chunk_size=chunk_size)
+
+    for name, count in sorted(counts.items()):
+        click.echo('Ranked {0} users on {1}'.format(count, name))
+
+    return None
+
+
+cli.add_command(rebuild)
@@ -1,8 +1,6 @@
 import click
 
-from snakeeyes.app import create_app
-
-app = create_app()
+from cli.flask_app import app
 
 
 @click.command()
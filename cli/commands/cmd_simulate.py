@@ -0,0 +1,108 @@
+import json
+import multiprocessing
+import time
+
+import click
+
+from config import settings
+from snakeeyes.blueprints.bet.models.simulation import simulate_chunk
+
+
+def _echo_report(results, wager, payout_tables, bets_per_table, elapsed):
+    """
+    Print the house edge, variance and ruin probability for every guess.
+
+    :param results: Running totals for each table and guess
+    :type results: dict
+    :param wager: Coins wagered per bet
+    :type wager: int
+    :param payout_tables: Payout tables being simulated
+    :type payout_tables: dict
+    :param bets_per_table: Total bets that will be simulated per table
+    :type bets_per_table: int
+    :param elapsed: Seconds since the simulation started
+    :type elapsed: float
+    :return: None
+    """
+    for name in sorted(results):
+        bets_done = int(next(iter(results[name].values()))[0])
+
+        click.echo('\n{0}: {1:,} / {2:,} bets per guess ({3:.1f}s)'.format(
+            name, bets_done, bets_per_table, elapsed))
+        click.echo('{0:>5} {1:>8} {2:>12} {3:>14} {4:>10}'.format(
+            'Guess', 'Payout', 'House edge', 'Variance', 'Ruin'))
+
+        for guess, total in sorted(results[name].items()):
+            count, net, net_squared, sessions, ruined = total
+            mean = net / count
+
+            click.echo('{0:>5} {1:>7}x {2:>11.3f}% {3:>14.2f} {4:>9.2f}%'
+                       .format(guess,
+                               payout_tables[name][str(guess)],
+                               -mean / wager * 100,
+                               net_squared / count - mean ** 2,
+                               ruined / sessions * 100 if sessions else 0))
+
+    return None
+
+
+@click.command()
+@click.option('--bets', default=100000000,
+              help='How many bets to simulate per guess and payout table?')
+@click.option('--payouts', type=click.File('r'),
+              help='JSON file of named payout tables to compare, defaults to '
+                   'DICE_ROLL_PAYOUT')
+@click.option('--wager', default=10, help='Coins wagered per bet')
+@click.option('--bankroll', default=1000,
+              help='Coins a player starts a session with')
+@click.option('--rounds', default=1000, help='Bets placed per session')
+@click.option('--chunk-size', default=1000000, help='Bets per worker task')
+@click.option('--workers', default=multiprocessing.cpu_count(),
+              help='How many processes to simulate with?')
+@click.option('--report-every', default=2.0,
+              help='Seconds between partial results')
+def cli(bets, payouts, wager, bankroll, rounds, chunk_size, workers,
+        report_every):
+    """
+    Simulate bets to estimate the house edge of payout tables.
+
+    :return: None
+    """
+    if payouts:
+        payout_tables = json.load(payouts)
+    else:
+        payout_tables = {'DICE_ROLL_PAYOUT': settings.DICE_ROLL_PAYOUT}
+
+    # Whole sessions have to fit in a chunk to measure the ruin probability.
+    chunk_size = max(rounds, chunk_size - chunk_size % rounds)
+
+    tasks = []
+    for name, table in payout_tables.items():
+        for start in range(0, bets, chunk_size):
+            count = min(chunk_size, bets - start)
+            tasks.append((name, table, count, wager, bankroll, rounds))
+
+    results = {}
+    pool = multiprocessing.Pool(workers)
+
+    start = time.time()
+    last_report = start
+
+    try:
+        for name, totals in pool.imap_unordered(simulate_chunk, tasks):
+            table_results = results.setdefault(name, {})
+
+            for guess, total in totals.items():
+                table_results[guess] = table_results.get(guess, 0) + total
+
+            if time.time() - last_report >= report_every:
+                last_report = time.time()
+                _echo_report(results, wager, payout_tables, bets,
+                             last_report - start)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    _echo_report(results, wager, payout_tables, bets, time.time() - start)
+
+    return None
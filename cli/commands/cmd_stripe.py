@@ -1,13 +1,8 @@
 import click
 
-from snakeeyes.app import create_app
-from snakeeyes.extensions import db
+from cli.flask_app import app, with_app
 from snakeeyes.blueprints.billing.gateways.stripecom import Plan as PaymentPlan
 
-# Create an app context for the database connection.
-app = create_app()
-db.app = app
-
 
 @click.group()
 def cli():
@@ -16,6 +11,7 @@ def cli():
 
 
 @click.command()
+@with_app
 def sync_plans():
     """
     Sync (upsert) STRIPE_PLANS to Stripe.
@@ -42,6 +38,7 @@ def sync_plans():
 
 @click.command()
 @click.argument('plan_ids', nargs=-1)
+@with_app
 def delete_plans(plan_ids):
     """
     Delete 1 or more plans from Stripe.
@@ -55,6 +52,7 @@ def delete_plans(plan_ids):
 
 
 @click.command()
+@with_app
 def list_plans():
     """
     List all existing plans on Stripe.
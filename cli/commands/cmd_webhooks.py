@@ -0,0 +1,54 @@
+import click
+
+from cli.flask_app import app, with_app
+from snakeeyes.blueprints.billing.models.webhook_event import WebhookEvent
+
+
+@click.group()
+def cli():
+    """ Manage delivered Stripe webhook events. """
+    pass
+
+
+@click.command()
+@click.option('--status', '-s', multiple=True,
+              type=click.Choice(['failed', 'processing', 'processed']),
+              default=['failed'], help='Replay events with this status')
+@click.option('--event-id', '-e', multiple=True,
+              help='Only replay this Stripe event id')
+@click.option('--now/--later', default=True,
+              help='Process them now or leave them for the workers?')
+@with_app
+def replay(status, event_id, now):
+    """
+    Queue up delivered events to be processed again, such as after fixing
+    whatever made them fail. Events stuck processing because a worker died
+    can be replayed with --status processing.
+
+    Replaying processed events grants their coins again, so only do that
+    for specific events with --event-id.
+
+    :return: None
+    """
+    if 'processed' in status and not event_id:
+        raise click.UsageError('Processed events can only be replayed by id.')
+
+    with app.app_context():
+        replay_count = WebhookEvent.replay(event_ids=event_id,
+                                           statuses=status)
+        click.echo('Queued up {0} event(s).'.format(replay_count))
+
+        if now:
+            while True:
+                outcome = WebhookEvent.process_pending()
+
+                if not outcome['processed'] and not outcome['failed']:
+                    break
+
+                click.echo('Processed {processed}, failed {failed}.'
+                           .format(**outcome))
+
+    return None
+
+
+cli.add_command(replay)
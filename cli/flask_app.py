@@ -0,0 +1,48 @@
+import functools
+
+from werkzeug.local import LocalProxy
+
+_app = None
+
+
+def get_app():
+    """
+    Create the Flask app the first time a command needs it, listing commands
+    or running one that doesn't touch the app never pays for creating it.
+
+    :return: Flask app
+    """
+    global _app
+
+    if _app is None:
+        from snakeeyes.app import create_app
+        from snakeeyes.extensions import db
+
+        _app = create_app()
+
+        # Create an app context for the database connection.
+        db.app = _app
+
+    return _app
+
+
+app = LocalProxy(get_app)
+
+
+def with_app(f):
+    """
+    Create the app before running a command. Click only calls a command
+    once its arguments were parsed, so asking for a command's --help never
+    creates the app.
+
+    :param f: Command callback
+    :type f: function
+    :return: Function
+    """
+    @functools.wraps(f)
+    def decorated_function(*args, **kwargs):
+        get_app()
+
+        return f(*args, **kwargs)
+
+    return decorated_function
@@ -3,3 +3,14 @@
 bind = '0.0.0.0:8000'
 accesslog = '-'
 access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s" in %(D)sµs'
+
+
+def post_fork(server, worker):
+    # Every worker needs its own dice rolls, never the ones that may have been
+    # buffered by the master process before it forked.
+    from snakeeyes.blueprints.bet.models.dice import rolls
+    rolls.reset()
+
+    # Likewise every worker hashes passwords in its own pool of processes.
+    from snakeeyes.blueprints.user.passwords import hasher
+    hasher.reset()
@@ -8,6 +8,7 @@ LOG_LEVEL = 'DEBUG'  # CRITICAL / ERROR / WARNING / INFO / DEBUG
 
 SERVER_NAME = 'localhost:8000'
 SECRET_KEY = 'insecurekeyfordev'
+STARTUP_PROFILE = False  # Write how long creating the app took to stderr.
 
 # Flask-Mail.
 MAIL_DEFAULT_SENDER = 'contact@local.host'
@@ -17,6 +18,19 @@ MAIL_USE_TLS = True
 MAIL_USE_SSL = False
 MAIL_USERNAME = 'you@gmail.com'
 MAIL_PASSWORD = 'awesomepassword'
+MAIL_QUEUE_KEY = 'mail:queue'
+MAIL_BATCH_SIZE = 100  # E-mails sent per SMTP connection.
+MAIL_BATCH_WINDOW = 2  # Seconds queued e-mails wait for others to join them.
+MAIL_RETRY_DELAY = 60  # Seconds before temporary failures are tried again.
+MAIL_MAX_ATTEMPTS = 5
+MAIL_PROCESSING_TIMEOUT = 300  # Seconds before a claimed batch is stale.
+ERROR_DIGEST_KEY = 'errors'
+ERROR_DIGEST_WINDOW = 300  # Seconds of errors e-mailed in 1 digest.
+ERROR_DIGEST_MAX_ERRORS = 25  # Different errors listed per digest.
+
+# Admin exports, the web and Celery workers must share this folder.
+EXPORT_FOLDER = '/snakeeyes/instance/exports'
+EXPORT_MAX_AGE = 86400  # Seconds.
 
 # Flask-Babel.
 LANGUAGES = {
@@ -26,8 +40,11 @@ LANGUAGES = {
 }
 BABEL_DEFAULT_LOCALE = 'en'
 
+# Redis.
+REDIS_URL = 'redis://:devpassword@redis:6379/0'
+
 # Celery.
-CELERY_BROKER_URL = 'redis://:devpassword@redis:6379/0'
+CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = CELERY_BROKER_URL
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
@@ -42,6 +59,22 @@ CELERYBEAT_SCHEDULE = {
         'task': 'snakeeyes.blueprints.billing.tasks.expire_old_coupons',
         'schedule': crontab(hour=0, minute=1)
     },
+    'refresh-dashboard': {
+        'task': 'snakeeyes.blueprints.admin.tasks.refresh_dashboard',
+        'schedule': crontab(minute='*/5')
+    },
+    'delete-exports': {
+        'task': 'snakeeyes.blueprints.admin.tasks.delete_exports',
+        'schedule': crontab(minute=30)
+    },
+    'deliver-queued-mail': {
+        'task': 'snakeeyes.blueprints.user.tasks.deliver_queued_mail',
+        'schedule': crontab(minute='*')
+    },
+    'process-webhook-events': {
+        'task': 'snakeeyes.blueprints.billing.tasks.process_webhook_events',
+        'schedule': crontab(minute='*')
+    },
 }
 
 # SQLAlchemy.
@@ -53,12 +86,44 @@ SQLALCHEMY_TRACK_MODIFICATIONS = False
 SEED_ADMIN_EMAIL = 'dev@local.host'
 SEED_ADMIN_PASSWORD = 'devpassword'
 REMEMBER_COOKIE_DURATION = timedelta(days=90)
+USER_CACHE_TTL = 120  # Seconds, 0 disables caching users in Redis.
+AUTH_TOKEN_CACHE_TTL = 300  # Seconds, 0 disables caching verified tokens.
+PASSWORD_HASH_METHOD = 'pbkdf2:sha1:1000'
+PASSWORD_HASH_WORKERS = 2  # Processes per app worker, 0 hashes inline.
+PASSWORD_HASH_MAX_PENDING = 8  # Across every app worker.
+PASSWORD_HASH_SLOTS_KEY = 'password_hashing'
+PASSWORD_HASH_TIMEOUT = 5  # Seconds.
+USER_DELETE_CHUNK_SIZE = 500
 
 # Billing.
 STRIPE_SECRET_KEY = None
 STRIPE_PUBLISHABLE_KEY = None
 STRIPE_API_VERSION = '2016-03-07'
 STRIPE_CURRENCY = 'usd'
+PAYMENT_GATEWAY_WORKERS = 8  # Concurrent calls during bulk actions.
+PAYMENT_GATEWAY_RETRIES = 3
+PAYMENT_GATEWAY_BACKOFF = 0.5  # Seconds before the first retry.
+PAYMENT_GATEWAY_POOL_SIZE = 10  # Keep-alive connections per process.
+PAYMENT_GATEWAY_HTTP_RETRIES = 2  # Retries of requests safe to send twice.
+PAYMENT_GATEWAY_CONNECT_TIMEOUT = 3.05  # Seconds to connect to Stripe.
+PAYMENT_GATEWAY_TIMEOUTS = {  # Seconds to wait on a response, by operation.
+    'default': 10,
+    'charges.post': 30,
+    'customers.post': 20,
+    'events.get': 5,
+    'invoices.get': 5
+}
+PAYMENT_GATEWAY_SLOW_CALL = 5  # Seconds before a call counts as failed.
+PAYMENT_GATEWAY_BREAKER_ERROR_RATE = 0.5  # Share of failed calls, 0 disables.
+PAYMENT_GATEWAY_BREAKER_MIN_CALLS = 10  # Calls in a window before it opens.
+PAYMENT_GATEWAY_BREAKER_WINDOW = 30  # Seconds of calls it looks at.
+PAYMENT_GATEWAY_BREAKER_COOLDOWN = 30  # Seconds open before a trial call.
+PAYMENT_GATEWAY_BREAKER_KEY_PREFIX = 'gateway:breaker'
+PAYMENT_GATEWAY_LATENCY_KEY_PREFIX = 'gateway:latency'
+COUPON_DELETE_CHUNK_SIZE = 500
+WEBHOOK_BATCH_SIZE = 100  # Stripe events processed per task.
+GATEWAY_CACHE_TTL = 86400  # Seconds, 0 disables caching Stripe responses.
+GATEWAY_CACHE_FRESH_FOR = 300  # Seconds before a refresh gets queued up.
 STRIPE_PLANS = {
     '0': {
         'id': 'bronze',
@@ -123,6 +188,12 @@ DICE_ROLL_PAYOUT = {
     '11': 18.0,
     '12': 36.0
 }
+BET_BATCH_MAX_BETS = 1000
+BET_BATCH_MAX_WAGER = 10 ** 12  # Coins per bet, keeps payouts within 64 bits.
+
+# Leaderboard.
+LEADERBOARD_KEY_PREFIX = 'leaderboard'
+LEADERBOARD_PER_PAGE = 25
 
 RATELIMIT_STORAGE_URL = CELERY_BROKER_URL
 RATELIMIT_STRATEGY = 'fixed-window-elastic-expiry'
@@ -0,0 +1,113 @@
+import hashlib
+import logging
+
+
+class DigestHandler(logging.Handler):
+    """
+    A logging handler that never sends e-mail from the request that logged
+    the error. Errors get counted in Redis by their traceback and the first
+    one in a window schedules a digest of every error logged during it, so a
+    burst of identical errors turns into a single e-mail.
+    """
+
+    def __init__(self, redis, schedule, window, key_prefix='errors',
+                 level=logging.ERROR):
+        """
+        :param redis: Redis client
+        :param schedule: Queue up a digest, such as a Celery task's
+          apply_async, it gets called with a countdown once per window
+        :type schedule: function
+        :param window: Seconds errors get gathered up for
+        :type window: int
+        :param key_prefix: Prefix of the Redis keys
+        :type key_prefix: str
+        """
+        super(DigestHandler, self).__init__(level)
+
+        self.redis = redis
+        self.schedule = schedule
+        self.window = window
+        self.key_prefix = key_prefix
+
+    def signature(self, record):
+        """
+        Identify a record, records with the same traceback (or message when
+        there is none) are the same error.
+
+        :param record: Log record
+        :type record: logging.LogRecord
+        :return: str
+        """
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info)
+
+            text = record.exc_text
+        else:
+            text = record.getMessage()
+
+        # Python 2 messages can already be bytes, hash those as they are.
+        if not isinstance(text, bytes):
+            text = text.encode('utf-8')
+
+        return hashlib.sha1(text).hexdigest()
+
+    def emit(self, record):
+        try:
+            signature = self.signature(record)
+
+            pipeline = self.redis.pipeline(transaction=False)
+            pipeline.hincrby(key(self.key_prefix, 'counts'), signature, 1)
+            pipeline.hsetnx(key(self.key_prefix, 'samples'), signature,
+                            self.format(record))
+            pipeline.set(key(self.key_prefix, 'scheduled'), 1, nx=True,
+                         ex=max(1, self.window))
+
+            if pipeline.execute()[2]:
+                self.schedule(countdown=self.window)
+        except Exception:
+            self.handleError(record)
+
+
+def key(key_prefix, name):
+    """
+    Return the Redis key of part of the error digest.
+
+    :param key_prefix: Prefix of the Redis keys
+    :type key_prefix: str
+    :param name: What the key holds, such as counts
+    :type name: str
+    :return: str
+    """
+    return '{0}:{1}'.format(key_prefix, name)
+
+
+def collect(redis, key_prefix='errors', limit=None):
+    """
+    Take every error recorded since the last digest, the most frequent first.
+
+    :param redis: Redis client
+    :param key_prefix: Prefix of the Redis keys
+    :type key_prefix: str
+    :param limit: Only return this many distinct errors
+    :type limit: int
+    :return: Tuple of the total amount of errors and a list of
+      (count, sample) tuples
+    """
+    counts_key = key(key_prefix, 'counts')
+    samples_key = key(key_prefix, 'samples')
+
+    # Both are read and cleared at once so no error gets lost or counted twice.
+    pipeline = redis.pipeline()
+    pipeline.hgetall(counts_key)
+    pipeline.hgetall(samples_key)
+    pipeline.delete(counts_key, samples_key)
+    counts, samples, _ = pipeline.execute()
+
+    errors = sorted(((int(count), samples.get(signature, b'')
+                      .decode('utf-8'))
+                     for signature, count in counts.items()),
+                    key=lambda error: error[0], reverse=True)
+
+    return sum(count for count, _ in errors), errors[:limit]
@@ -0,0 +1,303 @@
+import json
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import StreamRequestHandler, TCPServer, ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import StreamRequestHandler, TCPServer, ThreadingMixIn
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+import stripe
+from flask import current_app
+
+
+class _ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that timed out hang up before they get a response.
+        pass
+
+
+class FakeStripe(object):
+    """
+    A local stand-in for Stripe's API. Every connection is served on its own
+    thread and kept alive like the real thing, so it holds up under load.
+
+    It answers with the response registered for a path or an empty object,
+    after waiting latency seconds. Queued up failures are answered first and
+    every request fails while it is down. Requests with an idempotency key
+    that was seen before get the same response back.
+
+    Use it as a context manager to point the Stripe library at it.
+    """
+
+    def __init__(self, latency=0, responses=None):
+        self.latency = latency
+        self.responses = responses or {}
+        self.requests = []
+        self.connections = 0
+
+        # Answer every request with this error status while it is set.
+        self.down = None
+
+        self._failures = []
+        self._replies = {}
+        self._lock = threading.Lock()
+        self._original = None
+        self._server = self._start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self._server.server_port)
+
+    def fail(self, *statuses):
+        """
+        Answer the next requests with these error statuses.
+
+        :return: None
+        """
+        with self._lock:
+            self._failures.extend(statuses)
+
+        return None
+
+    def reply(self, handler):
+        """
+        Work out the status and body of a request.
+
+        :param handler: Request handler
+        :return: Tuple of the status code and body
+        """
+        path = urlparse(handler.path).path
+        key = handler.headers.get('Idempotency-Key')
+
+        with self._lock:
+            self.requests.append((handler.command, path, key))
+
+            if self._failures or self.down:
+                error = {'error': {'type': 'api_error',
+                                   'message': 'Stripe is having a bad day.'}}
+                status = self._failures.pop(0) if self._failures else self.down
+
+                return status, error
+
+            if key and key in self._replies:
+                return self._replies[key]
+
+            reply = 200, self.responses.get(path, {'id': 'fake'})
+
+            if key:
+                self._replies[key] = reply
+
+            return reply
+
+    def _start(self):
+        """
+        Start serving in the background.
+
+        :return: HTTP server
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+
+                with fake._lock:
+                    fake.connections += 1
+
+            def respond(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self.rfile.read(length)
+
+                time.sleep(fake.latency)
+                status, body = fake.reply(self)
+                body = json.dumps(body).encode('utf-8')
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_DELETE = respond
+
+            def log_message(self, *args):
+                pass
+
+        server = _ThreadedHTTPServer(('127.0.0.1', 0), Handler)
+
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        return server
+
+    def stop(self):
+        """
+        Stop serving.
+
+        :return: None
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+        return None
+
+    def __enter__(self):
+        self._original = stripe.api_base, stripe.api_key
+        stripe.api_base = self.url
+        stripe.api_key = 'sk_test_fake'
+
+        return self
+
+    def __exit__(self, *args):
+        stripe.api_base, stripe.api_key = self._original
+        self.stop()
+
+
+class _ThreadedTCPServer(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # Clients may hang up in the middle of a conversation.
+        pass
+
+
+class FakeSMTP(object):
+    """
+    A local SMTP sink that speaks just enough SMTP for Flask-Mail. Every
+    connection is served on its own thread and kept open until the client
+    quits, so it holds up under load.
+
+    Recipients in refuse get rejected with their status code, everything
+    else is accepted after waiting latency seconds per message.
+
+    Use it as a context manager to point the app's Flask-Mail at it.
+    """
+
+    def __init__(self, latency=0, refuse=None):
+        self.latency = latency
+        self.refuse = refuse or {}
+        self.messages = []
+        self.connections = 0
+
+        self._lock = threading.Lock()
+        self._state = None
+        self._original = None
+        self._server = self._start()
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def _start(self):
+        """
+        Start serving in the background.
+
+        :return: TCP server
+        """
+        fake = self
+
+        class Handler(StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write('{0}\r\n'.format(line).encode('utf-8'))
+                self.wfile.flush()
+
+            def handle(self):
+                with fake._lock:
+                    fake.connections += 1
+
+                recipients = []
+                self.reply('220 fake ESMTP')
+
+                for line in iter(self.rfile.readline, b''):
+                    command = line.decode('utf-8').strip()
+                    verb = command[:4].upper()
+
+                    if verb in ('EHLO', 'HELO'):
+                        self.reply('250 fake')
+                    elif verb == 'MAIL':
+                        recipients = []
+                        self.reply('250 OK')
+                    elif verb == 'RCPT':
+                        address = command.split(':', 1)[1].strip().strip('<>')
+                        code = fake.refuse.get(address)
+
+                        if code:
+                            self.reply('{0} Refused'.format(code))
+                        else:
+                            recipients.append(address)
+                            self.reply('250 OK')
+                    elif verb == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        data = []
+
+                        for data_line in iter(self.rfile.readline, b''):
+                            if data_line.rstrip(b'\r\n') == b'.':
+                                break
+                            data.append(data_line)
+
+                        time.sleep(fake.latency)
+
+                        with fake._lock:
+                            fake.messages.append((recipients,
+                                                  b''.join(data)))
+
+                        self.reply('250 OK')
+                    elif verb == 'QUIT':
+                        self.reply('221 Bye')
+                        break
+                    else:
+                        self.reply('250 OK')
+
+        server = _ThreadedTCPServer(('127.0.0.1', 0), Handler)
+
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        return server
+
+    def stop(self):
+        """
+        Stop serving.
+
+        :return: None
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+        return None
+
+    def __enter__(self):
+        self._state = current_app.extensions['mail']
+        self._original = (self._state.server, self._state.port,
+                          self._state.use_tls, self._state.use_ssl,
+                          self._state.username, self._state.suppress)
+
+        self._state.server = '127.0.0.1'
+        self._state.port = self.port
+        self._state.use_tls = False
+        self._state.use_ssl = False
+        self._state.username = None
+        self._state.suppress = False
+
+        return self
+
+    def __exit__(self, *args):
+        (self._state.server, self._state.port, self._state.use_tls,
+         self._state.use_ssl, self._state.username,
+         self._state.suppress) = self._original
+        self.stop()
@@ -1,7 +1,25 @@
-from flask import render_template
+import json
+import smtplib
+import socket
+import time
+import uuid
 
-from snakeeyes.extensions import mail
+from flask import current_app, render_template
+from flask_mail import Message
+from redis import RedisError
 
+from snakeeyes.extensions import mail, redis
+
+# Moves due retries (KEYS[1]) onto the queue (KEYS[2]) in one step, so a
+# crash can neither lose them nor requeue them twice.
+REQUEUE_DUE_RETRIES = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], 0, ARGV[1])
+for _, message in ipairs(due) do
+    redis.call('LPUSH', KEYS[2], message)
+    redis.call('ZREM', KEYS[1], message)
+end
+return #due
+"""
 
 def send_template_message(template=None, ctx=None, *args, **kwargs):
     """
@@ -35,6 +53,205 @@ def send_template_message(template=None, ctx=None, *args, **kwargs):
     :param context: Dictionary of anything you want in the template context
     :return: None
     """
+    _render_message(template, ctx, kwargs)
+    mail.send_message(*args, **kwargs)
+
+    return None
+
+
+def queue_template_message(template=None, ctx=None, schedule=None, **kwargs):
+    """
+    Queue up a templated e-mail, it gets sent along with other queued e-mails
+    in a batch over a single SMTP connection by deliver_queued_messages.
+
+    It takes the same arguments as send_template_message, except they must
+    be keyword arguments that can be serialized to JSON. Templates get
+    rendered right away so retries never render them again.
+
+    If the queue is unreachable the e-mail gets sent right away instead.
+
+    :param template: Path to a template without the extension
+    :param ctx: Dictionary of anything you want in the template context
+    :param schedule: Queue up a delivery, such as a Celery task's
+      apply_async, it gets called with a countdown at most once per
+      MAIL_BATCH_WINDOW
+    :type schedule: function
+    :return: None
+    """
+    _render_message(template, ctx, kwargs)
+
+    entry = json.dumps({'queued_on': time.time(), 'attempts': 0,
+                        'message': kwargs})
+
+    try:
+        redis.lpush(current_app.config['MAIL_QUEUE_KEY'], entry)
+    except RedisError:
+        current_app.logger.exception('Could not queue an e-mail, sending it '
+                                     'right away.')
+        mail.send_message(**kwargs)
+
+        return None
+
+    if schedule and _claim_delivery():
+        schedule(countdown=current_app.config['MAIL_BATCH_WINDOW'])
+
+    return None
+
+
+def deliver_queued_messages(batch_size=None):
+    """
+    Claim a batch of queued e-mails and send them over one SMTP connection.
+
+    Claimed e-mails are moved onto a processing list rather than being
+    removed from Redis, and each one is only acknowledged once it was sent,
+    retried or given up on. If a worker dies halfway through a batch, the
+    e-mails it never acknowledged get queued up again once the batch is
+    older than MAIL_PROCESSING_TIMEOUT.
+
+    Recipients that were refused with a temporary (4xx) error, and e-mails
+    that were cut off by a lost connection or failed to send for any other
+    reason, get queued up again after MAIL_RETRY_DELAY until they were
+    tried MAIL_MAX_ATTEMPTS times.
+
+    :param batch_size: E-mails to claim, defaults to MAIL_BATCH_SIZE
+    :type batch_size: int
+    :return: dict of how many e-mails were sent, retried and failed
+    """
+    queue_key = current_app.config['MAIL_QUEUE_KEY']
+    batch_size = batch_size or current_app.config['MAIL_BATCH_SIZE']
+    outcome = {'sent': 0, 'retried': 0, 'failed': 0}
+
+    _requeue_due_retries(queue_key)
+    _requeue_stale_batches(queue_key)
+
+    batch_key = '{0}:processing:{1}'.format(queue_key, uuid.uuid4().hex)
+    claimed = _claim_batch(queue_key, batch_key, batch_size)
+
+    if not claimed:
+        _release_batch(queue_key, batch_key)
+        return outcome
+
+    done = 0
+    start = time.time()
+
+    try:
+        with mail.connect() as connection:
+            for raw_entry in claimed:
+                _deliver(connection, queue_key, batch_key, raw_entry,
+                         outcome)
+                done += 1
+    except (smtplib.SMTPException, socket.error):
+        current_app.logger.exception('Lost the SMTP connection after %s of %s '
+                                     'queued e-mails.', done, len(claimed))
+
+        for raw_entry in claimed[done:]:
+            entry = _read(raw_entry, outcome)
+            retries = []
+
+            if entry is not None:
+                _retry(entry, entry['message'].get('recipients'), retries,
+                       outcome)
+
+            _acknowledge(queue_key, batch_key, raw_entry, retries)
+
+    _release_batch(queue_key, batch_key)
+
+    current_app.logger.info('Mail batch: %s sent, %s retried, %s failed in '
+                            '%.3fs.', outcome['sent'], outcome['retried'],
+                            outcome['failed'], time.time() - start)
+
+    return outcome
+
+
+def _deliver(connection, queue_key, batch_key, raw_entry, outcome):
+    """
+    Send a claimed e-mail and acknowledge it, a lost connection is left
+    to the caller (mutates the outcome passed in).
+
+    :param connection: Open SMTP connection
+    :type connection: Flask-Mail connection
+    :param queue_key: Redis key of the queue
+    :type queue_key: str
+    :param batch_key: Redis key of the batch it was claimed in
+    :type batch_key: str
+    :param raw_entry: Queued e-mail as it was stored
+    :type raw_entry: bytes
+    :param outcome: How many e-mails were sent, retried and failed
+    :type outcome: dict
+    :return: None
+    """
+    entry = _read(raw_entry, outcome)
+    retries = []
+
+    if entry is None:
+        _acknowledge(queue_key, batch_key, raw_entry, retries)
+
+        return None
+
+    recipients = entry['message'].get('recipients')
+
+    try:
+        connection.send(Message(**entry['message']))
+        outcome['sent'] += 1
+    except smtplib.SMTPRecipientsRefused as e:
+        _retry(entry, _temporary_failures(e.recipients), retries, outcome)
+    except smtplib.SMTPResponseException as e:
+        temporary = 400 <= e.smtp_code < 500
+        _retry(entry, recipients if temporary else [], retries, outcome)
+    except (smtplib.SMTPServerDisconnected, socket.error):
+        raise
+    except Exception:
+        current_app.logger.exception('Could not send a queued e-mail to %s.',
+                                     recipients)
+        _retry(entry, recipients, retries, outcome)
+
+    _acknowledge(queue_key, batch_key, raw_entry, retries)
+
+    return None
+
+
+def _read(raw_entry, outcome):
+    """
+    Decode a claimed e-mail, one that can't be read is given up on right
+    away since retrying it would never help (mutates the outcome passed in).
+
+    :param raw_entry: Queued e-mail as it was stored
+    :type raw_entry: bytes
+    :param outcome: How many e-mails were sent, retried and failed
+    :type outcome: dict
+    :return: dict or None
+    """
+    try:
+        entry = json.loads(raw_entry.decode('utf-8'))
+    except ValueError:
+        entry = None
+
+    if not isinstance(entry, dict) or \
+            not isinstance(entry.get('message'), dict):
+        current_app.logger.error('Dropped a queued e-mail that could not be '
+                                 'read: %r', raw_entry)
+        outcome['failed'] += 1
+
+        return None
+
+    entry.setdefault('attempts', 0)
+
+    return entry
+
+
+def _render_message(template, ctx, kwargs):
+    """
+    Render the text and html body of an e-mail from a template
+    (mutates the kwargs passed in).
+
+    :param template: Path to a template without the extension
+    :type template: str
+    :param ctx: Dictionary of anything you want in the template context
+    :type ctx: dict
+    :param kwargs: Flask-Mail message arguments
+    :type kwargs: dict
+    :return: None
+    """
     if ctx is None:
         ctx = {}
 
@@ -47,7 +264,179 @@ def send_template_message(template=None, ctx=None, *args, **kwargs):
         kwargs['body'] = _try_renderer_template(template, **ctx)
         kwargs['html'] = _try_renderer_template(template, ext='html', **ctx)
 
-    mail.send_message(*args, **kwargs)
+    return None
+
+
+def _claim_delivery():
+    """
+    Make sure only 1 delivery of queued e-mails gets scheduled per batch
+    window, e-mails queued up in the meantime go out with it.
+
+    :return: bool
+    """
+    lock_key = '{0}:scheduled'.format(current_app.config['MAIL_QUEUE_KEY'])
+    window = current_app.config['MAIL_BATCH_WINDOW']
+
+    try:
+        return bool(redis.set(lock_key, 1, nx=True, ex=max(1, window)))
+    except RedisError:
+        return False
+
+
+def _temporary_failures(refused):
+    """
+    Pick the recipients that were refused with a temporary error.
+
+    :param refused: Refused recipients and their SMTP code and message
+    :type refused: dict
+    :return: list
+    """
+    return [recipient for recipient, (code, _) in refused.items()
+            if 400 <= code < 500]
+
+
+def _retry(entry, recipients, retries, outcome):
+    """
+    Try a queued e-mail again later for these recipients, unless there are
+    none or it ran out of attempts (mutates the retries and outcome passed
+    in).
+
+    :param entry: Queued e-mail
+    :type entry: dict
+    :param recipients: Recipients to try again
+    :type recipients: list
+    :param retries: E-mails to try again
+    :type retries: list
+    :param outcome: How many e-mails were sent, retried and failed
+    :type outcome: dict
+    :return: None
+    """
+    entry['attempts'] += 1
+
+    if not recipients or \
+            entry['attempts'] >= current_app.config['MAIL_MAX_ATTEMPTS']:
+        current_app.logger.error('Gave up on an e-mail to %s after %s '
+                                 'attempts.',
+                                 entry['message'].get('recipients'),
+                                 entry['attempts'])
+        outcome['failed'] += 1
+
+        return None
+
+    # Everyone else already got it.
+    entry['message'].update(recipients=recipients, cc=[], bcc=[])
+    retries.append(entry)
+    outcome['retried'] += 1
+
+    return None
+
+
+def _claim_batch(queue_key, batch_key, batch_size):
+    """
+    Move the oldest queued e-mails onto a batch's processing list, the batch
+    is registered in the same transaction so it can never go unnoticed.
+
+    :param queue_key: Redis key of the queue
+    :type queue_key: str
+    :param batch_key: Redis key of the batch's processing list
+    :type batch_key: str
+    :param batch_size: E-mails to claim
+    :type batch_size: int
+    :return: List of the claimed e-mails as they were stored
+    """
+    pipeline = redis.pipeline()
+    pipeline.zadd('{0}:processing'.format(queue_key), time.time(), batch_key)
+
+    for _ in range(batch_size):
+        pipeline.rpoplpush(queue_key, batch_key)
+
+    return [raw_entry for raw_entry in pipeline.execute()[1:]
+            if raw_entry is not None]
+
+
+def _acknowledge(queue_key, batch_key, raw_entry, retries):
+    """
+    Remove a handled e-mail from its batch and park the ones to try again
+    until their retry is due, both happen at once so nothing gets lost.
+
+    :param queue_key: Redis key of the queue
+    :type queue_key: str
+    :param batch_key: Redis key of the batch it was claimed in
+    :type batch_key: str
+    :param raw_entry: Queued e-mail as it was stored
+    :type raw_entry: bytes
+    :param retries: E-mails to try again
+    :type retries: list
+    :return: None
+    """
+    due_on = time.time() + current_app.config['MAIL_RETRY_DELAY']
+
+    pipeline = redis.pipeline()
+    for entry in retries:
+        pipeline.zadd('{0}:retry'.format(queue_key), due_on,
+                      json.dumps(entry))
+    pipeline.lrem(batch_key, 1, raw_entry)
+    pipeline.execute()
+
+    return None
+
+
+def _release_batch(queue_key, batch_key):
+    """
+    Forget a batch once every e-mail in it was acknowledged.
+
+    :param queue_key: Redis key of the queue
+    :type queue_key: str
+    :param batch_key: Redis key of the batch's processing list
+    :type batch_key: str
+    :return: None
+    """
+    pipeline = redis.pipeline()
+    pipeline.zrem('{0}:processing'.format(queue_key), batch_key)
+    pipeline.delete(batch_key)
+    pipeline.execute()
+
+    return None
+
+
+def _requeue_stale_batches(queue_key):
+    """
+    Queue up the unacknowledged e-mails of batches whose worker never
+    finished them, such as one that got killed mid batch.
+
+    :param queue_key: Redis key of the queue
+    :type queue_key: str
+    :return: None
+    """
+    batches_key = '{0}:processing'.format(queue_key)
+    stale_on = time.time() - current_app.config['MAIL_PROCESSING_TIMEOUT']
+
+    for batch_key in redis.zrangebyscore(batches_key, 0, stale_on):
+        # Only the worker that removes the batch gets to requeue it.
+        if not redis.zrem(batches_key, batch_key):
+            continue
+
+        requeued = 0
+        while redis.rpoplpush(batch_key, queue_key) is not None:
+            requeued += 1
+
+        current_app.logger.warning('Queued up %s e-mails again from a stale '
+                                   'batch.', requeued)
+
+    return None
+
+
+def _requeue_due_retries(queue_key):
+    """
+    Move e-mails whose retry is due back onto the queue.
+
+    :param queue_key: Redis key of the queue
+    :type queue_key: str
+    :return: None
+    """
+    retry_key = '{0}:retry'.format(queue_key)
+
+    redis.eval(REQUEUE_DUE_RETRIES, 2, retry_key, queue_key, time.time())
 
     return None
 
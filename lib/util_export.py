@@ -0,0 +1,188 @@
+import csv
+import datetime
+import json
+import os
+import time
+
+try:
+    # Python 2's csv module only writes bytes.
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+# Spreadsheets run cells starting with these as formulas.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _serialize(value):
+    """
+    Convert a column value into something that CSV and JSON can both write.
+
+    :param value: Column value
+    :return: Serializable value
+    """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+
+    return value
+
+
+def _csv_value(value):
+    """
+    Convert a column value for the csv module, on Python 2 that means
+    encoding text since it can only write bytes.
+
+    Text that a spreadsheet would run as a formula, such as a username of
+    =HYPERLINK(...), gets prefixed with a quote so it shows up as text.
+
+    :param value: Column value
+    :return: Serializable value
+    """
+    value = _serialize(value)
+
+    if hasattr(value, 'startswith') and value.startswith(FORMULA_PREFIXES):
+        value = "'" + value
+
+    if not isinstance(value, str) and hasattr(value, 'encode'):
+        return value.encode('utf-8')
+
+    return value
+
+
+def csv_chunks(header, rows, rows_per_chunk=1000):
+    """
+    Write rows as CSV, a chunk at a time.
+
+    :param header: Column names
+    :type header: list
+    :param rows: Rows to write
+    :type rows: iterable
+    :param rows_per_chunk: Rows per chunk of output
+    :type rows_per_chunk: int
+    :return: Generator of CSV text
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+
+    for i, row in enumerate(rows, 1):
+        writer.writerow([_csv_value(value) for value in row])
+
+        if i % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(header, rows, rows_per_chunk=1000):
+    """
+    Write rows as newline delimited JSON objects, a chunk at a time.
+
+    :param header: Column names
+    :type header: list
+    :param rows: Rows to write
+    :type rows: iterable
+    :param rows_per_chunk: Rows per chunk of output
+    :type rows_per_chunk: int
+    :return: Generator of NDJSON text
+    """
+    lines = []
+
+    for row in rows:
+        lines.append(json.dumps(dict(zip(header, map(_serialize, row)))))
+
+        if len(lines) == rows_per_chunk:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def write_export(query, columns, format, path, chunk_size=1000):
+    """
+    Write the results of a query to a file without ever holding more than a
+    chunk of rows in memory, no matter how many rows there are.
+
+    Only the exported columns are selected so no model instances get built,
+    and rows are read from a server side cursor a chunk at a time. The file
+    only shows up at its path once it was completely written.
+
+    :param query: Query to export, it is already filtered and sorted
+    :type query: SQLAlchemy query
+    :param columns: List of (name, column) pairs to export
+    :type columns: list
+    :param format: csv or ndjson
+    :type format: str
+    :param path: Where to write the file
+    :type path: str
+    :param chunk_size: Rows to read and write at a time
+    :type chunk_size: int
+    :return: How many bytes were written
+    """
+    header = [name for name, _ in columns]
+    rows = query.with_entities(*[column for _, column in columns]) \
+        .execution_options(stream_results=True) \
+        .yield_per(chunk_size)
+
+    if format == 'ndjson':
+        chunks = ndjson_chunks(header, rows, chunk_size)
+    else:
+        chunks = csv_chunks(header, rows, chunk_size)
+
+    folder = os.path.dirname(path)
+
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    partial_path = '{0}.part'.format(path)
+    written = 0
+
+    try:
+        with open(partial_path, 'wb') as f:
+            for chunk in chunks:
+                if not isinstance(chunk, bytes):
+                    chunk = chunk.encode('utf-8')
+
+                f.write(chunk)
+                written += len(chunk)
+
+        os.rename(partial_path, path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+    return written
+
+
+def delete_old_exports(folder, max_age):
+    """
+    Delete exports that were written a while ago.
+
+    :param folder: Folder the exports are written to
+    :type folder: str
+    :param max_age: Seconds to keep exports around for
+    :type max_age: int
+    :return: How many exports were deleted
+    """
+    if not os.path.isdir(folder):
+        return 0
+
+    deleted = 0
+    cutoff = time.time() - max_age
+
+    for filename in os.listdir(folder):
+        path = os.path.join(folder, filename)
+
+        if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            deleted += 1
+
+    return deleted
@@ -1,6 +1,12 @@
+import base64
 import datetime
+import json
+import re
 
-from sqlalchemy import DateTime
+import pytz
+
+from flask_sqlalchemy import Pagination
+from sqlalchemy import DateTime, false, or_, tuple_
 from sqlalchemy.types import TypeDecorator
 
 from lib.util_datetime import tzware_datetime
@@ -84,6 +90,28 @@ class ResourceMixin(object):
 
         return ids
 
+    @classmethod
+    def get_bulk_action_filter(cls, scope, ids, query=''):
+        """
+        Match the same items as get_bulk_action_ids without loading their ids
+        first, so it works no matter how many items are in scope.
+
+        :param scope: Affect all or only a subset of items
+        :type scope: str
+        :param ids: List of ids to be affected
+        :type ids: list
+        :param query: Search query (if applicable)
+        :type query: str
+        :return: SQLAlchemy filter
+        """
+        if scope == 'all_search_results':
+            return cls.search(query)
+
+        if not ids:
+            return false()
+
+        return cls.id.in_([int(id) for id in ids])
+
     @classmethod
     def bulk_delete(cls, ids):
         """
@@ -130,3 +158,279 @@ class ResourceMixin(object):
 
         values = ', '.join("%s=%r" % (n, getattr(self, n)) for n in columns)
         return '<%s %s(%s)>' % (obj_id, self.__class__.__name__, values)
+
+
+class KeysetPage(object):
+    """
+    A page of results found by seeking past the last row of the previous page
+    instead of using an OFFSET, so every page costs the same to look up.
+
+    It quacks enough like Flask-SQLAlchemy's Pagination object for templates
+    that only need the items and whether or not there are more of them.
+    """
+
+    def __init__(self, items, has_prev, has_next, prev_cursor, next_cursor):
+        self.items = items
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+
+def encode_cursor(backwards, value, id):
+    """
+    Create an opaque token that points at a row.
+
+    :param backwards: Does the token seek to the previous page?
+    :type backwards: bool
+    :param value: Value of the sorted column for the row
+    :param id: Id of the row
+    :type id: int
+    :return: str
+    """
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+
+    payload = json.dumps([int(backwards), value, id]).encode('utf-8')
+
+    return base64.urlsafe_b64encode(payload).decode('utf-8')
+
+
+# What datetime.isoformat() returns for a tz-aware datetime.
+ISO_DATETIME = re.compile(r'^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})'
+                          r'(?:\.(\d{1,6}))?([+-])(\d{2}):(\d{2})$')
+
+
+def parse_iso_datetime(value):
+    """
+    Parse a tz-aware datetime created by datetime.isoformat().
+
+    :param value: ISO 8601 datetime with a UTC offset
+    :type value: str
+    :return: UTC datetime or None if it is invalid
+    """
+    try:
+        match = ISO_DATETIME.match(value)
+    except TypeError:
+        return None
+
+    if match is None:
+        return None
+
+    seconds, fraction, sign, hours, minutes = match.groups()
+
+    try:
+        parsed = datetime.datetime.strptime(seconds, '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        return None
+
+    offset = (int(hours) * 60 + int(minutes)) * (-1 if sign == '-' else 1)
+
+    if abs(offset) >= 24 * 60:
+        return None
+
+    parsed = parsed.replace(microsecond=int((fraction or '0').ljust(6, '0')),
+                            tzinfo=pytz.FixedOffset(offset))
+
+    return parsed.astimezone(pytz.utc)
+
+
+def decode_cursor(cursor):
+    """
+    Read a token created by encode_cursor. Tokens come from the query string
+    so anything that isn't a datetime and an id is rejected, rather than
+    being handed to the database.
+
+    :param cursor: Token
+    :type cursor: str
+    :return: Tuple of (backwards, value, id) or None if it is invalid
+    """
+    try:
+        backwards, value, id = json.loads(
+            base64.urlsafe_b64decode(str(cursor)).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        return None
+
+    value = parse_iso_datetime(value)
+
+    if value is None or backwards not in (0, 1) or \
+            not isinstance(id, int) or isinstance(id, bool):
+        return None
+
+    return bool(backwards), value, id
+
+
+def keyset_paginate(query, column, id_column, direction='desc', cursor=None,
+                    per_page=50):
+    """
+    Paginate a query by seeking on (column, id) instead of using an OFFSET.
+    The column must never be NULL, created_on is the usual choice.
+
+    :param query: Query to paginate
+    :type query: SQLAlchemy query
+    :param column: Column to sort on
+    :type column: SQLAlchemy column
+    :param id_column: Unique column to break ties with
+    :type id_column: SQLAlchemy column
+    :param direction: Direction
+    :type direction: str
+    :param cursor: Token from a previous page's prev_cursor or next_cursor
+    :type cursor: str
+    :param per_page: Amount of items per page
+    :type per_page: int
+    :return: KeysetPage
+    """
+    position = decode_cursor(cursor) if cursor else None
+    backwards = position is not None and position[0]
+
+    # Seeking backwards is the same as seeking forwards in reverse order.
+    descending = (direction == 'desc') != backwards
+    key = tuple_(column, id_column)
+
+    if position is not None:
+        seek_to = tuple_(position[1], position[2])
+        query = query.filter(key < seek_to if descending else key > seek_to)
+
+    if descending:
+        query = query.order_by(column.desc(), id_column.desc())
+    else:
+        query = query.order_by(column.asc(), id_column.asc())
+
+    items = query.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+
+    if backwards:
+        items.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = position is not None, has_more
+
+    prev_cursor = None
+    next_cursor = None
+
+    if items:
+        first, last = items[0], items[-1]
+        prev_cursor = encode_cursor(True, getattr(first, column.key),
+                                    getattr(first, id_column.key))
+        next_cursor = encode_cursor(False, getattr(last, column.key),
+                                    getattr(last, id_column.key))
+
+    return KeysetPage(items, has_prev, has_next, prev_cursor, next_cursor)
+
+
+# Trigrams are 3 characters long, anything shorter than that can't be found
+# efficiently anywhere inside of a string, only at the start of it.
+MIN_TRIGRAM_LENGTH = 3
+
+
+def escape_like(value, escape='\\'):
+    """
+    Escape the wildcards in a value so it can be matched literally in LIKE.
+
+    :param value: Value to escape
+    :type value: str
+    :param escape: Escape character
+    :type escape: str
+    :return: str
+    """
+    for character in (escape, '%', '_'):
+        value = value.replace(character, escape + character)
+
+    return value
+
+
+def search_filter(columns, query):
+    """
+    Match a search query against 1 or more columns case insensitively.
+
+    Queries of at least MIN_TRIGRAM_LENGTH characters match anywhere inside
+    of a column, which a pg_trgm GIN index on the column can answer. Shorter
+    queries only match at the start of a column, matching them anywhere would
+    mean reading the whole index for barely any filtering.
+
+    :param columns: Columns to search, each one should have a trigram index
+    :type columns: list
+    :param query: Search query
+    :type query: str
+    :return: SQLAlchemy filter or an empty string if there is nothing to match
+    """
+    query = (query or '').strip()
+
+    if not query:
+        return ''
+
+    if len(query) < MIN_TRIGRAM_LENGTH:
+        pattern = '{0}%'.format(escape_like(query))
+    else:
+        pattern = '%{0}%'.format(escape_like(query))
+
+    return or_(*[column.ilike(pattern, escape='\\') for column in columns])
+
+
+def estimate_count(query, exact_below=1000):
+    """
+    Estimate how many rows a query returns from Postgres' query plan instead
+    of counting them. Counting a search that matches millions of rows means
+    reading every one of them, the planner's guess costs nothing.
+
+    Small estimates get counted exactly since counting them is cheap.
+
+    :param query: Query to count
+    :type query: SQLAlchemy query
+    :param exact_below: Count exactly when fewer rows than this are estimated
+    :type exact_below: int
+    :return: int
+    """
+    connection = query.session.connection()
+    compiled = query.order_by(None).statement.compile(bind=connection)
+
+    plan = connection.execute('EXPLAIN (FORMAT JSON) {0}'.format(compiled),
+                              compiled.params).scalar()
+
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+
+    estimate = int(plan[0]['Plan']['Plan Rows'])
+
+    if estimate < exact_below:
+        return query.order_by(None).count()
+
+    return estimate
+
+
+def estimated_paginate(query, page, per_page=50, exact_below=1000):
+    """
+    Paginate a query with an estimated total instead of a count(*).
+
+    The previous and next links are always right because 1 extra row is
+    fetched to find out if there is a next page, only the amount of pages
+    is approximate. Pages past the end are empty instead of a 404 since the
+    estimate may point at them.
+
+    :param query: Query to paginate
+    :type query: SQLAlchemy query
+    :param page: Page number starting from 1
+    :type page: int
+    :param per_page: Amount of items per page
+    :type per_page: int
+    :param exact_below: Count exactly when fewer rows than this are estimated
+    :type exact_below: int
+    :return: Flask-SQLAlchemy Pagination
+    """
+    page = max(1, page)
+    offset = (page - 1) * per_page
+
+    items = query.limit(per_page + 1).offset(offset).all()
+    has_next = len(items) > per_page
+    items = items[:per_page]
+
+    if has_next:
+        total = max(estimate_count(query, exact_below),
+                    offset + per_page + 1)
+    elif items or page == 1:
+        total = offset + len(items)
+    else:
+        total = estimate_count(query, exact_below)
+
+    return Pagination(query, page, per_page, total, items)
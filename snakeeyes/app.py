@@ -1,38 +1,38 @@
 import logging
-
-from logging.handlers import SMTPHandler
-
-import stripe
+import sys
+import time
+from contextlib import contextmanager
 
 from werkzeug.contrib.fixers import ProxyFix
+from werkzeug.utils import import_string
 from flask import Flask, render_template, request
 from flask_login import current_user
 from celery import Celery
-from itsdangerous import URLSafeTimedSerializer
-
-from snakeeyes.blueprints.admin import admin
-from snakeeyes.blueprints.page import page
-from snakeeyes.blueprints.contact import contact
-from snakeeyes.blueprints.user import user
-from snakeeyes.blueprints.billing import billing
-from snakeeyes.blueprints.billing import stripe_webhook
-from snakeeyes.blueprints.bet import bet
-from snakeeyes.blueprints.user.models import User
-from snakeeyes.blueprints.billing.template_processors import (
-  format_currency,
-  current_year
-)
+
 from snakeeyes.extensions import (
-    debug_toolbar,
     mail,
     csrf,
     db,
     login_manager,
     limiter,
-    babel
+    babel,
+    redis
 )
 
+# Blueprints get imported while the app is created, so importing this module
+# stays cheap and the startup profile can time each of them.
+BLUEPRINTS = [
+    'snakeeyes.blueprints.admin:admin',
+    'snakeeyes.blueprints.page:page',
+    'snakeeyes.blueprints.contact:contact',
+    'snakeeyes.blueprints.user:user',
+    'snakeeyes.blueprints.billing:billing',
+    'snakeeyes.blueprints.billing:stripe_webhook',
+    'snakeeyes.blueprints.bet:bet',
+]
+
 CELERY_TASK_LIST = [
+    'snakeeyes.blueprints.admin.tasks',
     'snakeeyes.blueprints.contact.tasks',
     'snakeeyes.blueprints.user.tasks',
     'snakeeyes.blueprints.billing.tasks',
@@ -41,14 +41,22 @@ CELERY_TASK_LIST = [
 
 def create_celery_app(app=None):
     """
-    Create a new Celery object and tie together the Celery config to the app's
-    config. Wrap all tasks in the context of the application.
+    Return the Celery object of a Flask app, creating it the first time. Its
+    config comes from the app's config and all tasks run in the app's
+    context.
 
-    :param app: Flask app
+    Tasks are shared tasks, so they are registered on it lazily once their
+    module gets imported. Workers import every module in CELERY_TASK_LIST
+    when they start, while web processes only import the ones they use.
+
+    :param app: Flask app, a new one gets created if there is none
     :return: Celery app
     """
     app = app or create_app()
 
+    if 'celery' in app.extensions:
+        return app.extensions['celery']
+
     celery = Celery(app.import_name, broker=app.config['CELERY_BROKER_URL'],
                     include=CELERY_TASK_LIST)
     celery.conf.update(app.config)
@@ -62,6 +70,11 @@ def create_celery_app(app=None):
                 return TaskBase.__call__(self, *args, **kwargs)
 
     celery.Task = ContextTask
+
+    # Shared tasks are looked up on the default app from any thread.
+    celery.set_default()
+    app.extensions['celery'] = celery
+
     return celery
 
 
@@ -80,27 +93,104 @@ def create_app(settings_override=None):
     if settings_override:
         app.config.update(settings_override)
 
-    stripe.api_key = app.config.get('STRIPE_SECRET_KEY')
-    stripe.api_version = app.config.get('STRIPE_API_VERSION')
+    with startup_step(app, 'middleware'):
+        middleware(app)
+        error_templates(app)
+
+    for blueprint in BLUEPRINTS:
+        with startup_step(app, blueprint):
+            app.register_blueprint(import_string(blueprint))
+
+    with startup_step(app, 'payment gateway'):
+        payment_gateway(app)
+
+    with startup_step(app, 'mail handler'):
+        exception_handler(app)
+
+    with startup_step(app, 'template processors'):
+        template_processors(app)
 
-    middleware(app)
-    error_templates(app)
-    exception_handler(app)
-    app.register_blueprint(admin)
-    app.register_blueprint(page)
-    app.register_blueprint(contact)
-    app.register_blueprint(user)
-    app.register_blueprint(billing)
-    app.register_blueprint(stripe_webhook)
-    app.register_blueprint(bet)
-    template_processors(app)
     extensions(app)
-    authentication(app, User)
-    locale(app)
+
+    with startup_step(app, 'authentication'):
+        from snakeeyes.blueprints.user import cache as user_cache
+        authentication(app, user_cache.get)
+        locale(app)
+
+    with startup_step(app, 'celery'):
+        create_celery_app(app)
+
+    if app.config['STARTUP_PROFILE']:
+        startup_report(app)
 
     return app
 
 
+@contextmanager
+def startup_step(app, name):
+    """
+    Time a step of creating the app, imports done during it count towards it.
+
+    :param app: Flask application instance
+    :param name: Name of the step
+    :type name: str
+    :return: None
+    """
+    start = time.time()
+
+    yield
+
+    app.extensions.setdefault('startup_profile', []).append(
+        (name, time.time() - start))
+
+
+def startup_report(app, stream=None):
+    """
+    Write how long every step of creating the app took, the slowest first.
+
+    :param app: Flask application instance
+    :param stream: Where to write it, defaults to stderr
+    :return: None
+    """
+    stream = stream or sys.stderr
+    steps = app.extensions.get('startup_profile', [])
+
+    stream.write('Startup profile of {0}:\n'.format(app.import_name))
+
+    for name, elapsed in sorted(steps, key=lambda step: step[1],
+                                reverse=True):
+        stream.write('  {0:>8.1f}ms  {1}\n'.format(elapsed * 1000, name))
+
+    stream.write('  {0:>8.1f}ms  total\n'.format(
+        sum(elapsed for _, elapsed in steps) * 1000))
+
+    return None
+
+
+def payment_gateway(app):
+    """
+    Point the Stripe library at the account and send its requests through
+    the pooled gateway client, which only connects once it is first used.
+
+    :param app: Flask application instance
+    :return: None
+    """
+    import stripe
+
+    from snakeeyes.blueprints.billing.gateways.transport import GatewayClient
+
+    stripe.api_key = app.config.get('STRIPE_SECRET_KEY')
+    stripe.api_version = app.config.get('STRIPE_API_VERSION')
+    stripe.default_http_client = GatewayClient(
+        timeouts=app.config['PAYMENT_GATEWAY_TIMEOUTS'],
+        connect_timeout=app.config['PAYMENT_GATEWAY_CONNECT_TIMEOUT'],
+        pool_size=app.config['PAYMENT_GATEWAY_POOL_SIZE'],
+        retries=app.config['PAYMENT_GATEWAY_HTTP_RETRIES'],
+        backoff=app.config['PAYMENT_GATEWAY_BACKOFF'])
+
+    return None
+
+
 def extensions(app):
     """
     Register 0 or more extensions (mutates the app passed in).
@@ -108,13 +198,18 @@ def extensions(app):
     :param app: Flask application instance
     :return: None
     """
-    debug_toolbar.init_app(app)
-    mail.init_app(app)
-    csrf.init_app(app)
-    db.init_app(app)
-    login_manager.init_app(app)
-    limiter.init_app(app)
-    babel.init_app(app)
+    if app.debug:
+        # Only development uses the toolbar, so only then is it imported.
+        with startup_step(app, 'debug_toolbar'):
+            from flask_debugtoolbar import DebugToolbarExtension
+            DebugToolbarExtension(app)
+
+    for name, extension in (('mail', mail), ('csrf', csrf), ('db', db),
+                            ('login_manager', login_manager),
+                            ('limiter', limiter), ('babel', babel),
+                            ('redis', redis)):
+        with startup_step(app, name):
+            extension.init_app(app)
 
     return None
 
@@ -126,36 +221,37 @@ def template_processors(app):
     :param app: Flask application instance
     :return: App jinja environment
     """
+    from snakeeyes.blueprints.billing.template_processors import (
+      format_currency,
+      current_year
+    )
+
     app.jinja_env.filters['format_currency'] = format_currency
     app.jinja_env.globals.update(current_year=current_year)
 
     return app.jinja_env
 
 
-def authentication(app, user_model):
+def authentication(app, get_user):
     """
     Initialize the Flask-Login extension (mutates the app passed in).
 
     :param app: Flask application instance
-    :param user_model: Model that contains the authentication information
-    :type user_model: SQLAlchemy model
+    :param get_user: Look up a user by their id
+    :type get_user: function
     :return: None
     """
+    from snakeeyes.blueprints.user import auth_tokens
+
     login_manager.login_view = 'user.login'
 
     @login_manager.user_loader
     def load_user(uid):
-        return user_model.query.get(uid)
+        return get_user(uid)
 
     @login_manager.token_loader
     def load_token(token):
-        duration = app.config['REMEMBER_COOKIE_DURATION'].total_seconds()
-        serializer = URLSafeTimedSerializer(app.secret_key)
-
-        data = serializer.loads(token, max_age=duration)
-        user_uid = data[0]
-
-        return user_model.query.get(user_uid)
+        return auth_tokens.load(token, get_user)
 
 
 def locale(app):
@@ -222,14 +318,14 @@ def exception_handler(app):
     :param app: Flask application instance
     :return: None
     """
-    mail_handler = SMTPHandler((app.config.get('MAIL_SERVER'),
-                                app.config.get('MAIL_PORT')),
-                               app.config.get('MAIL_USERNAME'),
-                               [app.config.get('MAIL_USERNAME')],
-                               '[Exception handler] A 5xx was thrown',
-                               (app.config.get('MAIL_USERNAME'),
-                                app.config.get('MAIL_PASSWORD')),
-                               secure=())
+    from lib.error_digest import DigestHandler
+    from snakeeyes.blueprints.admin.tasks import deliver_error_digest
+
+    # Errors get e-mailed in digests by a worker, so a failing request never
+    # waits on SMTP and a burst of errors sends 1 e-mail.
+    mail_handler = DigestHandler(redis, deliver_error_digest.apply_async,
+                                 app.config['ERROR_DIGEST_WINDOW'],
+                                 key_prefix=app.config['ERROR_DIGEST_KEY'])
 
     mail_handler.setLevel(logging.ERROR)
     mail_handler.setFormatter(logging.Formatter("""
@@ -0,0 +1,143 @@
+import os
+import re
+
+from flask import current_app
+from sqlalchemy import text
+
+from snakeeyes.blueprints.billing.models.coupon import Coupon
+from snakeeyes.blueprints.billing.models.invoice import Invoice
+from snakeeyes.blueprints.user.models import User
+
+FILENAME = re.compile(r'^(?P<resource>users|coupons|invoices)'
+                      r'-(?P<export_id>[0-9a-f]{32})'
+                      r'\.(?P<format>csv|ndjson)$')
+
+
+def path(filename):
+    """
+    Return where an export gets written to.
+
+    :param filename: Name of the export
+    :type filename: str
+    :return: str
+    """
+    return os.path.join(current_app.config['EXPORT_FOLDER'], filename)
+
+
+def users(params):
+    """
+    Build the query and columns of a users export.
+
+    :param params: Search, sort and bulk action scope of the export
+    :type params: dict
+    :return: Tuple of the query and a list of (name, column) pairs
+    """
+    sort_by = User.sort_by(params.get('sort', 'created_on'),
+                           params.get('direction', 'desc'))
+    order_values = '{0} {1}'.format(sort_by[0], sort_by[1])
+
+    query = User.query.filter(User.get_bulk_action_filter(
+        params.get('scope', 'all_search_results'),
+        params.get('bulk_ids', []),
+        query=params.get('q', '')))
+
+    if sort_by[0] == 'created_on':
+        query = query.order_by(text(order_values), User.id)
+    else:
+        query = query.order_by(User.role.asc(), User.payment_id,
+                               text(order_values), User.id)
+
+    columns = [
+        ('id', User.id),
+        ('created_on', User.created_on),
+        ('role', User.role),
+        ('active', User.active),
+        ('username', User.username),
+        ('email', User.email),
+        ('name', User.name),
+        ('payment_id', User.payment_id),
+        ('coins', User.coins),
+        ('sign_in_count', User.sign_in_count),
+        ('last_sign_in_on', User.last_sign_in_on),
+        ('last_bet_on', User.last_bet_on)
+    ]
+
+    return query, columns
+
+
+def coupons(params):
+    """
+    Build the query and columns of a coupons export.
+
+    :param params: Search, sort and bulk action scope of the export
+    :type params: dict
+    :return: Tuple of the query and a list of (name, column) pairs
+    """
+    sort_by = Coupon.sort_by(params.get('sort', 'created_on'),
+                             params.get('direction', 'desc'))
+    order_values = '{0} {1}'.format(sort_by[0], sort_by[1])
+
+    query = Coupon.query.filter(Coupon.get_bulk_action_filter(
+        params.get('scope', 'all_search_results'),
+        params.get('bulk_ids', []),
+        query=params.get('q', ''))) \
+        .order_by(text(order_values), Coupon.id)
+
+    columns = [
+        ('id', Coupon.id),
+        ('created_on', Coupon.created_on),
+        ('code', Coupon.code),
+        ('duration', Coupon.duration),
+        ('amount_off', Coupon.amount_off),
+        ('percent_off', Coupon.percent_off),
+        ('currency', Coupon.currency),
+        ('duration_in_months', Coupon.duration_in_months),
+        ('max_redemptions', Coupon.max_redemptions),
+        ('redeem_by', Coupon.redeem_by),
+        ('times_redeemed', Coupon.times_redeemed),
+        ('valid', Coupon.valid)
+    ]
+
+    return query, columns
+
+
+def invoices(params):
+    """
+    Build the query and columns of an invoices export.
+
+    :param params: Search and sort of the export
+    :type params: dict
+    :return: Tuple of the query and a list of (name, column) pairs
+    """
+    sort_by = Invoice.sort_by(params.get('sort', 'created_on'),
+                              params.get('direction', 'desc'))
+    order_values = 'invoices.{0} {1}'.format(sort_by[0], sort_by[1])
+
+    query = Invoice.query.join(User) \
+        .filter(Invoice.search(params.get('q', ''))) \
+        .order_by(text(order_values), Invoice.id)
+
+    columns = [
+        ('id', Invoice.id),
+        ('created_on', Invoice.created_on),
+        ('user_id', Invoice.user_id),
+        ('email', User.email),
+        ('plan', Invoice.plan),
+        ('receipt_number', Invoice.receipt_number),
+        ('description', Invoice.description),
+        ('period_start_on', Invoice.period_start_on),
+        ('period_end_on', Invoice.period_end_on),
+        ('currency', Invoice.currency),
+        ('tax', Invoice.tax),
+        ('tax_percent', Invoice.tax_percent),
+        ('total', Invoice.total)
+    ]
+
+    return query, columns
+
+
+EXPORTS = {
+    'users': users,
+    'coupons': coupons,
+    'invoices': invoices
+}
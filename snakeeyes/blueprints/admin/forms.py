@@ -64,6 +64,10 @@ class UserCancelSubscriptionForm(Form):
     pass
 
 
+class DashboardRefreshForm(Form):
+    pass
+
+
 class CouponForm(Form):
     percent_off = IntegerField('Percent off (%)', [Optional(),
                                                    NumberRange(min=1,
@@ -1,11 +1,29 @@
 from sqlalchemy import func
+from sqlalchemy.dialects import postgresql
 
+from lib.util_datetime import tzware_datetime
+from lib.util_sqlalchemy import ResourceMixin
 from snakeeyes.blueprints.user.models import db, User
 from snakeeyes.blueprints.billing.models.subscription import Subscription
 from snakeeyes.blueprints.bet.models.bet import Bet
 
 
 class Dashboard(object):
+    @classmethod
+    def aggregate(cls):
+        """
+        Run every dashboard aggregate. These scan entire tables so call this
+        from a background job, the dashboard page reads DashboardSnapshot.
+
+        :return: dict
+        """
+        return {
+            'group_and_count_plans': cls.group_and_count_plans(),
+            'group_and_count_coupons': cls.group_and_count_coupons(),
+            'group_and_count_users': cls.group_and_count_users(),
+            'group_and_count_payouts': cls.group_and_count_payouts()
+        }
+
     @classmethod
     def group_and_count_users(cls):
         """
@@ -66,8 +84,52 @@ class Dashboard(object):
         query = db.session.query(count, field).group_by(field).all()
 
         results = {
-            'query': query,
+            'query': [list(row) for row in query],
             'total': model.query.count()
         }
 
         return results
+
+
+class DashboardSnapshot(ResourceMixin, db.Model):
+    __tablename__ = 'dashboard_snapshots'
+
+    # There is only ever 1 snapshot, it gets overwritten on every refresh.
+    SNAPSHOT_ID = 1
+
+    id = db.Column(db.Integer, primary_key=True)
+    data = db.Column(postgresql.JSON(), nullable=False)
+
+    def __init__(self, **kwargs):
+        # Call Flask-SQLAlchemy's constructor.
+        super(DashboardSnapshot, self).__init__(**kwargs)
+
+    @classmethod
+    def latest(cls):
+        """
+        Return the current snapshot, there is none until the first refresh
+        finished.
+
+        :return: DashboardSnapshot instance or None
+        """
+        return cls.query.get(cls.SNAPSHOT_ID)
+
+    @classmethod
+    def refresh(cls):
+        """
+        Recalculate the dashboard aggregates and store them.
+
+        :return: DashboardSnapshot instance
+        """
+        data = Dashboard.aggregate()
+        data['group_and_count_coupons'] = list(data['group_and_count_coupons'])
+
+        snapshot = cls.query.get(cls.SNAPSHOT_ID)
+
+        if snapshot is None:
+            snapshot = cls(id=cls.SNAPSHOT_ID)
+
+        snapshot.data = data
+        snapshot.updated_on = tzware_datetime()
+
+        return snapshot.save()
@@ -0,0 +1,80 @@
+from celery import shared_task
+from flask import current_app
+
+from lib.error_digest import collect
+from lib.flask_mailplus import queue_template_message
+from lib.util_export import delete_old_exports, write_export
+from snakeeyes.extensions import redis
+from snakeeyes.blueprints.admin import exports
+from snakeeyes.blueprints.admin.models import DashboardSnapshot
+from snakeeyes.blueprints.user.tasks import deliver_queued_mail
+
+
+@shared_task()
+def refresh_dashboard():
+    """
+    Recalculate the admin dashboard's aggregates.
+
+    :return: Id of the refreshed snapshot
+    """
+    return DashboardSnapshot.refresh().id
+
+
+@shared_task()
+def export_resource(resource, format, params, filename):
+    """
+    Write an export of users, coupons or invoices for an admin to download.
+    It happens here rather than in a request since a large export can take
+    longer than a web worker is allowed to run for.
+
+    :param resource: users, coupons or invoices
+    :type resource: str
+    :param format: csv or ndjson
+    :type format: str
+    :param params: Search, sort and bulk action scope of the export
+    :type params: dict
+    :param filename: Name of the export
+    :type filename: str
+    :return: How many bytes were written
+    """
+    query, columns = exports.EXPORTS[resource](params)
+
+    return write_export(query, columns, format, exports.path(filename))
+
+
+@shared_task()
+def delete_exports():
+    """
+    Delete exports that have been around for longer than EXPORT_MAX_AGE.
+
+    :return: How many exports were deleted
+    """
+    return delete_old_exports(current_app.config['EXPORT_FOLDER'],
+                              current_app.config['EXPORT_MAX_AGE'])
+
+
+@shared_task(ignore_result=True)
+def deliver_error_digest():
+    """
+    E-mail every error that was logged since the last digest.
+
+    :return: How many errors were in the digest
+    """
+    config = current_app.config
+    total, errors = collect(redis, config['ERROR_DIGEST_KEY'],
+                            limit=config['ERROR_DIGEST_MAX_ERRORS'])
+
+    if not total:
+        return 0
+
+    ctx = {'total': total, 'errors': errors,
+           'window': config['ERROR_DIGEST_WINDOW']}
+
+    queue_template_message(subject='[Exception handler] {0} errors were '
+                                   'logged'.format(total),
+                           sender=config['MAIL_USERNAME'],
+                           recipients=[config['MAIL_USERNAME']],
+                           template='admin/mail/error_digest', ctx=ctx,
+                           schedule=deliver_queued_mail.apply_async)
+
+    return total
@@ -1,26 +1,38 @@
+import os
+import uuid
+
 from flask import (
     Blueprint,
+    abort,
+    current_app,
     redirect,
     request,
     flash,
     url_for,
-    render_template)
+    render_template,
+    send_from_directory)
 from flask_login import login_required, current_user
 from sqlalchemy import text
 
-from snakeeyes.blueprints.admin.models import Dashboard
+from lib.util_export import EXPORT_MIMETYPES
+from lib.util_sqlalchemy import estimated_paginate, keyset_paginate
+from snakeeyes.blueprints.admin import exports
+from snakeeyes.blueprints.admin.models import DashboardSnapshot
 from snakeeyes.blueprints.user.decorators import role_required
 from snakeeyes.blueprints.billing.decorators import handle_stripe_exceptions
+from snakeeyes.blueprints.billing.gateways import breaker, transport
 from snakeeyes.blueprints.billing.models.coupon import Coupon
 from snakeeyes.blueprints.billing.models.subscription import Subscription
 from snakeeyes.blueprints.billing.models.invoice import Invoice
+from snakeeyes.blueprints.bet.models import leaderboard
 from snakeeyes.blueprints.user.models import User
 from snakeeyes.blueprints.admin.forms import (
     SearchForm,
     BulkDeleteForm,
     UserForm,
     UserCancelSubscriptionForm,
-    CouponForm
+    CouponForm,
+    DashboardRefreshForm
 )
 
 admin = Blueprint('admin', __name__,
@@ -38,16 +50,42 @@ def before_request():
 # Dashboard -------------------------------------------------------------------
 @admin.route('')
 def dashboard():
-    group_and_count_plans = Dashboard.group_and_count_plans()
-    group_and_count_coupons = Dashboard.group_and_count_coupons()
-    group_and_count_users = Dashboard.group_and_count_users()
-    group_and_count_payouts = Dashboard.group_and_count_payouts()
+    form = DashboardRefreshForm()
+    snapshot = DashboardSnapshot.latest()
+
+    if snapshot is None:
+        # Prevent circular imports.
+        from snakeeyes.blueprints.admin.tasks import refresh_dashboard
+
+        # The aggregates scan entire tables, never take them in a request.
+        refresh_dashboard.delay()
+
+    # Gateway health is live, it would be useless from a snapshot.
+    return render_template('admin/page/dashboard.html', form=form,
+                           snapshot=snapshot,
+                           gateway_state=breaker.state(),
+                           gateway_states=breaker.STATES,
+                           gateway_latency=transport.latency_stats(),
+                           **(snapshot.data if snapshot else {}))
+
+
+@admin.route('/dashboard/refresh', methods=['POST'])
+def dashboard_refresh():
+    form = DashboardRefreshForm()
+
+    if form.validate_on_submit():
+        # Prevent circular imports.
+        from snakeeyes.blueprints.admin.tasks import refresh_dashboard
 
-    return render_template('admin/page/dashboard.html',
-                           group_and_count_plans=group_and_count_plans,
-                           group_and_count_coupons=group_and_count_coupons,
-                           group_and_count_users=group_and_count_users,
-                           group_and_count_payouts=group_and_count_payouts)
+        refresh_dashboard.delay()
+
+        flash('The dashboard is being refreshed, reload in a moment.',
+              'success')
+    else:
+        flash('The dashboard could not be refreshed, something went wrong.',
+              'error')
+
+    return redirect(url_for('admin.dashboard'))
 
 
 # Users -----------------------------------------------------------------------
@@ -61,10 +99,16 @@ def users(page):
                            request.args.get('direction', 'desc'))
     order_values = '{0} {1}'.format(sort_by[0], sort_by[1])
 
-    paginated_users = User.query \
-        .filter(User.search(request.args.get('q', ''))) \
-        .order_by(User.role.asc(), User.payment_id, text(order_values)) \
-        .paginate(page, 50, True)
+    query = User.query.filter(User.search(request.args.get('q', '')))
+
+    if sort_by[0] == 'created_on':
+        paginated_users = keyset_paginate(query, User.created_on, User.id,
+                                          direction=sort_by[1],
+                                          cursor=request.args.get('cursor'))
+    else:
+        paginated_users = estimated_paginate(
+            query.order_by(User.role.asc(), User.payment_id,
+                           text(order_values)), page)
 
     return render_template('admin/user/index.html',
                            form=search_form, bulk_form=bulk_form,
@@ -95,6 +139,7 @@ def users_edit(id):
             user.username = None
 
         user.save()
+        leaderboard.record_coins(user.id, user.coins)
 
         flash('User has been saved successfully.', 'success')
         return redirect(url_for('admin.users'))
@@ -126,6 +171,11 @@ def users_bulk_delete():
     return redirect(url_for('admin.users'))
 
 
+@admin.route('/users/export.<any(csv, ndjson):format>', methods=['POST'])
+def users_export(format):
+    return _queue_export('users', format)
+
+
 @admin.route('/users/cancel_subscription', methods=['POST'])
 def users_cancel_subscription():
     form = UserCancelSubscriptionForm()
@@ -156,10 +206,15 @@ def coupons(page):
                              request.args.get('direction', 'desc'))
     order_values = '{0} {1}'.format(sort_by[0], sort_by[1])
 
-    paginated_coupons = Coupon.query \
-        .filter(Coupon.search(request.args.get('q', ''))) \
-        .order_by(text(order_values)) \
-        .paginate(page, 50, True)
+    query = Coupon.query.filter(Coupon.search(request.args.get('q', '')))
+
+    if sort_by[0] == 'created_on':
+        paginated_coupons = keyset_paginate(query, Coupon.created_on,
+                                            Coupon.id, direction=sort_by[1],
+                                            cursor=request.args.get('cursor'))
+    else:
+        paginated_coupons = query.order_by(text(order_values)) \
+            .paginate(page, 50, True)
 
     return render_template('admin/coupon/index.html',
                            form=search_form, bulk_form=bulk_form,
@@ -215,6 +270,11 @@ def coupons_bulk_delete():
     return redirect(url_for('admin.coupons'))
 
 
+@admin.route('/coupons/export.<any(csv, ndjson):format>', methods=['POST'])
+def coupons_export(format):
+    return _queue_export('coupons', format)
+
+
 # Invoices --------------------------------------------------------------------
 @admin.route('/invoices', defaults={'page': 1})
 @admin.route('/invoices/page/<int:page>')
@@ -225,10 +285,81 @@ def invoices(page):
                               request.args.get('direction', 'desc'))
     order_values = 'invoices.{0} {1}'.format(sort_by[0], sort_by[1])
 
-    paginated_invoices = Invoice.query.join(User) \
-        .filter(Invoice.search(request.args.get('q', ''))) \
-        .order_by(text(order_values)) \
-        .paginate(page, 50, True)
+    query = Invoice.query.join(User) \
+        .filter(Invoice.search(request.args.get('q', '')))
+
+    if sort_by[0] == 'created_on':
+        paginated_invoices = keyset_paginate(query, Invoice.created_on,
+                                             Invoice.id, direction=sort_by[1],
+                                             cursor=request.args.get('cursor'))
+    else:
+        paginated_invoices = estimated_paginate(
+            query.order_by(text(order_values)), page)
 
     return render_template('admin/invoice/index.html',
                            form=search_form, invoices=paginated_invoices)
+
+
+@admin.route('/invoices/export.<any(csv, ndjson):format>',
+             methods=['POST'])
+def invoices_export(format):
+    return _queue_export('invoices', format)
+
+
+# Exports ---------------------------------------------------------------------
+def _queue_export(resource, format):
+    """
+    Write an export in the background, large exports take longer than a
+    request is allowed to. The admin gets sent to where it can be downloaded
+    once it is ready.
+
+    :param resource: users, coupons or invoices
+    :type resource: str
+    :param format: csv or ndjson
+    :type format: str
+    :return: Flask response
+    """
+    # Prevent circular imports.
+    from snakeeyes.blueprints.admin.tasks import export_resource
+
+    params = {
+        'sort': request.args.get('sort', 'created_on'),
+        'direction': request.args.get('direction', 'desc'),
+        'q': request.args.get('q', ''),
+        'scope': request.form.get('scope', 'all_search_results'),
+        'bulk_ids': request.form.getlist('bulk_ids')
+    }
+
+    export_id = uuid.uuid4().hex
+    filename = '{0}-{1}.{2}'.format(resource, export_id, format)
+
+    export_resource.apply_async((resource, format, params, filename),
+                                task_id=export_id)
+
+    return redirect(url_for('admin.exports_download', filename=filename))
+
+
+@admin.route('/exports/<filename>')
+def exports_download(filename):
+    # Prevent circular imports.
+    from snakeeyes.blueprints.admin.tasks import export_resource
+
+    match = exports.FILENAME.match(filename)
+
+    if match is None:
+        abort(404)
+
+    if os.path.isfile(exports.path(filename)):
+        return send_from_directory(
+            current_app.config['EXPORT_FOLDER'], filename,
+            as_attachment=True,
+            mimetype=EXPORT_MIMETYPES[match.group('format')])
+
+    if export_resource.AsyncResult(match.group('export_id')).failed():
+        flash('The export could not be created, something went wrong.',
+              'error')
+        return redirect(url_for('admin.{0}'.format(match.group('resource'))))
+
+    # Check again every few seconds until the export is ready.
+    return render_template('admin/export/pending.html',
+                           filename=filename), 200, {'Refresh': '3'}
@@ -1,10 +1,14 @@
 from lib.util_sqlalchemy import ResourceMixin
-from lib.util_datetime import tzware_datetime
 from snakeeyes.extensions import db
 
 
 class Bet(ResourceMixin, db.Model):
     __tablename__ = 'bets'
+    __table_args__ = (
+        # Betting history seeks through a user's bets by (created_on, id).
+        db.Index('ix_bets_user_id_created_on_id', 'user_id', 'created_on',
+                 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
 
     # Relationships.
@@ -76,18 +80,6 @@ class Bet(ResourceMixin, db.Model):
 
         return -wagered
 
-    def save_and_update_user(self, user):
-        """
-        Commit the bet and update the user's information.
-
-        :return: SQLAlchemy save result
-        """
-        self.save()
-
-        user.coins += self.net
-        user.last_bet_on = tzware_datetime()
-        return user.save()
-
     def to_json(self):
         """
         Return JSON fields to represent a bet.
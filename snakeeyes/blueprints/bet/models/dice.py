@@ -1,4 +1,123 @@
-import random
+import os
+import threading
+from collections import deque
+
+import numpy as np
+
+ROLL_BLOCK_SIZE = 65536
+
+# 252 is the largest multiple of 6 that fits in a byte. Random bytes at or
+# above it get thrown away so that every face is exactly as likely.
+_FAIR_BYTE_LIMIT = 252
+
+
+class RollBuffer(object):
+    """
+    Generate dice rolls in large blocks and hand them out on demand, this is
+    much cheaper than asking the random number generator for 1 roll at a time.
+
+    Rolls come from os.urandom so they are cryptographically secure. Each
+    worker process must have its own rolls, call reset after forking (the
+    gunicorn config does this) so 2 workers never hand out the same rolls.
+
+    The hit and refill counters are not locked, treat them as approximate
+    when rolling from multiple threads.
+    """
+
+    def __init__(self, block_size=ROLL_BLOCK_SIZE):
+        self.block_size = block_size
+        self.hits = 0
+        self.refills = 0
+        self._rolls = deque()
+        self._lock = threading.Lock()
+
+    def generate(self, count):
+        """
+        Generate a fresh set of rolls using rejection sampling.
+
+        :param count: Amount of rolls
+        :type count: int
+        :return: Numpy array
+        """
+        rolls = np.empty(0, dtype=np.int64)
+
+        while len(rolls) < count:
+            # Ask for a few extra bytes to make up for the rejected ones.
+            needed = count - len(rolls)
+            raw = np.frombuffer(os.urandom(needed + needed // 50 + 16),
+                                dtype=np.uint8)
+            fair = raw[raw < _FAIR_BYTE_LIMIT].astype(np.int64) % 6 + 1
+
+            rolls = np.concatenate((rolls, fair))
+
+        return rolls[:count]
+
+    def refill(self):
+        """
+        Add a new block of rolls to the buffer.
+
+        :return: None
+        """
+        block = self.generate(self.block_size).tolist()
+
+        with self._lock:
+            self._rolls.extend(block)
+            self.refills += 1
+
+        return None
+
+    def reset(self):
+        """
+        Throw away every buffered roll.
+
+        :return: None
+        """
+        self._rolls.clear()
+
+        return None
+
+    def take_one(self):
+        """
+        Take a single roll from the buffer, refilling it when it runs dry.
+
+        :return: int
+        """
+        # Popping from a deque is thread safe so the hot path needs no lock.
+        try:
+            roll = self._rolls.popleft()
+        except IndexError:
+            self.refill()
+            return self.take_one()
+
+        self.hits += 1
+
+        return roll
+
+    def take(self, count):
+        """
+        Take an array of rolls. Arrays are generated in 1 shot which is
+        already cheap, so they bypass the buffer.
+
+        :param count: Amount of rolls
+        :type count: int
+        :return: Numpy array
+        """
+        return self.generate(count)
+
+    def stats(self):
+        """
+        Report how often rolls were served straight from the buffer.
+
+        :return: dict
+        """
+        return {
+            'hits': self.hits,
+            'refills': self.refills,
+            'buffered': len(self._rolls)
+        }
+
+
+rolls = RollBuffer()
 
 
 def roll():
@@ -7,4 +126,17 @@ def roll():
 
     :return: int
     """
-    return random.randint(1, 6)
+    return rolls.take_one()
+
+
+def roll_pairs(count):
+    """
+    Randomly roll a pair of dice a number of times.
+
+    :param count: Amount of times to roll both dice
+    :type count: int
+    :return: Tuple of numpy arrays for the first and second die
+    """
+    pairs = rolls.take(count * 2)
+
+    return pairs[:count], pairs[count:]
@@ -0,0 +1,318 @@
+import datetime
+from collections import OrderedDict
+
+import pytz
+from flask import current_app
+from flask_sqlalchemy import Pagination
+from redis import RedisError
+from sqlalchemy import func
+
+from snakeeyes.extensions import db, redis
+from snakeeyes.blueprints.bet.models.bet import Bet
+from snakeeyes.blueprints.bet.models.stats import BetStats
+
+BOARDS = OrderedDict([
+    ('net', 'Net winnings'),
+    ('coins', 'Coins')
+])
+
+WINDOWS = OrderedDict([
+    ('daily', 'Today'),
+    ('weekly', 'This week'),
+    ('all', 'All time')
+])
+
+# Windowed boards stick around a little longer than their window so that
+# yesterday's and last week's results can still be looked at.
+WINDOW_TTL = {
+    'daily': datetime.timedelta(days=2),
+    'weekly': datetime.timedelta(days=8)
+}
+
+
+def window_start(window, when):
+    """
+    Return when a window started, days and weeks begin at midnight UTC and
+    weeks begin on Monday.
+
+    :param window: daily or weekly
+    :type window: str
+    :param when: Moment inside of the window
+    :type when: datetime
+    :return: datetime
+    """
+    day = when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if window == 'weekly':
+        return day - datetime.timedelta(days=day.weekday())
+
+    return day
+
+
+def key(board, window='all', when=None):
+    """
+    Return the Redis key of a leaderboard. Coin balances are not tracked over
+    time so the coins board only has an all time window.
+
+    :param board: net or coins
+    :type board: str
+    :param window: daily, weekly or all
+    :type window: str
+    :param when: Moment inside of the window, defaults to now
+    :type when: datetime
+    :return: str
+    """
+    prefix = current_app.config['LEADERBOARD_KEY_PREFIX']
+
+    if board == 'coins' or window == 'all':
+        return '{0}:{1}'.format(prefix, board)
+
+    when = when or datetime.datetime.now(pytz.utc)
+
+    return '{0}:{1}:{2}:{3}'.format(prefix, board, window,
+                                    window_start(window, when)
+                                    .strftime('%Y%m%d'))
+
+
+def _execute(pipeline, action='update'):
+    """
+    Use the leaderboard without ever failing the request, reads show up as
+    unavailable. Postgres is the source of truth, rebuild to fix any drift.
+
+    :param pipeline: Pipeline of queued Redis commands
+    :type pipeline: Redis pipeline
+    :param action: update or read, used in the logged error
+    :type action: str
+    :return: Pipeline results or None if Redis is unavailable
+    """
+    try:
+        return pipeline.execute()
+    except RedisError:
+        current_app.logger.exception(
+            'Could not {0} the leaderboard.'.format(action))
+
+    return None
+
+
+def record_bet(user_id, net, coins, when=None):
+    """
+    Mirror the result of 1 or more settled bets into the leaderboards.
+
+    :param user_id: User who placed the bets
+    :type user_id: int
+    :param net: Net coins won or lost
+    :type net: int
+    :param coins: User's new coin balance
+    :type coins: int
+    :param when: When the bets were settled, defaults to now
+    :type when: datetime
+    :return: Pipeline results or None if Redis is unavailable
+    """
+    pipeline = redis.pipeline()
+    pipeline.zadd(key('coins'), coins, user_id)
+
+    for window in WINDOWS:
+        name = key('net', window, when)
+        pipeline.zincrby(name, user_id, net)
+
+        if window in WINDOW_TTL:
+            pipeline.expire(name, WINDOW_TTL[window])
+
+    return _execute(pipeline)
+
+
+def record_coins(user_id, coins):
+    """
+    Mirror a user's coin balance into the coins leaderboard, this should be
+    called whenever coins are granted outside of betting.
+
+    :param user_id: User who received coins
+    :type user_id: int
+    :param coins: User's new coin balance
+    :type coins: int
+    :return: Pipeline results or None if Redis is unavailable
+    """
+    pipeline = redis.pipeline()
+    pipeline.zadd(key('coins'), coins, user_id)
+
+    return _execute(pipeline)
+
+
+def remove_user(*user_ids):
+    """
+    Remove 1 or more users from every current leaderboard.
+
+    :param user_ids: Users to remove
+    :type user_ids: int
+    :return: Pipeline results or None if Redis is unavailable
+    """
+    pipeline = redis.pipeline()
+    pipeline.zrem(key('coins'), *user_ids)
+
+    for window in WINDOWS:
+        pipeline.zrem(key('net', window), *user_ids)
+
+    return _execute(pipeline)
+
+
+def top(board='net', window='all', page=1, per_page=25):
+    """
+    Return a page of the highest ranked users.
+
+    :param board: net or coins
+    :type board: str
+    :param window: daily, weekly or all
+    :type window: str
+    :param page: Page number starting from 1
+    :type page: int
+    :param per_page: Users per page
+    :type per_page: int
+    :return: Flask-SQLAlchemy Pagination of rank, user and score dicts, or
+             None if Redis is unavailable
+    """
+    # Prevent circular imports.
+    from snakeeyes.blueprints.user.models import User
+
+    name = key(board, window)
+    start = (page - 1) * per_page
+
+    pipeline = redis.pipeline(transaction=False)
+    pipeline.zcard(name)
+    pipeline.zrevrange(name, start, start + per_page - 1, withscores=True)
+    results = _execute(pipeline, 'read')
+
+    if results is None:
+        return None
+
+    total, entries = results
+
+    user_ids = [int(member) for member, _ in entries]
+    users = {}
+
+    if user_ids:
+        for user in User.query.filter(User.id.in_(user_ids)):
+            users[user.id] = user
+
+    items = []
+    for i, (user_id, (_, score)) in enumerate(zip(user_ids, entries)):
+        items.append({
+            'rank': start + i + 1,
+            'user': users.get(user_id),
+            'score': int(score)
+        })
+
+    return Pagination(None, page, per_page, total, items)
+
+
+def rank(user_id, board='net', window='all'):
+    """
+    Look up where a user ranks on a leaderboard.
+
+    :param user_id: User to look up
+    :type user_id: int
+    :param board: net or coins
+    :type board: str
+    :param window: daily, weekly or all
+    :type window: str
+    :return: Tuple of the rank starting from 1 and the score, or None if the
+             user is not ranked or Redis is unavailable
+    """
+    name = key(board, window)
+
+    pipeline = redis.pipeline(transaction=False)
+    pipeline.zrevrank(name, user_id)
+    pipeline.zscore(name, user_id)
+    position, score = _execute(pipeline, 'read') or (None, None)
+
+    if position is None:
+        return None
+
+    return position + 1, int(score)
+
+
+def _chunks(query, id_column, chunk_size):
+    """
+    Walk through (id, score) rows in chunks by seeking on the id, so each
+    chunk costs the same no matter how far along the walk is.
+
+    :param query: Query selecting an id and a score
+    :type query: SQLAlchemy query
+    :param id_column: Column to seek on
+    :type id_column: SQLAlchemy column
+    :param chunk_size: Rows per chunk
+    :type chunk_size: int
+    :return: Generator of lists of rows
+    """
+    last_id = 0
+
+    while True:
+        rows = query.filter(id_column > last_id).order_by(id_column) \
+            .limit(chunk_size).all()
+
+        if not rows:
+            return
+
+        yield rows
+
+        last_id = rows[-1][0]
+
+
+def rebuild(chunk_size=1000, when=None):
+    """
+    Rebuild every current leaderboard from Postgres. Each board is built
+    under a temporary key and swapped in at the end, so readers never see a
+    partially built board.
+
+    Bets settled while a board is being rebuilt may be missing from it, so
+    run this when traffic is low or run it twice.
+
+    :param chunk_size: Users to load per query
+    :type chunk_size: int
+    :param when: Moment to rebuild the windows for, defaults to now
+    :type when: datetime
+    :return: dict of each board's key and how many users it ranks
+    """
+    # Prevent circular imports.
+    from snakeeyes.blueprints.user.models import User
+
+    when = when or datetime.datetime.now(pytz.utc)
+
+    sources = [
+        (key('coins'), None,
+         db.session.query(User.id, User.coins), User.id),
+        (key('net'), None,
+         db.session.query(BetStats.user_id, BetStats.net), BetStats.user_id)
+    ]
+
+    for window in WINDOW_TTL:
+        query = db.session.query(Bet.user_id, func.sum(Bet.net)) \
+            .filter(Bet.created_on >= window_start(window, when)) \
+            .group_by(Bet.user_id)
+
+        sources.append((key('net', window, when), WINDOW_TTL[window],
+                        query, Bet.user_id))
+
+    counts = {}
+
+    for name, ttl, query, id_column in sources:
+        building = '{0}:rebuild'.format(name)
+        redis.delete(building)
+        counts[name] = 0
+
+        for rows in _chunks(query, id_column, chunk_size):
+            scores = []
+            for user_id, score in rows:
+                scores.extend((int(score or 0), user_id))
+
+            redis.zadd(building, *scores)
+            counts[name] += len(rows)
+
+        if counts[name]:
+            redis.rename(building, name)
+
+            if ttl:
+                redis.expire(name, ttl)
+        else:
+            redis.delete(name)
+
+    return counts
@@ -0,0 +1,77 @@
+import numpy as np
+
+_payout_tables = {}
+
+
+class PayoutTable(object):
+    """
+    Payout multipliers stored in an array indexed by the guess, so that
+    whole arrays of bets can be settled at once.
+    """
+
+    def __init__(self, payouts):
+        """
+        :param payouts: Payout multiplier for each guess, such as the
+                        DICE_ROLL_PAYOUT setting
+        :type payouts: dict
+        """
+        guesses = [int(guess) for guess in payouts]
+
+        self.lookup = np.zeros(max(guesses) + 1)
+
+        for guess, payout in payouts.items():
+            self.lookup[int(guess)] = float(payout)
+
+    def __contains__(self, guess):
+        return 0 <= guess < len(self.lookup) and self.lookup[guess] > 0
+
+    def payout(self, guess):
+        """
+        Look up the payout for a single guess.
+
+        :param guess: Dice guess
+        :type guess: int
+        :return: float
+        """
+        return float(self.lookup[guess])
+
+    def settle(self, guesses, wagered, rolls):
+        """
+        Determine the winners, payouts and nets for an array of bets. This
+        follows the same rules as Bet.is_winner, Bet.determine_payout and
+        Bet.calculate_net.
+
+        :param guesses: Dice guesses
+        :type guesses: Numpy array or list
+        :param wagered: Amount of coins wagered
+        :type wagered: Numpy array or list
+        :param rolls: Dice rolls
+        :type rolls: Numpy array or list
+        :return: Tuple of is_winner, payout and net numpy arrays
+        """
+        guesses = np.asarray(guesses, dtype=np.int64)
+        wagered = np.asarray(wagered, dtype=np.int64)
+
+        is_winner = guesses == np.asarray(rolls)
+        payout = np.where(is_winner, self.lookup[guesses], 1.0)
+        net = np.where(is_winner, (wagered * payout).astype(np.int64),
+                       -wagered)
+
+        return is_winner, payout, net
+
+
+def get_payout_table(payouts):
+    """
+    Return a payout table, they only get built once per set of payouts.
+
+    :param payouts: Payout multiplier for each guess
+    :type payouts: dict
+    :return: PayoutTable
+    """
+    key = tuple(sorted((str(guess), float(payout))
+                       for guess, payout in payouts.items()))
+
+    if key not in _payout_tables:
+        _payout_tables[key] = PayoutTable(payouts)
+
+    return _payout_tables[key]
@@ -0,0 +1,188 @@
+from sqlalchemy import text
+
+from lib.util_datetime import tzware_datetime
+from snakeeyes.extensions import db
+from snakeeyes.blueprints.bet.models import leaderboard
+from snakeeyes.blueprints.bet.models.bet import Bet
+from snakeeyes.blueprints.bet.models.dice import roll, roll_pairs
+from snakeeyes.blueprints.user import cache as user_cache
+from snakeeyes.blueprints.bet.models.stats import (
+    UPSERT_BET_STATS_SQL,
+    BetStats
+)
+
+# Debit / credit the user and record the bet in a single statement. The coin
+# check lives in the UPDATE's WHERE clause so Postgres' row lock serializes
+# concurrent bets for the same user, which means the balance can never go
+# negative no matter how many workers are placing bets at once. The user's
+# bet stats get rolled up by the same statement.
+SETTLE_BET_SQL = text("""
+WITH settled AS (
+    UPDATE users
+    SET coins = coins + :net, last_bet_on = :now, updated_on = :now
+    WHERE id = :user_id AND coins >= :wagered
+    RETURNING id, coins
+), placed AS (
+    INSERT INTO bets (created_on, updated_on, user_id, guess, die_1, die_2,
+                      roll, wagered, payout, net)
+    SELECT :now, :now, settled.id, :guess, :die_1, :die_2, :roll, :wagered,
+           :payout, :net
+    FROM settled
+    RETURNING id
+), {0}
+SELECT placed.id, settled.coins FROM placed, settled
+""".format(UPSERT_BET_STATS_SQL))
+
+# Same idea as above except every bet in the batch gets inserted at once by
+# unnesting parallel arrays, and the user's coins only get touched once. The
+# user must be able to cover every wager in the batch up front.
+SETTLE_BETS_SQL = text("""
+WITH settled AS (
+    UPDATE users
+    SET coins = coins + :net, last_bet_on = :now, updated_on = :now
+    WHERE id = :user_id AND coins >= :wagered
+    RETURNING id, coins
+), placed AS (
+    INSERT INTO bets (created_on, updated_on, user_id, guess, die_1, die_2,
+                      roll, wagered, payout, net)
+    SELECT :now, :now, settled.id, b.guess, b.die_1, b.die_2, b.roll,
+           b.wagered, b.payout, b.net
+    FROM settled, unnest(:guesses, :dice_1, :dice_2, :rolls, :wagers,
+                         :payouts, :nets)
+         AS b(guess, die_1, die_2, roll, wagered, payout, net)
+), {0}
+SELECT coins FROM settled
+""".format(UPSERT_BET_STATS_SQL))
+
+
+def _roll_bet(user_id, guess, wagered, payout):
+    """
+    Roll the dice for a bet and work out what it's worth.
+
+    :param user_id: User placing the bet
+    :type user_id: int
+    :param guess: Dice guess
+    :type guess: int
+    :param wagered: Amount of coins wagered
+    :type wagered: int
+    :param payout: Payout multiplier for the guess
+    :type payout: float
+    :return: Tuple of the bet's columns and whether or not it won
+    """
+    die_1 = roll()
+    die_2 = roll()
+    outcome = die_1 + die_2
+    is_winner = Bet.is_winner(guess, outcome)
+    payout = Bet.determine_payout(payout, is_winner)
+    net = Bet.calculate_net(wagered, payout, is_winner)
+
+    params = {
+        'user_id': user_id,
+        'guess': guess,
+        'die_1': die_1,
+        'die_2': die_2,
+        'roll': outcome,
+        'wagered': wagered,
+        'payout': payout,
+        'net': net
+    }
+
+    return params, is_winner
+
+
+def settle_bet(user_id, guess, wagered, payout):
+    """
+    Roll the dice and settle a bet in 1 transaction and 1 round trip.
+
+    :param user_id: User placing the bet
+    :type user_id: int
+    :param guess: Dice guess
+    :type guess: int
+    :param wagered: Amount of coins wagered
+    :type wagered: int
+    :param payout: Payout multiplier for the guess
+    :type payout: float
+    :return: Tuple of the settled bet and the user's new coins, or None if
+             the user could not cover the wager
+    """
+    if wagered < 1:
+        return None
+
+    params, is_winner = _roll_bet(user_id, guess, wagered, payout)
+    stats = BetStats.tally([guess], [is_winner], [params['net']])
+
+    now = tzware_datetime()
+    result = db.session.execute(SETTLE_BET_SQL,
+                                dict(params, now=now, **stats)).first()
+    db.session.commit()
+
+    if result is None:
+        return None
+
+    user_cache.invalidate(user_id)
+    leaderboard.record_bet(user_id, params['net'], result[1], now)
+
+    bet = Bet(id=result[0], created_on=now, updated_on=now, **params)
+
+    return bet, result[1]
+
+
+def settle_bets(user_id, wagers, payout_table):
+    """
+    Roll the dice for a batch of bets and settle all of them in 1 transaction
+    with a bulk insert and a single update to the user's coins.
+
+    :param user_id: User placing the bets
+    :type user_id: int
+    :param wagers: List of (guess, wagered) pairs
+    :type wagers: list
+    :param payout_table: Payouts to settle the bets with
+    :type payout_table: PayoutTable
+    :return: Tuple of the settled bets and the user's new coins, or None if
+             the user could not cover every wager
+    """
+    if not wagers or any(wagered < 1 for _, wagered in wagers):
+        return None
+
+    guesses = [guess for guess, _ in wagers]
+    wagered = [amount for _, amount in wagers]
+
+    dice_1, dice_2 = roll_pairs(len(wagers))
+    rolls = dice_1 + dice_2
+    is_winner, payouts, nets = payout_table.settle(guesses, wagered, rolls)
+
+    params = {
+        'user_id': user_id,
+        'wagered': sum(wagered),
+        'net': int(nets.sum()),
+        'now': tzware_datetime(),
+        'guesses': guesses,
+        'dice_1': dice_1.tolist(),
+        'dice_2': dice_2.tolist(),
+        'rolls': rolls.tolist(),
+        'wagers': wagered,
+        'payouts': payouts.tolist(),
+        'nets': nets.tolist()
+    }
+    params.update(BetStats.tally(guesses, is_winner, nets))
+
+    result = db.session.execute(SETTLE_BETS_SQL, params).first()
+    db.session.commit()
+
+    if result is None:
+        return None
+
+    now = params['now']
+    user_cache.invalidate(user_id)
+    leaderboard.record_bet(user_id, params['net'], result[0], now)
+
+    columns = zip(params['guesses'], params['dice_1'], params['dice_2'],
+                  params['rolls'], params['wagers'], params['payouts'],
+                  params['nets'])
+
+    bets = [Bet(user_id=user_id, created_on=now, updated_on=now,
+                guess=guess, die_1=die_1, die_2=die_2, roll=outcome,
+                wagered=wagered, payout=payout, net=net)
+            for guess, die_1, die_2, outcome, wagered, payout, net in columns]
+
+    return bets, result[0]
@@ -0,0 +1,41 @@
+import numpy as np
+
+from snakeeyes.blueprints.bet.models.dice import roll_pairs
+from snakeeyes.blueprints.bet.models.payout import PayoutTable
+
+
+def simulate_chunk(task):
+    """
+    Roll a chunk of bets and settle them against every guess in a payout
+    table. Every guess shares the same rolls which makes comparing them fair.
+
+    This gets sent to worker processes, which is why it takes a single tuple
+    and lives in an importable module.
+
+    :param task: Tuple of (table name, payouts, bets, wager, bankroll, rounds)
+    :type task: tuple
+    :return: Tuple of the table name and, for each guess, an array of
+             [bets, net, net squared, sessions, ruined sessions]
+    """
+    name, payouts, count, wager, bankroll, rounds = task
+
+    table = PayoutTable(payouts)
+    dice_1, dice_2 = roll_pairs(count)
+    rolls = dice_1 + dice_2
+    sessions = count // rounds
+
+    totals = {}
+
+    for guess in sorted(int(key) for key in payouts):
+        _, _, net = table.settle(guess, wager, rolls)
+
+        # A session is ruined once the player can no longer cover the wager.
+        balances = bankroll + np.cumsum(
+            net[:sessions * rounds].reshape(sessions, rounds), axis=1)
+        ruined = int((balances.min(axis=1) < wager).sum()) if sessions else 0
+
+        totals[guess] = np.array([count, net.sum(),
+                                  np.square(net, dtype=np.float64).sum(),
+                                  sessions, ruined], dtype=np.float64)
+
+    return name, totals
@@ -0,0 +1,241 @@
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from lib.util_sqlalchemy import ResourceMixin
+from snakeeyes.extensions import db
+
+# Histograms are indexed by the guess, so they need a slot for 0 through 12.
+HISTOGRAM_SIZE = 13
+
+# Fold a settled bet (or batch of bets) into the user's running stats. This
+# is meant to be added as a CTE next to the settlement's "settled" CTE so it
+# happens in the same statement and transaction as the bets themselves.
+#
+# Streaks are signed, 3 means 3 wins in a row and -3 means 3 losses in a row.
+# A batch only extends the current streak if every bet in it went the same
+# way as the streak, otherwise the batch's own trailing streak takes over.
+UPSERT_BET_STATS_SQL = """
+stats AS (
+    INSERT INTO bet_stats AS s (created_on, updated_on, user_id, bets,
+                                wagered, net, wins, biggest_win,
+                                current_streak, longest_win_streak,
+                                guess_counts, guess_wins)
+    SELECT :now, :now, settled.id, :stats_bets, :wagered, :net, :stats_wins,
+           :stats_biggest_win, :stats_streak, :stats_longest_win_streak,
+           :stats_guess_counts, :stats_guess_wins
+    FROM settled
+    ON CONFLICT (user_id) DO UPDATE SET
+        updated_on = EXCLUDED.updated_on,
+        bets = s.bets + EXCLUDED.bets,
+        wagered = s.wagered + EXCLUDED.wagered,
+        net = s.net + EXCLUDED.net,
+        wins = s.wins + EXCLUDED.wins,
+        biggest_win = GREATEST(s.biggest_win, EXCLUDED.biggest_win),
+        current_streak = CASE
+            WHEN :stats_unbroken
+                 AND sign(s.current_streak) = sign(EXCLUDED.current_streak)
+            THEN s.current_streak + EXCLUDED.current_streak
+            ELSE EXCLUDED.current_streak
+        END,
+        longest_win_streak = GREATEST(s.longest_win_streak,
+                                      EXCLUDED.longest_win_streak,
+                                      s.current_streak
+                                      + :stats_leading_wins),
+        guess_counts = ARRAY(
+            SELECT a + b
+            FROM unnest(s.guess_counts, EXCLUDED.guess_counts)
+                 WITH ORDINALITY AS h(a, b, i)
+            ORDER BY i
+        ),
+        guess_wins = ARRAY(
+            SELECT a + b
+            FROM unnest(s.guess_wins, EXCLUDED.guess_wins)
+                 WITH ORDINALITY AS h(a, b, i)
+            ORDER BY i
+        )
+)"""
+
+# Recalculate everyone's stats from scratch by scanning the bets table. This
+# is only needed to backfill stats for bets that were inserted directly, such
+# as the fake bets generated by the CLI.
+REBUILD_BET_STATS_SQL = """
+INSERT INTO bet_stats (created_on, updated_on, user_id, bets, wagered, net,
+                       wins, biggest_win, current_streak, longest_win_streak,
+                       guess_counts, guess_wins)
+WITH ordered AS (
+    SELECT user_id, guess, wagered, net, guess = roll AS won,
+           row_number() OVER (PARTITION BY user_id
+                              ORDER BY created_on, id) AS position
+    FROM bets
+), runs AS (
+    SELECT user_id, won, count(*) AS length, max(position) AS last
+    FROM (
+        SELECT user_id, won, position,
+               position - row_number() OVER (PARTITION BY user_id, won
+                                             ORDER BY position) AS run
+        FROM ordered
+    ) AS r
+    GROUP BY user_id, won, run
+), streaks AS (
+    SELECT DISTINCT ON (user_id) user_id,
+           CASE WHEN won THEN length ELSE -length END AS current_streak
+    FROM runs
+    ORDER BY user_id, last DESC
+), longest AS (
+    SELECT user_id, max(length) AS longest_win_streak
+    FROM runs
+    WHERE won
+    GROUP BY user_id
+), totals AS (
+    SELECT user_id, count(*) AS bets, sum(wagered) AS wagered,
+           sum(net) AS net, count(*) FILTER (WHERE won) AS wins,
+           coalesce(max(net) FILTER (WHERE won), 0) AS biggest_win
+    FROM ordered
+    GROUP BY user_id
+), per_guess AS (
+    SELECT user_id, guess, count(*) AS bets,
+           count(*) FILTER (WHERE won) AS wins
+    FROM ordered
+    GROUP BY user_id, guess
+), histograms AS (
+    SELECT t.user_id,
+           array_agg(coalesce(g.bets, 0) ORDER BY slot.guess)
+             AS guess_counts,
+           array_agg(coalesce(g.wins, 0) ORDER BY slot.guess) AS guess_wins
+    FROM totals AS t
+    CROSS JOIN generate_series(0, :last_slot) AS slot(guess)
+    LEFT JOIN per_guess AS g
+           ON g.user_id = t.user_id AND g.guess = slot.guess
+    GROUP BY t.user_id
+)
+SELECT now(), now(), t.user_id, t.bets, t.wagered, t.net, t.wins,
+       t.biggest_win, streaks.current_streak,
+       coalesce(longest.longest_win_streak, 0), h.guess_counts, h.guess_wins
+FROM totals AS t
+JOIN streaks USING (user_id)
+JOIN histograms AS h USING (user_id)
+LEFT JOIN longest USING (user_id)
+"""
+
+
+class BetStats(ResourceMixin, db.Model):
+    __tablename__ = 'bet_stats'
+
+    # Relationships.
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id',
+                                                  onupdate='CASCADE',
+                                                  ondelete='CASCADE'),
+                        primary_key=True)
+
+    # Running totals.
+    bets = db.Column(db.BigInteger(), nullable=False, server_default='0')
+    wagered = db.Column(db.BigInteger(), nullable=False, server_default='0')
+    net = db.Column(db.BigInteger(), nullable=False, server_default='0')
+    wins = db.Column(db.BigInteger(), nullable=False, server_default='0')
+    biggest_win = db.Column(db.BigInteger(), nullable=False,
+                            server_default='0')
+    current_streak = db.Column(db.Integer(), nullable=False,
+                               server_default='0')
+    longest_win_streak = db.Column(db.Integer(), nullable=False,
+                                   server_default='0')
+
+    # Bets and wins per guess, indexed by the guess.
+    guess_counts = db.Column(postgresql.ARRAY(db.BigInteger()),
+                             nullable=False)
+    guess_wins = db.Column(postgresql.ARRAY(db.BigInteger()), nullable=False)
+
+    def __init__(self, **kwargs):
+        # Call Flask-SQLAlchemy's constructor.
+        super(BetStats, self).__init__(**kwargs)
+
+    @classmethod
+    def tally(cls, guesses, is_winner, nets):
+        """
+        Summarize a batch of settled bets into the parameters needed by
+        UPSERT_BET_STATS_SQL. The bets must be in the order they were placed.
+
+        :param guesses: Dice guesses
+        :type guesses: Numpy array or list
+        :param is_winner: Whether or not each bet won
+        :type is_winner: Numpy array or list
+        :param nets: Net won or lost for each bet
+        :type nets: Numpy array or list
+        :return: dict
+        """
+        guesses = np.asarray(guesses, dtype=np.int64)
+        is_winner = np.asarray(is_winner, dtype=bool)
+        nets = np.asarray(nets, dtype=np.int64)
+
+        # Split the outcomes into runs of consecutive wins or losses.
+        run_starts = np.concatenate(
+            ([0], np.flatnonzero(is_winner[1:] != is_winner[:-1]) + 1))
+        run_lengths = np.diff(np.append(run_starts, len(is_winner)))
+        run_won = is_winner[run_starts]
+
+        trailing = int(run_lengths[-1])
+        win_runs = run_lengths[run_won]
+
+        params = {
+            'stats_bets': len(guesses),
+            'stats_wins': int(is_winner.sum()),
+            'stats_biggest_win': int(nets[is_winner].max())
+            if is_winner.any() else 0,
+            'stats_streak': trailing if run_won[-1] else -trailing,
+            'stats_unbroken': len(run_starts) == 1,
+            'stats_leading_wins': int(run_lengths[0]) if run_won[0] else 0,
+            'stats_longest_win_streak': int(win_runs.max())
+            if len(win_runs) else 0,
+            'stats_guess_counts': np.bincount(
+                guesses, minlength=HISTOGRAM_SIZE).tolist(),
+            'stats_guess_wins': np.bincount(
+                guesses[is_winner], minlength=HISTOGRAM_SIZE).tolist()
+        }
+
+        return params
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Recalculate every user's stats from their bets.
+
+        :return: None
+        """
+        db.session.execute('TRUNCATE bet_stats')
+        db.session.execute(text(REBUILD_BET_STATS_SQL),
+                           {'last_slot': HISTOGRAM_SIZE - 1})
+        db.session.commit()
+
+        return None
+
+    @property
+    def losses(self):
+        """
+        Return how many bets were lost.
+
+        :return: int
+        """
+        return self.bets - self.wins
+
+    @property
+    def win_rate(self):
+        """
+        Return the percentage of bets that were won.
+
+        :return: float
+        """
+        if not self.bets:
+            return 0.0
+
+        return self.wins * 100.0 / self.bets
+
+    def favorite_guess(self):
+        """
+        Return the guess that was bet on the most, if any.
+
+        :return: int or None
+        """
+        if not self.bets:
+            return None
+
+        return max(range(HISTOGRAM_SIZE), key=lambda i: self.guess_counts[i])
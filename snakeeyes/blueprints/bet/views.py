@@ -2,11 +2,23 @@ from flask import Blueprint, current_app, render_template, request
 from flask_login import current_user, login_required
 
 from lib.util_json import render_json
+from lib.util_sqlalchemy import keyset_paginate
 from snakeeyes.extensions import limiter
 from snakeeyes.blueprints.bet.decorators import coins_required
 from snakeeyes.blueprints.bet.forms import BetForm
+from snakeeyes.blueprints.bet.models import leaderboard
 from snakeeyes.blueprints.bet.models.bet import Bet
-from snakeeyes.blueprints.bet.models.dice import roll
+from snakeeyes.blueprints.bet.models.payout import get_payout_table
+from snakeeyes.blueprints.bet.models.settlement import (
+    settle_bet,
+    settle_bets
+)
+
+try:
+    # Python 2 decodes large JSON integers as long.
+    INTEGER_TYPES = (int, long)  # noqa
+except NameError:
+    INTEGER_TYPES = (int,)
 
 bet = Blueprint('bet', __name__, template_folder='templates',
                 url_prefix='/bet')
@@ -27,7 +39,8 @@ def place_bet():
         recent_bets = Bet.query.filter(Bet.user_id == current_user.id) \
             .order_by(Bet.created_on.desc()).limit(10)
 
-        return render_template('bet/place_bet.html', recent_bets=recent_bets)
+        return render_template('bet/place_bet.html', recent_bets=recent_bets,
+                               stats=current_user.bet_stats)
 
     form = BetForm()
 
@@ -35,31 +48,15 @@ def place_bet():
         guess = int(request.form.get('guess'))
         wagered = int(request.form.get('wagered'))
 
-        if wagered > current_user.coins:
+        payout_table = get_payout_table(current_app.config['DICE_ROLL_PAYOUT'])
+        settled = settle_bet(current_user.id, guess, wagered,
+                             payout_table.payout(guess))
+
+        if settled is None:
             error = 'You cannot wager more than your total coins.'
             return render_json(400, {'error': error})
 
-        payout = float(current_app.config['DICE_ROLL_PAYOUT'][str(guess)])
-        die_1 = roll()
-        die_2 = roll()
-        outcome = die_1 + die_2
-        is_winner = Bet.is_winner(guess, outcome)
-        payout = Bet.determine_payout(payout, is_winner)
-        net = Bet.calculate_net(wagered, payout, is_winner)
-
-        params = {
-          'user_id': current_user.id,
-          'guess': guess,
-          'die_1': die_1,
-          'die_2': die_2,
-          'roll': outcome,
-          'wagered': wagered,
-          'payout': payout,
-          'net': net
-        }
-
-        bet = Bet(**params)
-        bet.save_and_update_user(current_user)
+        bet = settled[0]
 
         return render_json(200, {'data': bet.to_json()})
     else:
@@ -67,12 +64,100 @@ def place_bet():
                            {'error': 'You need to wager at least 1 coin.'})
 
 
-@bet.route('/history', defaults={'page': 1})
-@bet.route('/history/page/<int:page>')
-def history(page):
-    paginated_bets = Bet.query \
-        .filter(Bet.user_id == current_user.id) \
-        .order_by(Bet.created_on.desc()) \
-        .paginate(page, 50, True)
+@bet.route('/place_batch', methods=['POST'])
+@coins_required
+@limiter.limit('3/second')
+def place_batch():
+    if not isinstance(request.json, dict) or \
+            not isinstance(request.json.get('bets'), list):
+        return render_json(406, {'error': 'Expected a JSON list of bets.'})
+
+    max_bets = current_app.config['BET_BATCH_MAX_BETS']
+    max_wager = current_app.config['BET_BATCH_MAX_WAGER']
+    payout_table = get_payout_table(current_app.config['DICE_ROLL_PAYOUT'])
+
+    wagers = []
+
+    for item in request.json['bets'][:max_bets + 1]:
+        wager = _parse_wager(item, payout_table, max_wager)
+
+        if wager is None:
+            error = 'Each bet needs a guess (2-12) and between 1 and {0} ' \
+                    'coins.'.format(max_wager)
+            return render_json(400, {'error': error})
+
+        wagers.append(wager)
+
+    if not wagers or len(wagers) > max_bets:
+        error = 'You can place between 1 and {0} bets at once.'.format(
+            max_bets)
+        return render_json(400, {'error': error})
+
+    settled = settle_bets(current_user.id, wagers, payout_table)
+
+    if settled is None:
+        error = 'You cannot wager more than your total coins.'
+        return render_json(400, {'error': error})
+
+    bets, coins = settled
+
+    return render_json(200, {'data': [bet.to_json() for bet in bets],
+                             'coins': coins})
+
+
+def _parse_wager(item, payout_table, max_wager):
+    """
+    Validate a bet of a batch, it must be a [guess, wagered] list of JSON
+    integers. Nothing gets coerced, so "57", 7.9 or true are all rejected.
+
+    :param item: Bet as it was sent
+    :param payout_table: Payout table
+    :type payout_table: PayoutTable
+    :param max_wager: Most coins a single bet can wager
+    :type max_wager: int
+    :return: Tuple of the guess and wagered coins or None if it is invalid
+    """
+    if not isinstance(item, list) or len(item) != 2:
+        return None
+
+    for value in item:
+        if isinstance(value, bool) or not isinstance(value, INTEGER_TYPES):
+            return None
+
+    guess, wagered = item
+
+    if guess not in payout_table or not 1 <= wagered <= max_wager:
+        return None
+
+    return guess, wagered
+
+
+@bet.route('/history')
+def history():
+    query = Bet.query.filter(Bet.user_id == current_user.id)
+    paginated_bets = keyset_paginate(query, Bet.created_on, Bet.id,
+                                     cursor=request.args.get('cursor'))
 
     return render_template('bet/history.html', bets=paginated_bets)
+
+
+@bet.route('/leaderboard', defaults={'page': 1})
+@bet.route('/leaderboard/page/<int:page>')
+def leaderboard_standings(page):
+    board = request.args.get('board', 'net')
+    window = request.args.get('window', 'all')
+
+    if board not in leaderboard.BOARDS:
+        board = 'net'
+
+    if board == 'coins' or window not in leaderboard.WINDOWS:
+        window = 'all'
+
+    standings = leaderboard.top(board, window, page,
+                                current_app.config['LEADERBOARD_PER_PAGE'])
+    user_rank = leaderboard.rank(current_user.id, board, window)
+
+    return render_template('bet/leaderboard.html', standings=standings,
+                           user_rank=user_rank, board=board, window=window,
+                           boards=leaderboard.BOARDS,
+                           windows=leaderboard.WINDOWS)
@@ -4,6 +4,8 @@ import stripe
 from flask import redirect, url_for, flash
 from flask_login import current_user
 
+from snakeeyes.blueprints.billing.gateways import breaker
+
 
 def subscription_required(f):
     """
@@ -21,6 +23,24 @@ def subscription_required(f):
     return decorated_function
 
 
+def payment_gateway_required(f):
+    """
+    Fail fast while the payment gateway breaker is open, rather than letting
+    someone fill in a form that can't go through. It raises the same error a
+    failed gateway call would so handle_stripe_exceptions can deal with it.
+
+    :return: Function
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if breaker.state() == 'open':
+            raise breaker.CircuitOpen('Our payment gateway is unavailable.')
+
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
 def handle_stripe_exceptions(f):
     """
     Handle Stripe exceptions so they do not throw 500s.
@@ -0,0 +1,222 @@
+import math
+import time
+from collections import OrderedDict
+
+import stripe
+from flask import current_app, has_app_context
+from redis import RedisError
+
+from snakeeyes.extensions import redis
+
+STATES = OrderedDict([
+    ('closed', 'Closed'),
+    ('open', 'Open'),
+    ('half_open', 'Half open')
+])
+
+
+class CircuitOpen(stripe.error.APIConnectionError):
+    """
+    The payment gateway has been failing, so calls fail right away instead of
+    tying up a worker waiting on it. It is a connection error so everything
+    that already handles those keeps working.
+    """
+    pass
+
+
+def _key(name):
+    """
+    Return the Redis key of a piece of breaker state.
+
+    :param name: What the key holds
+    :type name: str
+    :return: str
+    """
+    return '{0}:{1}'.format(
+        current_app.config['PAYMENT_GATEWAY_BREAKER_KEY_PREFIX'], name)
+
+
+def _window_key():
+    """
+    Return the Redis key counting calls in the current window, older windows
+    expire on their own.
+
+    :return: str
+    """
+    window = current_app.config['PAYMENT_GATEWAY_BREAKER_WINDOW']
+
+    return _key('window:{0}'.format(int(time.time() // window)))
+
+
+def _enabled():
+    """
+    The breaker only guards calls made with an app, CLI scripts without one
+    always go through.
+
+    :return: bool
+    """
+    return has_app_context() and \
+        bool(current_app.config['PAYMENT_GATEWAY_BREAKER_ERROR_RATE'])
+
+
+def state():
+    """
+    Return the state of the breaker. It is shared by every process through
+    Redis and counts as closed if Redis can't be reached.
+
+    :return: str, one of STATES
+    """
+    try:
+        opened, tripped = redis.mget(_key('open'), _key('tripped'))
+    except RedisError:
+        return 'closed'
+
+    if opened:
+        return 'open'
+
+    if tripped:
+        return 'half_open'
+
+    return 'closed'
+
+
+def allow():
+    """
+    Make sure a gateway call may go through. Once the breaker has been open
+    for PAYMENT_GATEWAY_BREAKER_COOLDOWN it lets 1 trial call through at a
+    time to find out if the gateway recovered.
+
+    :return: None
+    """
+    if not _enabled():
+        return None
+
+    current = state()
+
+    if current == 'closed':
+        return None
+
+    if current == 'half_open' and _claim_trial():
+        return None
+
+    raise CircuitOpen('Our payment gateway is unavailable right now.')
+
+
+def record(elapsed, failed=False):
+    """
+    Count the outcome of a gateway call, calls slower than
+    PAYMENT_GATEWAY_SLOW_CALL count as failed since waiting on them is
+    what ties up workers.
+
+    The breaker opens once PAYMENT_GATEWAY_BREAKER_ERROR_RATE of the calls
+    in a window failed, and closes again once a trial call succeeds.
+
+    :param elapsed: Seconds the call took
+    :type elapsed: float
+    :param failed: Whether or not the call failed
+    :type failed: bool
+    :return: None
+    """
+    if not _enabled():
+        return None
+
+    config = current_app.config
+    failed = failed or elapsed > config['PAYMENT_GATEWAY_SLOW_CALL']
+    current = state()
+
+    if current == 'half_open':
+        if failed:
+            trip()
+        else:
+            _close()
+
+        return None
+
+    if current == 'open':
+        return None
+
+    window_key = _window_key()
+
+    try:
+        pipeline = redis.pipeline(transaction=False)
+        pipeline.hincrby(window_key, 'calls', 1)
+        pipeline.hincrby(window_key, 'failures', int(failed))
+        pipeline.expire(window_key,
+                        config['PAYMENT_GATEWAY_BREAKER_WINDOW'] * 2)
+        calls, failures, _ = pipeline.execute()
+    except RedisError:
+        return None
+
+    if calls >= config['PAYMENT_GATEWAY_BREAKER_MIN_CALLS'] and \
+            failures >= calls * config['PAYMENT_GATEWAY_BREAKER_ERROR_RATE']:
+        trip()
+
+    return None
+
+
+def reset():
+    """
+    Close the breaker and forget every call it counted.
+
+    :return: None
+    """
+    try:
+        redis.delete(_key('open'), _key('tripped'), _key('trial'),
+                     _window_key())
+    except RedisError:
+        current_app.logger.exception('Could not reset the gateway breaker.')
+
+    return None
+
+
+def _claim_trial():
+    """
+    Make sure only 1 trial call is in flight at a time. The claim outlives
+    the slowest call that the gateway client waits on, otherwise a second
+    trial could start while the first one is still waiting.
+
+    :return: bool
+    """
+    config = current_app.config
+    timeout = config['PAYMENT_GATEWAY_CONNECT_TIMEOUT'] + \
+        max(config['PAYMENT_GATEWAY_TIMEOUTS'].values())
+
+    try:
+        return bool(redis.set(_key('trial'), 1, nx=True,
+                              ex=max(1, int(math.ceil(timeout)))))
+    except RedisError:
+        return False
+
+
+def trip():
+    """
+    Open the breaker, this also takes the gateway out of service by hand.
+
+    :return: None
+    """
+    cooldown = current_app.config['PAYMENT_GATEWAY_BREAKER_COOLDOWN']
+
+    try:
+        pipeline = redis.pipeline()
+        pipeline.setex(_key('open'), max(1, cooldown), int(time.time()))
+        pipeline.set(_key('tripped'), 1)
+        pipeline.delete(_key('trial'), _window_key())
+        pipeline.execute()
+    except RedisError:
+        return None
+
+    current_app.logger.warning('Payment gateway breaker opened.')
+
+    return None
+
+
+def _close():
+    """
+    Close the breaker after the gateway recovered.
+
+    :return: None
+    """
+    reset()
+    current_app.logger.warning('Payment gateway breaker closed.')
+
+    return None
@@ -0,0 +1,108 @@
+import random
+import time
+from multiprocessing.pool import ThreadPool
+
+import stripe
+from flask import current_app, has_app_context
+
+from snakeeyes.blueprints.billing.gateways.breaker import CircuitOpen
+
+# Errors where the same request may well go through if it is sent again.
+RETRYABLE_ERRORS = (
+    stripe.error.APIConnectionError,
+    stripe.error.RateLimitError,
+    stripe.error.APIError
+)
+
+
+def call_with_retry(func, args=(), retries=3, backoff=0.5):
+    """
+    Call the payment gateway, retrying with jittered exponential backoff when
+    it fails in a way that is worth retrying.
+
+    :param func: Gateway function to call
+    :type func: function
+    :param args: Arguments to call it with
+    :type args: tuple
+    :param retries: How many times to retry
+    :type retries: int
+    :param backoff: Seconds to wait before the first retry, it doubles after
+                    every retry
+    :type backoff: float
+    :return: The function's result
+    """
+    attempt = 0
+
+    while True:
+        try:
+            return func(*args)
+        except CircuitOpen:
+            # Retrying can't help until the breaker closes.
+            raise
+        except RETRYABLE_ERRORS:
+            if attempt >= retries:
+                raise
+
+            time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+            attempt += 1
+
+
+def call_each(func, calls, workers=8, retries=3, backoff=0.5):
+    """
+    Make many payment gateway calls concurrently with a bounded amount of
+    threads. The calls spend nearly all of their time waiting on the network
+    so threads are plenty.
+
+    A failed call never stops the others, its error is returned instead.
+
+    :param func: Gateway function to call
+    :type func: function
+    :param calls: Arguments to call the function with, keyed by anything
+                  that identifies the call such as a model id
+    :type calls: dict
+    :param workers: How many calls can be in flight at once
+    :type workers: int
+    :param retries: How many times to retry each call
+    :type retries: int
+    :param backoff: Seconds to wait before the first retry of a call
+    :type backoff: float
+    :return: Tuple of the results and the errors, both keyed like the calls
+    """
+    if not calls:
+        return {}, {}
+
+    # Calls are made with the caller's app so the gateway breaker guards them.
+    app = current_app._get_current_object() if has_app_context() else None
+
+    def call(item):
+        key, args = item
+
+        try:
+            if app is None:
+                result = call_with_retry(func, args, retries, backoff)
+            else:
+                with app.app_context():
+                    result = call_with_retry(func, args, retries, backoff)
+
+            return key, result, None
+        except stripe.error.StripeError as e:
+            return key, None, e
+
+    pool = ThreadPool(max(1, min(workers, len(calls))))
+
+    try:
+        outcomes = pool.map(call, calls.items())
+    finally:
+        pool.close()
+        pool.join()
+
+    results = {}
+    errors = {}
+
+    for key, result, error in outcomes:
+        if error is None:
+            results[key] = result
+        else:
+            errors[key] = error
+
+    return results, errors
@@ -0,0 +1,133 @@
+import json
+import time
+
+from flask import current_app
+from redis import RedisError
+
+from snakeeyes.extensions import redis
+
+# Every kind of gateway response that gets cached per customer.
+CACHED_RESPONSES = ('upcoming_invoice',)
+
+
+def key(name, customer_id):
+    """
+    Return the Redis key of a customer's cached gateway response.
+
+    :param name: What the response is, such as upcoming_invoice
+    :type name: str
+    :param customer_id: Stripe customer id
+    :type customer_id: str
+    :return: str
+    """
+    return 'gateway:{0}:{1}'.format(name, customer_id)
+
+
+def store(name, customer_id, response):
+    """
+    Cache a gateway response, it must be JSON serializable which Stripe
+    objects are.
+
+    :param name: What the response is, such as upcoming_invoice
+    :type name: str
+    :param customer_id: Stripe customer id
+    :type customer_id: str
+    :param response: Gateway response
+    :type response: dict
+    :return: None
+    """
+    ttl = current_app.config['GATEWAY_CACHE_TTL']
+
+    if not ttl:
+        return None
+
+    entry = json.dumps({'fetched_on': time.time(), 'response': response})
+
+    try:
+        redis.setex(key(name, customer_id), ttl, entry)
+    except RedisError:
+        current_app.logger.exception('Could not cache a gateway response.')
+
+    return None
+
+
+def _claim_refresh(name, customer_id):
+    """
+    Make sure only 1 refresh of a stale response gets queued up at a time.
+
+    :param name: What the response is, such as upcoming_invoice
+    :type name: str
+    :param customer_id: Stripe customer id
+    :type customer_id: str
+    :return: bool
+    """
+    lock_key = '{0}:refreshing'.format(key(name, customer_id))
+    lock_ttl = current_app.config['GATEWAY_CACHE_FRESH_FOR']
+
+    try:
+        return bool(redis.set(lock_key, 1, nx=True, ex=max(1, lock_ttl)))
+    except RedisError:
+        return False
+
+
+def fetch(name, customer_id, func, refresh=None):
+    """
+    Return a customer's cached gateway response, only calling the gateway
+    when nothing is cached.
+
+    Responses older than GATEWAY_CACHE_FRESH_FOR are still returned right
+    away, refresh gets called to fetch a new one in the background so the
+    request never has to wait on the gateway.
+
+    :param name: What the response is, such as upcoming_invoice
+    :type name: str
+    :param customer_id: Stripe customer id
+    :type customer_id: str
+    :param func: Call the gateway with the customer id
+    :type func: function
+    :param refresh: Queue up a refresh with the customer id
+    :type refresh: function
+    :return: Gateway response
+    """
+    if not current_app.config['GATEWAY_CACHE_TTL']:
+        return func(customer_id)
+
+    try:
+        cached = redis.get(key(name, customer_id))
+    except RedisError:
+        cached = None
+
+    if cached is not None:
+        entry = json.loads(cached.decode('utf-8'))
+        age = time.time() - entry['fetched_on']
+
+        if refresh and age > current_app.config['GATEWAY_CACHE_FRESH_FOR'] \
+                and _claim_refresh(name, customer_id):
+            refresh(customer_id)
+
+        return entry['response']
+
+    response = func(customer_id)
+    store(name, customer_id, response)
+
+    return response
+
+
+def invalidate(customer_id):
+    """
+    Forget every cached gateway response of a customer, this should happen
+    whenever something changes what the gateway would respond with.
+
+    :param customer_id: Stripe customer id
+    :type customer_id: str
+    :return: None
+    """
+    if not customer_id:
+        return None
+
+    try:
+        redis.delete(*[key(name, customer_id) for name in CACHED_RESPONSES])
+    except RedisError:
+        current_app.logger.exception('Could not invalidate gateway responses.')
+
+    return None
@@ -1,3 +1,5 @@
+import uuid
+
 import stripe
 
 
@@ -20,7 +22,8 @@ class Event(object):
 
 class Customer(object):
     @classmethod
-    def create(cls, token=None, email=None, coupon=None, plan=None):
+    def create(cls, token=None, email=None, coupon=None, plan=None,
+               idempotency_key=None):
         """
         Create a new customer.
 
@@ -35,11 +38,15 @@ class Customer(object):
         :type coupon: str
         :param plan: Plan identifier
         :type plan: str
+        :param idempotency_key: Sending the same key again won't create
+                                another customer, defaults to a random key
+        :type idempotency_key: str
         :return: Stripe customer
         """
         params = {
             'source': token,
-            'email': email
+            'email': email,
+            'idempotency_key': idempotency_key or str(uuid.uuid4())
         }
 
         if plan:
@@ -53,7 +60,8 @@ class Customer(object):
 
 class Charge(object):
     @classmethod
-    def create(cls, customer_id=None, currency=None, amount=None):
+    def create(cls, customer_id=None, currency=None, amount=None,
+               idempotency_key=None):
         """
         Create a new charge.
 
@@ -63,17 +71,17 @@ class Charge(object):
         :type amount: str
         :param amount: Amount in cents
         :type amount: int
+        :param idempotency_key: Sending the same key again won't charge the
+                                customer twice, defaults to a random key
+        :type idempotency_key: str
         :return: Stripe charge
         """
-        foo = stripe.Charge.create(
+        return stripe.Charge.create(
             amount=amount,
             currency=currency,
             customer=customer_id,
-            statement_descriptor='SNAKEEYES COINS')
-
-        print(foo)
-
-        return foo
+            statement_descriptor='SNAKEEYES COINS',
+            idempotency_key=idempotency_key or str(uuid.uuid4()))
 
 
 class Coupon(object):
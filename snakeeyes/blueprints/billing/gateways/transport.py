@@ -0,0 +1,289 @@
+import os
+import random
+import threading
+import time
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+import requests
+import stripe
+from flask import current_app, has_app_context
+from redis import RedisError
+from requests.adapters import HTTPAdapter
+from stripe.http_client import RequestsClient
+
+from config import settings
+from snakeeyes.extensions import redis
+from snakeeyes.blueprints.billing.gateways import breaker
+
+# Responses where the same request may well go through if it is sent again.
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+# Upper bounds in milliseconds of the latency histogram of every operation.
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def latency_key(operation=None):
+    """
+    Return the Redis key of an operation's latency histogram, or of the set
+    of every operation when there is none. CLI scripts without an app use
+    the default settings.
+
+    :param operation: Operation name
+    :type operation: str
+    :return: str
+    """
+    if has_app_context():
+        prefix = current_app.config['PAYMENT_GATEWAY_LATENCY_KEY_PREFIX']
+    else:
+        prefix = settings.PAYMENT_GATEWAY_LATENCY_KEY_PREFIX
+
+    if operation is None:
+        return prefix
+
+    return '{0}:{1}'.format(prefix, operation)
+
+
+def operation_name(method, url):
+    """
+    Name the operation of a gateway request after the resources in its path
+    and its method, ids are left out so every customer shares 1 name, for
+    example DELETE /v1/customers/cus_1/subscriptions/sub_1 is
+    customers.subscriptions.delete.
+
+    :param method: HTTP method
+    :type method: str
+    :param url: Request URL
+    :type url: str
+    :return: str
+    """
+    segments = [segment for segment in urlparse(url).path.split('/')
+                if segment]
+
+    # Skip the API version, every other segment after it is an id.
+    resources = segments[1::2]
+
+    return '.'.join(resources + [method.lower()])
+
+
+def record_latency(operation, elapsed, failed=False):
+    """
+    Count a gateway request and its latency towards its operation's metrics.
+
+    :param operation: Operation name
+    :type operation: str
+    :param elapsed: Seconds the request took
+    :type elapsed: float
+    :param failed: Whether or not the request failed
+    :type failed: bool
+    :return: None
+    """
+    elapsed_ms = elapsed * 1000
+    bucket = next((str(bound) for bound in LATENCY_BUCKETS
+                   if elapsed_ms <= bound), 'inf')
+    key = latency_key(operation)
+
+    try:
+        pipeline = redis.pipeline(transaction=False)
+        pipeline.sadd(latency_key(), operation)
+        pipeline.hincrby(key, 'count', 1)
+        pipeline.hincrby(key, 'errors', int(failed))
+        pipeline.hincrbyfloat(key, 'total_ms', elapsed_ms)
+        pipeline.hincrby(key, 'le:{0}'.format(bucket), 1)
+        pipeline.execute()
+    except RedisError:
+        pass
+
+    return None
+
+
+def latency_stats():
+    """
+    Summarize the latency of every operation, percentiles are the upper bound
+    of the histogram bucket they fall in.
+
+    :return: dict of stats keyed by operation name
+    """
+    stats = {}
+
+    try:
+        operations = [operation.decode('utf-8') for operation in
+                      redis.smembers(latency_key())]
+        pipeline = redis.pipeline(transaction=False)
+
+        for operation in operations:
+            pipeline.hgetall(latency_key(operation))
+
+        histograms = pipeline.execute()
+    except RedisError:
+        return stats
+
+    for operation, fields in zip(operations, histograms):
+        fields = dict((k.decode('utf-8'), v) for k, v in fields.items())
+        count = int(fields.get('count', 0))
+
+        if not count:
+            continue
+
+        summary = {
+            'count': count,
+            'errors': int(fields.get('errors', 0)),
+            'mean_ms': float(fields.get('total_ms', 0)) / count
+        }
+
+        for percentile in (50, 95, 99):
+            seen = 0
+
+            for bound in LATENCY_BUCKETS + ('inf',):
+                seen += int(fields.get('le:{0}'.format(bound), 0))
+
+                if seen * 100 >= count * percentile:
+                    summary['p{0}_ms'.format(percentile)] = float(bound)
+                    break
+
+        stats[operation] = summary
+
+    return stats
+
+
+def reset_latency_stats():
+    """
+    Forget the latency of every operation.
+
+    :return: None
+    """
+    operations = redis.smembers(latency_key())
+    keys = [latency_key(operation.decode('utf-8'))
+            for operation in operations]
+
+    redis.delete(latency_key(), *keys)
+
+    return None
+
+
+class GatewayClient(RequestsClient):
+    """
+    HTTP client that the Stripe library sends every request through.
+
+    Connections are kept alive in a pool so most requests skip the TCP and
+    TLS handshakes, and every operation has its own timeout so a slow
+    Stripe can only tie up a worker for so long.
+
+    Requests that are safe to send twice get retried with jittered backoff,
+    that is GET and DELETE requests plus anything with an idempotency key.
+
+    Every request goes through the circuit breaker, once Stripe is failing
+    requests fail right away instead of waiting on it.
+    """
+
+    def __init__(self, timeouts=None, connect_timeout=3.05, pool_size=10,
+                 retries=2, backoff=0.5, verify_ssl_certs=True):
+        super(GatewayClient, self).__init__(verify_ssl_certs=verify_ssl_certs)
+
+        self.timeouts = timeouts or {}
+        self.connect_timeout = connect_timeout
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def session(self):
+        """
+        Return the session holding the connection pool, each forked process
+        must start its own since sockets can't be shared.
+
+        :return: Requests session
+        """
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=self.pool_size)
+
+                self._session = requests.Session()
+                self._session.mount('https://', adapter)
+                self._session.mount('http://', adapter)
+                self._pid = os.getpid()
+
+        return self._session
+
+    def timeout(self, operation):
+        """
+        Return the connect and read timeouts of an operation.
+
+        :param operation: Operation name
+        :type operation: str
+        :return: Tuple of seconds
+        """
+        read_timeout = self.timeouts.get(operation,
+                                         self.timeouts.get('default', 80))
+
+        return self.connect_timeout, read_timeout
+
+    def request(self, method, url, headers, post_data=None):
+        """
+        Send a request to Stripe.
+
+        :param method: HTTP method
+        :type method: str
+        :param url: Request URL
+        :type url: str
+        :param headers: Request headers
+        :type headers: dict
+        :param post_data: Encoded request body
+        :type post_data: str
+        :return: Tuple of the body, status code and headers
+        """
+        operation = operation_name(method, url)
+        idempotent = method.lower() in ('get', 'delete') or \
+            'Idempotency-Key' in headers
+
+        kwargs = {
+            'headers': headers,
+            'data': post_data,
+            'timeout': self.timeout(operation),
+            'verify': False
+        }
+
+        if self._verify_ssl_certs:
+            kwargs['verify'] = os.path.join(os.path.dirname(stripe.__file__),
+                                            'data/ca-certificates.crt')
+
+        attempt = 0
+
+        while True:
+            breaker.allow()
+            start = time.time()
+
+            try:
+                response = self.session().request(method, url, **kwargs)
+                content = response.content
+            except Exception as e:
+                elapsed = time.time() - start
+                record_latency(operation, elapsed, failed=True)
+                breaker.record(elapsed, failed=True)
+
+                # A connection that was never made can't have done anything.
+                retryable = isinstance(e, requests.exceptions.ConnectTimeout) \
+                    or (idempotent and
+                        isinstance(e, requests.exceptions.RequestException))
+
+                if not retryable or attempt >= self.retries:
+                    self._handle_request_error(e)
+            else:
+                elapsed = time.time() - start
+                failed = response.status_code in RETRYABLE_STATUSES
+                record_latency(operation, elapsed, failed=failed)
+                breaker.record(elapsed, failed=failed)
+
+                if not failed or not idempotent or attempt >= self.retries:
+                    return content, response.status_code, response.headers
+
+            time.sleep(self.backoff * (2 ** attempt) *
+                       random.uniform(0.5, 1.5))
+            attempt += 1
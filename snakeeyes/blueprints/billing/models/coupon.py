@@ -4,6 +4,8 @@ from collections import OrderedDict
 from random import choice
 
 import pytz
+import stripe
+from flask import current_app
 from sqlalchemy import or_, and_
 
 from sqlalchemy.ext.hybrid import hybrid_property
@@ -11,6 +13,7 @@ from sqlalchemy.ext.hybrid import hybrid_property
 from lib.util_sqlalchemy import ResourceMixin, AwareDateTime
 from lib.money import cents_to_dollars, dollars_to_cents
 from snakeeyes.extensions import db
+from snakeeyes.blueprints.billing.gateways import bulk
 from snakeeyes.blueprints.billing.gateways.stripecom import \
     Coupon as PaymentCoupon
 
@@ -23,6 +26,9 @@ class Coupon(ResourceMixin, db.Model):
     ])
 
     __tablename__ = 'coupons'
+    __table_args__ = (
+        db.Index('ix_coupons_created_on_id', 'created_on', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
 
     # Coupon details.
@@ -152,29 +158,50 @@ class Coupon(ResourceMixin, db.Model):
     def bulk_delete(cls, ids):
         """
         Override the general bulk_delete method because we need to delete them
-        one at a time while also deleting them on Stripe.
+        on Stripe before deleting them locally.
+
+        Coupons are handled in chunks. Each chunk gets deleted on Stripe
+        concurrently and then every coupon that is gone from Stripe gets
+        deleted locally with 1 statement.
 
         :param ids: List of ids to be deleted
         :type ids: list
-        :return: int
+        :return: Tuple of how many coupons were deleted and the ids of the
+                 coupons that could not be deleted on Stripe
         """
+        ids = [int(id) for id in ids]
+        chunk_size = current_app.config['COUPON_DELETE_CHUNK_SIZE']
         delete_count = 0
+        failed_ids = []
+
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+
+            codes = dict((id, (code,)) for id, code in
+                         db.session.query(Coupon.id, Coupon.code)
+                         .filter(Coupon.id.in_(chunk)))
 
-        for id in ids:
-            coupon = Coupon.query.get(id)
+            responses, errors = bulk.call_each(
+                _delete_payment_coupon, codes,
+                workers=current_app.config['PAYMENT_GATEWAY_WORKERS'],
+                retries=current_app.config['PAYMENT_GATEWAY_RETRIES'],
+                backoff=current_app.config['PAYMENT_GATEWAY_BACKOFF'])
 
-            if coupon is None:
-                continue
+            for id, error in errors.items():
+                current_app.logger.error('Could not delete coupon %s: %s',
+                                         id, error)
 
-            # Delete on Stripe.
-            stripe_response = PaymentCoupon.delete(coupon.code)
+            deleted = [id for id, response in responses.items()
+                       if response is None or response.get('deleted')]
+            failed_ids.extend(id for id in codes if id not in deleted)
 
-            # If successful, delete it locally.
-            if stripe_response.get('deleted'):
-                coupon.delete()
-                delete_count += 1
+            if deleted:
+                delete_count += Coupon.query \
+                    .filter(Coupon.id.in_(deleted)) \
+                    .delete(synchronize_session=False)
+                db.session.commit()
 
-        return delete_count
+        return delete_count, failed_ids
 
     @classmethod
     def find_by_code(cls, code):
@@ -238,3 +265,21 @@ class Coupon(ResourceMixin, db.Model):
             params['percent_off'] = self.percent_off,
 
         return params
+
+
+def _delete_payment_coupon(code):
+    """
+    Delete a coupon on Stripe. There is nothing to delete if it is already
+    gone from Stripe.
+
+    :param code: Coupon code
+    :type code: str
+    :return: Stripe coupon or None
+    """
+    try:
+        return PaymentCoupon.delete(code)
+    except stripe.error.InvalidRequestError as e:
+        if e.http_status == 404:
+            return None
+
+        raise
@@ -1,11 +1,11 @@
 import datetime
 
-from sqlalchemy import or_
-
-from lib.util_sqlalchemy import ResourceMixin
+from lib.util_sqlalchemy import ResourceMixin, search_filter
 from snakeeyes.extensions import db
+from snakeeyes.blueprints.bet.models import leaderboard
 from snakeeyes.blueprints.billing.models.credit_card import CreditCard
 from snakeeyes.blueprints.billing.models.coupon import Coupon
+from snakeeyes.blueprints.billing.gateways import cache as gateway_cache
 from snakeeyes.blueprints.billing.gateways.stripecom import (
     Customer as PaymentCustomer,
     Charge as PaymentCharge,
@@ -15,6 +15,9 @@ from snakeeyes.blueprints.billing.gateways.stripecom import (
 
 class Invoice(ResourceMixin, db.Model):
     __tablename__ = 'invoices'
+    __table_args__ = (
+        db.Index('ix_invoices_created_on_id', 'created_on', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
 
     # Relationships.
@@ -55,14 +58,7 @@ class Invoice(ResourceMixin, db.Model):
         """
         from snakeeyes.blueprints.user.models import User
 
-        if not query:
-            return ''
-
-        search_query = '%{0}%'.format(query)
-        search_chain = (User.email.ilike(search_query),
-                        User.username.ilike(search_query))
-
-        return or_(*search_chain)
+        return search_filter((User.email, User.username), query)
 
     @classmethod
     def parse_from_event(cls, payload):
@@ -117,7 +113,8 @@ class Invoice(ResourceMixin, db.Model):
     @classmethod
     def prepare_and_save(cls, parsed_event):
         """
-        Potentially save the invoice after argument the event fields.
+        Potentially save the invoice after argument the event fields. It is
+        only added to the session, the caller commits it.
 
         :param parsed_event: Event params to be saved
         :type parsed_event: dict
@@ -139,7 +136,7 @@ class Invoice(ResourceMixin, db.Model):
             del parsed_event['payment_id']
 
             invoice = Invoice(**parsed_event)
-            invoice.save()
+            db.session.add(invoice)
 
         return user
 
@@ -152,10 +149,26 @@ class Invoice(ResourceMixin, db.Model):
         :type customer_id: int
         :return: Stripe invoice object
         """
-        invoice = PaymentInvoice.upcoming(customer_id)
+        invoice = gateway_cache.fetch('upcoming_invoice', customer_id,
+                                      PaymentInvoice.upcoming,
+                                      refresh=_queue_upcoming_refresh)
 
         return Invoice.parse_from_api(invoice)
 
+    @classmethod
+    def refresh_upcoming(cls, customer_id):
+        """
+        Fetch the upcoming invoice item from Stripe and cache it.
+
+        :param customer_id: Stripe customer id
+        :type customer_id: int
+        :return: None
+        """
+        gateway_cache.store('upcoming_invoice', customer_id,
+                            PaymentInvoice.upcoming(customer_id))
+
+        return None
+
     def create(self, user=None, currency=None, amount=None, coins=None,
                coupon=None, token=None):
         """
@@ -175,24 +188,33 @@ class Invoice(ResourceMixin, db.Model):
         :type token: str
         :return: bool
         """
+        from snakeeyes.blueprints.user.models import User
+
         if token is None:
             return False
 
-        customer = PaymentCustomer.create(token=token, email=user.email)
+        # A token can only be used once, so a resubmitted form gets back the
+        # customer and charge it created the first time.
+        customer = PaymentCustomer.create(
+            token=token, email=user.email,
+            idempotency_key='customer-{0}'.format(token))
 
         if coupon:
             self.coupon = coupon.upper()
             coupon = Coupon.query.filter(Coupon.code == self.coupon).first()
             amount = coupon.apply_discount_to(amount)
 
-        charge = PaymentCharge.create(customer.id, currency, amount)
+        charge = PaymentCharge.create(
+            customer.id, currency, amount,
+            idempotency_key='charge-{0}'.format(token))
 
         # Redeem the coupon.
         if coupon:
             coupon.redeem()
 
-        # Add the coins to the user.
-        user.coins += coins
+        # Add the coins to the user, the increment happens in SQL so that a
+        # stale copy of the user never overwrites a concurrent change.
+        user.coins = User.coins + coins
 
         # Create the invoice item.
         period_on = datetime.datetime.utcfromtimestamp(charge.get('created'))
@@ -216,4 +238,22 @@ class Invoice(ResourceMixin, db.Model):
         db.session.add(self)
         db.session.commit()
 
+        leaderboard.record_coins(user.id, user.coins)
+
         return True
+
+
+def _queue_upcoming_refresh(customer_id):
+    """
+    Refresh a customer's cached upcoming invoice in the background.
+
+    :param customer_id: Stripe customer id
+    :type customer_id: str
+    :return: None
+    """
+    # Prevent circular imports.
+    from snakeeyes.blueprints.billing.tasks import refresh_upcoming_invoice
+
+    refresh_upcoming_invoice.delay(customer_id)
+
+    return None
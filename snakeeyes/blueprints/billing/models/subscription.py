@@ -7,9 +7,11 @@ from lib.util_sqlalchemy import ResourceMixin
 from snakeeyes.extensions import db
 from snakeeyes.blueprints.billing.models.credit_card import CreditCard
 from snakeeyes.blueprints.billing.models.coupon import Coupon
+from snakeeyes.blueprints.billing.gateways import cache as gateway_cache
 from snakeeyes.blueprints.billing.gateways.stripecom import Card as PaymentCard
 from snakeeyes.blueprints.billing.gateways.stripecom import \
     Customer as PaymentCustomer, Subscription as PaymentSubscription
+from snakeeyes.blueprints.bet.models import leaderboard
 from snakeeyes.blueprints.bet.models.coin import add_subscription_coins
 
 
@@ -80,26 +82,30 @@ class Subscription(ResourceMixin, db.Model):
         :type token: str
         :return: bool
         """
+        from snakeeyes.blueprints.user.models import User
+
         if token is None:
             return False
 
         if coupon:
             self.coupon = coupon.upper()
 
-        customer = PaymentCustomer.create(token=token,
-                                          email=user.email,
-                                          plan=plan,
-                                          coupon=self.coupon)
+        # A token can only be used once, so a resubmitted form gets back the
+        # customer it created the first time.
+        customer = PaymentCustomer.create(
+            token=token,
+            email=user.email,
+            plan=plan,
+            coupon=self.coupon,
+            idempotency_key='customer-{0}'.format(token))
 
         # Update the user account.
         user.payment_id = customer.id
         user.name = name
         user.previous_plan = plan
-        user.coins = add_subscription_coins(user.coins,
-                                            Subscription.get_plan_by_id(
-                                                user.previous_plan),
-                                            Subscription.get_plan_by_id(plan),
-                                            user.cancelled_subscription_on)
+        user.coins = User.coins + add_subscription_coins(
+            0, Subscription.get_plan_by_id(user.previous_plan),
+            Subscription.get_plan_by_id(plan), user.cancelled_subscription_on)
         user.cancelled_subscription_on = None
 
         # Set the subscription details.
@@ -121,6 +127,8 @@ class Subscription(ResourceMixin, db.Model):
 
         db.session.commit()
 
+        leaderboard.record_coins(user.id, user.coins)
+
         return True
 
     def update(self, user=None, coupon=None, plan=None):
@@ -135,15 +143,15 @@ class Subscription(ResourceMixin, db.Model):
         :type plan: str
         :return: bool
         """
+        from snakeeyes.blueprints.user.models import User
+
         PaymentSubscription.update(user.payment_id, coupon, plan)
 
         user.previous_plan = user.subscription.plan
         user.subscription.plan = plan
-        user.coins = add_subscription_coins(user.coins,
-                                            Subscription.get_plan_by_id(
-                                                user.previous_plan),
-                                            Subscription.get_plan_by_id(plan),
-                                            user.cancelled_subscription_on)
+        user.coins = User.coins + add_subscription_coins(
+            0, Subscription.get_plan_by_id(user.previous_plan),
+            Subscription.get_plan_by_id(plan), user.cancelled_subscription_on)
 
         if coupon:
             user.subscription.coupon = coupon
@@ -155,6 +163,9 @@ class Subscription(ResourceMixin, db.Model):
         db.session.add(user.subscription)
         db.session.commit()
 
+        leaderboard.record_coins(user.id, user.coins)
+        gateway_cache.invalidate(user.payment_id)
+
         return True
 
     def cancel(self, user=None, discard_credit_card=True):
@@ -168,6 +179,7 @@ class Subscription(ResourceMixin, db.Model):
         :return: bool
         """
         PaymentSubscription.cancel(user.payment_id)
+        gateway_cache.invalidate(user.payment_id)
 
         user.payment_id = None
         user.cancelled_subscription_on = datetime.datetime.now(pytz.utc)
@@ -0,0 +1,231 @@
+import datetime
+from collections import OrderedDict
+
+import pytz
+from flask import current_app
+from sqlalchemy import text
+
+from lib.util_sqlalchemy import ResourceMixin, AwareDateTime
+from snakeeyes.extensions import db
+from snakeeyes.blueprints.bet.models import leaderboard
+from snakeeyes.blueprints.billing.models.invoice import Invoice
+from snakeeyes.blueprints.billing.models.subscription import Subscription
+from snakeeyes.blueprints.billing.gateways import breaker, bulk
+from snakeeyes.blueprints.billing.gateways import cache as gateway_cache
+from snakeeyes.blueprints.billing.gateways.stripecom import \
+    Event as PaymentEvent
+
+# Remember an event the first time it is delivered, later deliveries of the
+# same event match the unique event id and get ignored.
+RECORD_WEBHOOK_EVENT_SQL = """
+INSERT INTO webhook_events (created_on, updated_on, event_id, status,
+                            attempts)
+VALUES (:now, :now, :event_id, 'pending', 0)
+ON CONFLICT (event_id) DO NOTHING
+RETURNING id
+"""
+
+# Claim a batch of pending events. Locked rows are skipped so any amount of
+# workers can claim batches at the same time without getting the same event.
+CLAIM_WEBHOOK_EVENTS_SQL = """
+UPDATE webhook_events
+SET status = 'processing', attempts = attempts + 1, updated_on = :now
+WHERE id IN (
+    SELECT id
+    FROM webhook_events
+    WHERE status = 'pending'
+    ORDER BY id
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id
+"""
+
+
+class WebhookEvent(ResourceMixin, db.Model):
+    STATUS = OrderedDict([
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed')
+    ])
+
+    __tablename__ = 'webhook_events'
+    id = db.Column(db.Integer, primary_key=True)
+
+    # Event details.
+    event_id = db.Column(db.String(255), unique=True, index=True,
+                         nullable=False)
+    status = db.Column(db.Enum(*STATUS, name='webhook_event_status',
+                               native_enum=False),
+                       index=True, nullable=False, server_default='pending')
+    attempts = db.Column(db.Integer(), nullable=False, server_default='0')
+    error = db.Column(db.Text())
+    processed_on = db.Column(AwareDateTime())
+
+    def __init__(self, **kwargs):
+        # Call Flask-SQLAlchemy's constructor.
+        super(WebhookEvent, self).__init__(**kwargs)
+
+    @classmethod
+    def record(cls, event_id):
+        """
+        Remember that an event was delivered so it gets processed once.
+
+        :param event_id: Stripe event id
+        :type event_id: str
+        :return: bool, False if the event was already delivered before
+        """
+        params = {
+            'now': datetime.datetime.now(pytz.utc),
+            'event_id': event_id
+        }
+
+        result = db.session.execute(text(RECORD_WEBHOOK_EVENT_SQL), params)
+        recorded = result.first() is not None
+        db.session.commit()
+
+        return recorded
+
+    @classmethod
+    def replay(cls, event_ids=None, statuses=('failed',)):
+        """
+        Queue up events to be processed again.
+
+        :param event_ids: Only replay these Stripe event ids
+        :type event_ids: list
+        :param statuses: Only replay events with these statuses
+        :type statuses: tuple
+        :return: Number of events queued up
+        """
+        query = WebhookEvent.query.filter(WebhookEvent.status.in_(statuses))
+
+        if event_ids:
+            query = query.filter(WebhookEvent.event_id.in_(event_ids))
+
+        replay_count = query.update({'status': 'pending', 'error': None},
+                                    synchronize_session=False)
+        db.session.commit()
+
+        return replay_count
+
+    @classmethod
+    def process_pending(cls, batch_size=None):
+        """
+        Claim a batch of pending events and process them. Every event is
+        verified with Stripe first, those requests are made concurrently.
+
+        Nothing is claimed while the gateway breaker is open, and events that
+        could not be verified because it opened stay pending.
+
+        :param batch_size: Events to claim, defaults to WEBHOOK_BATCH_SIZE
+        :type batch_size: int
+        :return: dict of how many events were processed and failed
+        """
+        outcome = {'processed': 0, 'failed': 0}
+
+        if breaker.state() == 'open':
+            return outcome
+
+        params = {
+            'now': datetime.datetime.now(pytz.utc),
+            'batch_size': batch_size or
+            current_app.config['WEBHOOK_BATCH_SIZE']
+        }
+
+        ids = [row[0] for row in
+               db.session.execute(text(CLAIM_WEBHOOK_EVENTS_SQL), params)]
+        db.session.commit()
+
+        if not ids:
+            return outcome
+
+        events = WebhookEvent.query.filter(WebhookEvent.id.in_(ids)) \
+            .order_by(WebhookEvent.id).all()
+
+        verified, errors = bulk.call_each(
+            PaymentEvent.retrieve,
+            dict((event.event_id, (event.event_id,)) for event in events),
+            workers=current_app.config['PAYMENT_GATEWAY_WORKERS'],
+            retries=current_app.config['PAYMENT_GATEWAY_RETRIES'],
+            backoff=current_app.config['PAYMENT_GATEWAY_BACKOFF'])
+
+        for event in events:
+            error = errors.get(event.event_id)
+
+            if isinstance(error, breaker.CircuitOpen):
+                # It gets claimed again once the gateway recovers.
+                event.status = 'pending'
+                event.save()
+                continue
+
+            if error is not None:
+                processed = event.fail(error)
+            else:
+                processed = event.handle(verified[event.event_id])
+
+            outcome['processed' if processed else 'failed'] += 1
+
+        return outcome
+
+    def handle(self, safe_event):
+        """
+        Save the invoice of a verified event and grant its coins, then
+        record the outcome. All of it happens in a single transaction, so
+        an event is never marked as failed after its coins were granted.
+
+        :param safe_event: Event as retrieved from Stripe
+        :type safe_event: Stripe event
+        :return: bool, True if the event was processed
+        """
+        # Avoid circular imports.
+        from snakeeyes.blueprints.user.models import User
+
+        coins_granted = False
+
+        try:
+            parsed_event = Invoice.parse_from_event(safe_event)
+
+            # The customer's next invoice is different now that one is paid.
+            gateway_cache.invalidate(parsed_event['payment_id'])
+
+            user = Invoice.prepare_and_save(parsed_event)
+
+            if parsed_event.get('total') > 0:
+                plan = Subscription.get_plan_by_id(user.subscription.plan)
+                user.coins = User.coins + plan['metadata']['coins']
+                coins_granted = True
+
+            self.status = 'processed'
+            self.error = None
+            self.processed_on = datetime.datetime.now(pytz.utc)
+
+            db.session.add(self)
+            db.session.flush()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.exception('Could not process webhook event %s.',
+                                         self.event_id)
+
+            return self.fail(e)
+
+        if coins_granted:
+            leaderboard.record_coins(user.id, user.coins)
+
+        return True
+
+    def fail(self, error):
+        """
+        Record why an event could not be processed, it can be replayed once
+        the problem is fixed.
+
+        :param error: What went wrong
+        :type error: Exception
+        :return: bool, always False
+        """
+        self.status = 'failed'
+        self.error = str(error)
+        self.save()
+
+        return False
@@ -1,12 +1,16 @@
-from snakeeyes.app import create_celery_app
+from celery import shared_task
+from celery.utils.log import get_task_logger
+
 from snakeeyes.blueprints.user.models import User
 from snakeeyes.blueprints.billing.models.credit_card import CreditCard
 from snakeeyes.blueprints.billing.models.coupon import Coupon
+from snakeeyes.blueprints.billing.models.invoice import Invoice
+from snakeeyes.blueprints.billing.models.webhook_event import WebhookEvent
 
-celery = create_celery_app()
+logger = get_task_logger(__name__)
 
 
-@celery.task()
+@shared_task()
 def mark_old_credit_cards():
     """
     Mark credit cards that are going to expire soon or have expired.
@@ -16,7 +20,7 @@ def mark_old_credit_cards():
     return CreditCard.mark_old_credit_cards()
 
 
-@celery.task()
+@shared_task()
 def expire_old_coupons():
     """
     Invalidate coupons that are past their redeem date.
@@ -26,25 +30,64 @@ def expire_old_coupons():
     return Coupon.expire_old_coupons()
 
 
-@celery.task()
-def delete_users(ids):
+@shared_task(bind=True)
+def delete_users(self, ids):
     """
-    Delete users and potentially cancel their subscription.
+    Delete users and potentially cancel their subscription. Progress is
+    logged and stored as the task's state after every chunk of users.
 
     :param ids: List of ids to be deleted
     :type ids: list
     :return: int
     """
-    return User.bulk_delete(ids)
+    def progress(done, total):
+        logger.info('Deleted %s of %s user(s).', done, total)
+
+        if self.request.id:
+            self.update_state(state='PROGRESS',
+                              meta={'done': done, 'total': total})
 
+    return User.bulk_delete(ids, progress=progress)
 
-@celery.task()
-def delete_coupons(ids):
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def delete_coupons(self, ids):
     """
-    Delete coupons both on the payment gateway and locally.
+    Delete coupons both on the payment gateway and locally. Coupons that
+    could not be deleted on the payment gateway get retried later.
 
     :param ids: List of ids to be deleted
     :type ids: list
     :return: int
     """
-    return Coupon.bulk_delete(ids)
+    delete_count, failed_ids = Coupon.bulk_delete(ids)
+
+    if failed_ids:
+        logger.warning('Could not delete %s coupon(s), retrying them.',
+                       len(failed_ids))
+        raise self.retry(args=[failed_ids])
+
+    return delete_count
+
+
+@shared_task()
+def process_webhook_events():
+    """
+    Process a batch of delivered Stripe events. A burst of deliveries queues
+    up many of these, they each claim their own batch until none are left.
+
+    :return: dict of how many events were processed and failed
+    """
+    return WebhookEvent.process_pending()
+
+
+@shared_task(ignore_result=True)
+def refresh_upcoming_invoice(customer_id):
+    """
+    Refresh a customer's cached upcoming invoice.
+
+    :param customer_id: Stripe customer id
+    :type customer_id: str
+    :return: None
+    """
+    return Invoice.refresh_upcoming(customer_id)
@@ -19,7 +19,8 @@ from snakeeyes.blueprints.billing.models.coupon import Coupon
 from snakeeyes.blueprints.billing.models.subscription import Subscription
 from snakeeyes.blueprints.billing.models.invoice import Invoice
 from snakeeyes.blueprints.billing.decorators import subscription_required, \
-    handle_stripe_exceptions
+    handle_stripe_exceptions, payment_gateway_required
+from snakeeyes.blueprints.billing.gateways.breaker import CircuitOpen
 
 billing = Blueprint('billing', __name__, template_folder='../templates',
                     url_prefix='/subscription')
@@ -54,6 +55,7 @@ def coupon_code():
 @billing.route('/create', methods=['GET', 'POST'])
 @handle_stripe_exceptions
 @login_required
+@payment_gateway_required
 def create():
     if current_user.subscription:
         flash(_('You already have an active subscription.'), 'info')
@@ -93,6 +95,7 @@ def create():
 @handle_stripe_exceptions
 @subscription_required
 @login_required
+@payment_gateway_required
 def update():
     current_plan = current_user.subscription.plan
     active_plan = Subscription.get_plan_by_id(current_plan)
@@ -127,6 +130,7 @@ def update():
 @billing.route('/cancel', methods=['GET', 'POST'])
 @handle_stripe_exceptions
 @login_required
+@payment_gateway_required
 def cancel():
     if not current_user.subscription:
         flash(_('You do not have an active subscription.'), 'error')
@@ -149,6 +153,7 @@ def cancel():
 @billing.route('/update_payment_method', methods=['GET', 'POST'])
 @handle_stripe_exceptions
 @login_required
+@payment_gateway_required
 def update_payment_method():
     if not current_user.credit_card:
         flash(_('You do not have a payment method on file.'), 'error')
@@ -192,21 +197,31 @@ def billing_details(page):
       Invoice.user_id == current_user.id) \
         .order_by(Invoice.created_on.desc()).paginate(page, 12, True)
 
+    upcoming = None
+    upcoming_unavailable = False
+    coupon = None
+
     if current_user.subscription:
-        upcoming = Invoice.upcoming(current_user.payment_id)
+        # Past invoices don't need the gateway, so they still get shown.
+        try:
+            upcoming = Invoice.upcoming(current_user.payment_id)
+        except CircuitOpen:
+            upcoming_unavailable = True
+
         coupon = Coupon.query \
             .filter(Coupon.code == current_user.subscription.coupon).first()
-    else:
-        upcoming = None
-        coupon = None
 
     return render_template('billing/billing_details.html',
                            paginated_invoices=paginated_invoices,
-                           upcoming=upcoming, coupon=coupon)
+                           upcoming=upcoming,
+                           upcoming_unavailable=upcoming_unavailable,
+                           coupon=coupon)
 
 
 @billing.route('/purchase_coins', methods=['GET', 'POST'])
+@handle_stripe_exceptions
 @login_required
+@payment_gateway_required
 def purchase_coins():
     stripe_key = current_app.config.get('STRIPE_PUBLISHABLE_KEY')
     form = PaymentForm(stripe_key=stripe_key)
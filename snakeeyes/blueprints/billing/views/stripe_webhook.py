@@ -1,12 +1,14 @@
 from flask import Blueprint, request
-from stripe.error import InvalidRequestError
 
 from lib.util_json import render_json
 from snakeeyes.extensions import csrf
-from snakeeyes.blueprints.billing.models.invoice import Invoice
-from snakeeyes.blueprints.billing.models.subscription import Subscription
-from snakeeyes.blueprints.billing.gateways.stripecom import \
-    Event as PaymentEvent
+from snakeeyes.blueprints.billing.models.webhook_event import WebhookEvent
+
+try:
+    # Python 2 decodes JSON strings as either str or unicode.
+    STRING_TYPES = (str, unicode)  # noqa
+except NameError:
+    STRING_TYPES = (str,)
 
 stripe_webhook = Blueprint('stripe_webhook', __name__,
                            url_prefix='/stripe_webhook')
@@ -18,24 +20,20 @@ def event():
     if not request.json:
         return render_json(406, {'error': 'Mime-type is not application/json'})
 
-    if request.json.get('id') is None:
+    event_id = request.json.get('id')
+
+    if not isinstance(event_id, STRING_TYPES) or not event_id or \
+            len(event_id) > 255:
         return render_json(406, {'error': 'Invalid Stripe event'})
 
-    try:
-        safe_event = PaymentEvent.retrieve(request.json.get('id'))
-        parsed_event = Invoice.parse_from_event(safe_event)
+    # Stripe delivers events at least once, only queue up the first delivery.
+    # The event gets verified with Stripe and processed by a worker.
+    if WebhookEvent.record(event_id):
+        # Prevent circular imports.
+        from snakeeyes.blueprints.billing.tasks import process_webhook_events
 
-        user = Invoice.prepare_and_save(parsed_event)
+        process_webhook_events.delay()
 
-        if parsed_event.get('total') > 0:
-            plan = Subscription.get_plan_by_id(user.subscription.plan)
-            user.add_coins(plan)
-    except InvalidRequestError as e:
-        # We could not parse the event.
-        return render_json(422, {'error': str(e)})
-    except Exception as e:
-        # Return a 200 because something is really wrong and we want Stripe to
-        # stop trying to fulfill this webhook request.
-        return render_json(200, {'error': str(e)})
+        return render_json(200, {'success': True})
 
-    return render_json(200, {'success': True})
+    return render_json(200, {'success': True, 'duplicate': True})
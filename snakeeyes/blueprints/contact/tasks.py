@@ -1,13 +1,14 @@
-from lib.flask_mailplus import send_template_message
-from snakeeyes.app import create_celery_app
+from celery import shared_task
+from flask import current_app
 
-celery = create_celery_app()
+from lib.flask_mailplus import queue_template_message
+from snakeeyes.blueprints.user.tasks import deliver_queued_mail
 
 
-@celery.task()
+@shared_task()
 def deliver_contact_email(email, message):
     """
-    Send a contact e-mail.
+    Queue up a contact e-mail.
 
     :param email: E-mail address of the visitor
     :type user_id: str
@@ -17,10 +18,11 @@ def deliver_contact_email(email, message):
     """
     ctx = {'email': email, 'message': message}
 
-    send_template_message(subject='[Snake Eyes] Contact',
-                          sender=email,
-                          recipients=[celery.conf.get('MAIL_USERNAME')],
-                          reply_to=email,
-                          template='contact/mail/index', ctx=ctx)
+    queue_template_message(subject='[Snake Eyes] Contact',
+                           sender=email,
+                           recipients=[current_app.config['MAIL_USERNAME']],
+                           reply_to=email,
+                           template='contact/mail/index', ctx=ctx,
+                           schedule=deliver_queued_mail.apply_async)
 
     return None
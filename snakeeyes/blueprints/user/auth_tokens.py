@@ -0,0 +1,170 @@
+import datetime
+import hashlib
+import hmac
+
+from flask import current_app
+from itsdangerous import BadData, URLSafeTimedSerializer
+from redis import RedisError
+
+from snakeeyes.extensions import redis
+
+
+def get_serializer(app=None):
+    """
+    Return the app's remember me token serializer, it only gets built once
+    per app rather than once per token.
+
+    :param app: Flask application instance, defaults to the current app
+    :type app: Flask
+    :return: URLSafeTimedSerializer
+    """
+    app = app or current_app._get_current_object()
+    serializer = app.extensions.get('auth_token_serializer')
+
+    if serializer is None:
+        serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
+        app.extensions['auth_token_serializer'] = serializer
+
+    return serializer
+
+
+def fingerprint(password):
+    """
+    Fingerprint a password hash so that tokens stop working once the user
+    changes their password. It is completely fine to use md5 here as
+    nothing leaks.
+
+    :param password: User's password hash
+    :type password: str
+    :return: str
+    """
+    return hashlib.md5((password or '').encode('utf-8')).hexdigest()
+
+
+def key(token):
+    """
+    Return the Redis key of a verified token, the token itself is hashed so
+    that it never gets stored.
+
+    :param token: Remember me token
+    :type token: str
+    :return: str
+    """
+    return 'auth_token:{0}'.format(
+        hashlib.sha1(token.encode('utf-8')).hexdigest())
+
+
+def user_key(user_id):
+    """
+    Return the Redis key of the set of a user's verified tokens.
+
+    :param user_id: User id
+    :type user_id: int
+    :return: str
+    """
+    return 'auth_tokens:{0}'.format(user_id)
+
+
+def dump(user):
+    """
+    Create a remember me token for a user.
+
+    :param user: User to create the token for
+    :type user: User instance
+    :return: str
+    """
+    return get_serializer().dumps([str(user.id), fingerprint(user.password)])
+
+
+def _verify(token):
+    """
+    Verify a token's signature and age, remembering the result so that the
+    token does not need to be verified again for a while.
+
+    :param token: Remember me token
+    :type token: str
+    :return: Tuple of the user id and password fingerprint or None
+    """
+    max_age = current_app.config['REMEMBER_COOKIE_DURATION'].total_seconds()
+    ttl = current_app.config['AUTH_TOKEN_CACHE_TTL']
+    cache_key = key(token)
+
+    if ttl:
+        try:
+            cached = redis.get(cache_key)
+        except RedisError:
+            cached = None
+
+        if cached is not None:
+            user_id, password_fingerprint = cached.decode('utf-8').split(':')
+            return user_id, password_fingerprint
+
+    try:
+        data, signed_on = get_serializer().loads(token, max_age=max_age,
+                                                 return_timestamp=True)
+        user_id, password_fingerprint = data
+    except (BadData, TypeError, ValueError):
+        return None
+
+    if ttl:
+        # Never remember a token for longer than it is valid.
+        age = (datetime.datetime.utcnow() - signed_on).total_seconds()
+        ttl = int(min(ttl, max_age - age))
+
+    if ttl > 0:
+        try:
+            pipeline = redis.pipeline()
+            pipeline.setex(cache_key, ttl,
+                           '{0}:{1}'.format(user_id, password_fingerprint))
+            pipeline.sadd(user_key(user_id), cache_key)
+            pipeline.expire(user_key(user_id),
+                            current_app.config['AUTH_TOKEN_CACHE_TTL'])
+            pipeline.execute()
+        except RedisError:
+            current_app.logger.exception('Could not cache a verified token.')
+
+    return user_id, password_fingerprint
+
+
+def load(token, get_user):
+    """
+    Return the user that a remember me token belongs to.
+
+    :param token: Remember me token
+    :type token: str
+    :param get_user: Look up a user by their id
+    :type get_user: function
+    :return: User instance or None
+    """
+    verified = _verify(token)
+
+    if verified is None:
+        return None
+
+    user_id, password_fingerprint = verified
+    user = get_user(user_id)
+
+    if user is None or not hmac.compare_digest(
+            fingerprint(user.password), str(password_fingerprint)):
+        return None
+
+    return user
+
+
+def revoke(*user_ids):
+    """
+    Forget every verified token of 1 or more users, this happens when they
+    change their password.
+
+    :param user_ids: User ids
+    :type user_ids: int
+    :return: None
+    """
+    try:
+        for user_id in user_ids:
+            tokens = redis.smembers(user_key(user_id))
+            redis.delete(user_key(user_id), *tokens)
+    except RedisError:
+        current_app.logger.exception('Could not revoke verified tokens.')
+
+    return None
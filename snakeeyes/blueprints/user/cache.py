@@ -0,0 +1,316 @@
+import datetime
+import json
+
+from flask import current_app
+from redis import RedisError, WatchError
+from sqlalchemy import Date, event, inspect
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.session import make_transient_to_detached
+
+from lib.util_sqlalchemy import AwareDateTime, parse_iso_datetime
+from snakeeyes.extensions import db, redis
+from snakeeyes.blueprints.user import auth_tokens
+from snakeeyes.blueprints.billing.models.credit_card import CreditCard
+from snakeeyes.blueprints.billing.models.subscription import Subscription
+from snakeeyes.blueprints.bet.models.stats import BetStats
+from snakeeyes.blueprints.user.models import User
+
+# Relationships that get cached along with the user because nearly every
+# page that an authenticated user visits ends up reading them.
+CACHED_RELATIONSHIPS = (
+    ('subscription', Subscription),
+    ('credit_card', CreditCard),
+    ('bet_stats', BetStats)
+)
+
+# Changing any of these models means a user's cached snapshot is stale.
+INVALIDATING_MODELS = (User, Subscription, CreditCard, BetStats)
+
+# Only these columns get cached, anything else such as the password hash is
+# lazy loaded from the database on the rare occasion that it gets used.
+CACHED_COLUMNS = {
+    User: ('id', 'created_on', 'updated_on', 'role', 'active', 'username',
+           'email', 'name', 'payment_id', 'cancelled_subscription_on',
+           'previous_plan', 'coins', 'last_bet_on', 'sign_in_count',
+           'current_sign_in_on', 'current_sign_in_ip', 'last_sign_in_on',
+           'last_sign_in_ip', 'locale'),
+    Subscription: ('id', 'created_on', 'updated_on', 'user_id', 'plan',
+                   'coupon'),
+    CreditCard: ('id', 'created_on', 'updated_on', 'user_id', 'brand',
+                 'last4', 'exp_date', 'is_expiring'),
+    BetStats: ('user_id', 'created_on', 'updated_on', 'bets', 'wagered',
+               'net', 'wins', 'biggest_win', 'current_streak',
+               'longest_win_streak', 'guess_counts', 'guess_wins')
+}
+
+# Every invalidation bumps a user's version, it outlives any cached snapshot
+# by far so a version never gets reused while a query is in flight.
+VERSION_TTL = 86400
+
+
+def key(user_id):
+    """
+    Return the Redis key of a user's cached snapshot.
+
+    :param user_id: User id
+    :type user_id: int
+    :return: str
+    """
+    return 'user:{0}'.format(user_id)
+
+
+def version_key(user_id):
+    """
+    Return the Redis key of a user's cache version.
+
+    :param user_id: User id
+    :type user_id: int
+    :return: str
+    """
+    return 'user:{0}:version'.format(user_id)
+
+
+def _column_type(model, attribute):
+    """
+    Return the type of a model's column.
+
+    :param model: Model
+    :type model: SQLAlchemy model
+    :param attribute: Name of the column attribute
+    :type attribute: str
+    :return: SQLAlchemy type
+    """
+    return model.__mapper__.column_attrs[attribute].columns[0].type
+
+
+def _columns(model, instance):
+    """
+    Copy the cached column values of a model instance into a dict that can
+    be serialized to JSON.
+
+    :param model: Model of the instance
+    :type model: SQLAlchemy model
+    :param instance: Model instance
+    :type instance: SQLAlchemy model
+    :return: dict or None
+    """
+    if instance is None:
+        return None
+
+    columns = {}
+
+    for attribute in CACHED_COLUMNS[model]:
+        value = getattr(instance, attribute)
+
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            value = value.isoformat()
+
+        columns[attribute] = value
+
+    return columns
+
+
+def _restore(model, columns):
+    """
+    Rebuild a model instance from its cached column values, it is treated as
+    an existing row so no query is needed to load or attach it.
+
+    :param model: Model to build
+    :type model: SQLAlchemy model
+    :param columns: Column values
+    :type columns: dict
+    :return: Model instance or None
+    """
+    if columns is None:
+        return None
+
+    instance = model.__mapper__.class_manager.new_instance()
+
+    for attribute in CACHED_COLUMNS[model]:
+        value = columns.get(attribute)
+        column_type = _column_type(model, attribute)
+
+        if value is None:
+            pass
+        elif isinstance(column_type, AwareDateTime):
+            value = parse_iso_datetime(value)
+        elif isinstance(column_type, Date):
+            value = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+        set_committed_value(instance, attribute, value)
+
+    make_transient_to_detached(instance)
+
+    return instance
+
+
+def dump(user):
+    """
+    Serialize a user and its cached relationships.
+
+    :param user: User to serialize
+    :type user: User instance
+    :return: str
+    """
+    snapshot = {'user': _columns(User, user)}
+
+    for name, model in CACHED_RELATIONSHIPS:
+        snapshot[name] = _columns(model, getattr(user, name))
+
+    return json.dumps(snapshot)
+
+
+def load(data):
+    """
+    Rebuild a user and its cached relationships, then attach them to the
+    current session so they can be lazy loaded from and saved like usual.
+
+    :param data: Serialized snapshot
+    :type data: bytes
+    :return: User instance
+    """
+    snapshot = json.loads(data.decode('utf-8'))
+    user = _restore(User, snapshot['user'])
+
+    for name, model in CACHED_RELATIONSHIPS:
+        set_committed_value(user, name, _restore(model, snapshot[name]))
+
+    # The user may already be in the session, such as right after logging in.
+    return db.session.merge(user, load=False)
+
+
+def get(user_id):
+    """
+    Return a user from the cache, falling back to a single query that eager
+    loads its relationships and caches the result.
+
+    :param user_id: User id
+    :type user_id: int
+    :return: User instance or None
+    """
+    ttl = current_app.config['USER_CACHE_TTL']
+
+    if not ttl:
+        return User.query.get(user_id)
+
+    try:
+        data, version = redis.mget(key(user_id), version_key(user_id))
+    except RedisError:
+        data, version = None, None
+
+    if data is not None:
+        return load(data)
+
+    options = [joinedload(name) for name, _ in CACHED_RELATIONSHIPS]
+    user = User.query.options(*options).get(user_id)
+
+    if user is not None:
+        _populate(user_id, version, ttl, dump(user))
+
+    return user
+
+
+def _populate(user_id, version, ttl, data):
+    """
+    Cache a user's snapshot unless they got invalidated since their version
+    was read, otherwise a slow query could put back an outdated snapshot
+    right after a newer change removed it.
+
+    :param user_id: User id
+    :type user_id: int
+    :param version: Cache version read before querying the user
+    :type version: bytes or None
+    :param ttl: Seconds to cache the snapshot for
+    :type ttl: int
+    :param data: Serialized snapshot
+    :type data: str
+    :return: None
+    """
+    try:
+        with redis.pipeline() as pipeline:
+            pipeline.watch(version_key(user_id))
+
+            if pipeline.get(version_key(user_id)) != version:
+                return None
+
+            pipeline.multi()
+            pipeline.setex(key(user_id), ttl, data)
+            pipeline.execute()
+    except WatchError:
+        pass
+    except RedisError:
+        current_app.logger.exception('Could not cache user %s.', user_id)
+
+    return None
+
+
+def invalidate(*user_ids):
+    """
+    Remove 1 or more users from the cache. Call this after changing users
+    with raw SQL, ORM changes are picked up automatically.
+
+    :param user_ids: User ids
+    :type user_ids: int
+    :return: None
+    """
+    if not user_ids:
+        return None
+
+    try:
+        pipeline = redis.pipeline()
+
+        for user_id in user_ids:
+            pipeline.incr(version_key(user_id))
+            pipeline.expire(version_key(user_id), VERSION_TTL)
+            pipeline.delete(key(user_id))
+
+        pipeline.execute()
+    except RedisError:
+        current_app.logger.exception('Could not invalidate cached users.')
+
+    return None
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    """
+    Remember which users were changed by a flush, and whose password changed.
+    """
+    changed = session.info.setdefault('changed_user_ids', set())
+    revoked = session.info.setdefault('revoked_user_ids', set())
+
+    for instance in session.new | session.dirty | session.deleted:
+        if isinstance(instance, User):
+            changed.add(instance.id)
+
+            if inspect(instance).attrs.password.history.has_changes():
+                revoked.add(instance.id)
+        elif isinstance(instance, INVALIDATING_MODELS):
+            changed.add(instance.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    """
+    Invalidate the users that were changed once their changes are visible.
+    """
+    changed = session.info.pop('changed_user_ids', None)
+    revoked = session.info.pop('revoked_user_ids', None)
+
+    if changed:
+        invalidate(*[user_id for user_id in changed if user_id is not None])
+
+    if revoked:
+        auth_tokens.revoke(*[user_id for user_id in revoked
+                             if user_id is not None])
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_changed_users(session, previous_transaction):
+    """
+    Nothing was changed if the transaction got rolled back.
+    """
+    if previous_transaction.parent is None:
+        session.info.pop('changed_user_ids', None)
+        session.info.pop('revoked_user_ids', None)
@@ -1,22 +1,27 @@
 import datetime
 from collections import OrderedDict
-from hashlib import md5
 
 import pytz
+import stripe
 from flask import current_app
-from sqlalchemy import or_
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import DDL, event
 
 from flask_login import UserMixin
 
-from itsdangerous import URLSafeTimedSerializer, \
-    TimedJSONWebSignatureSerializer
+from itsdangerous import TimedJSONWebSignatureSerializer
 
-from lib.util_sqlalchemy import ResourceMixin, AwareDateTime
+from lib.util_sqlalchemy import ResourceMixin, AwareDateTime, search_filter
 from snakeeyes.blueprints.billing.models.credit_card import CreditCard
 from snakeeyes.blueprints.billing.models.subscription import Subscription
 from snakeeyes.blueprints.billing.models.invoice import Invoice
+from snakeeyes.blueprints.billing.gateways import bulk
+from snakeeyes.blueprints.billing.gateways.stripecom import (
+    Subscription as PaymentSubscription
+)
+from snakeeyes.blueprints.bet.models import leaderboard
+from snakeeyes.blueprints.user import passwords
 from snakeeyes.blueprints.bet.models.bet import Bet
+from snakeeyes.blueprints.bet.models.stats import BetStats
 from snakeeyes.extensions import db
 
 
@@ -27,6 +32,13 @@ class User(UserMixin, ResourceMixin, db.Model):
     ])
 
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_created_on_id', 'created_on', 'id'),
+        db.Index('ix_users_email_trgm', 'email', postgresql_using='gin',
+                 postgresql_ops={'email': 'gin_trgm_ops'}),
+        db.Index('ix_users_username_trgm', 'username', postgresql_using='gin',
+                 postgresql_ops={'username': 'gin_trgm_ops'})
+    )
     id = db.Column(db.Integer, primary_key=True)
 
     # Relationships.
@@ -36,6 +48,8 @@ class User(UserMixin, ResourceMixin, db.Model):
                                    backref='users', passive_deletes=True)
     invoices = db.relationship(Invoice, backref='users', passive_deletes=True)
     bets = db.relationship(Bet, backref='bets', passive_deletes=True)
+    bet_stats = db.relationship(BetStats, uselist=False, backref='users',
+                                passive_deletes=True)
 
     # Authentication.
     role = db.Column(db.Enum(*ROLE, name='role_types', native_enum=False),
@@ -95,12 +109,15 @@ class User(UserMixin, ResourceMixin, db.Model):
         In other words while bcrypt might be superior in practice, if you use
         PBKDF2 properly (which we are), then your passwords are safe.
 
+        The hashing happens in a bounded pool of processes, see
+        PASSWORD_HASH_WORKERS.
+
         :param plaintext_password: Password in plain text
         :type plaintext_password: str
         :return: str
         """
         if plaintext_password:
-            return generate_password_hash(plaintext_password)
+            return passwords.hash_password(plaintext_password)
 
         return None
 
@@ -150,14 +167,7 @@ class User(UserMixin, ResourceMixin, db.Model):
         :type query: str
         :return: SQLAlchemy filter
         """
-        if not query:
-            return ''
-
-        search_query = '%{0}%'.format(query)
-        search_chain = (User.email.ilike(search_query),
-                        User.username.ilike(search_query))
-
-        return or_(*search_chain)
+        return search_filter((User.email, User.username), query)
 
     @classmethod
     def is_last_admin(cls, user, new_role, new_active):
@@ -185,34 +195,64 @@ class User(UserMixin, ResourceMixin, db.Model):
         return False
 
     @classmethod
-    def bulk_delete(cls, ids):
+    def bulk_delete(cls, ids, progress=None):
         """
-        Override the general bulk_delete method because we need to delete them
-        one at a time while also deleting them on Stripe.
+        Override the general bulk_delete method because we need to cancel
+        subscriptions on Stripe before deleting users locally.
+
+        Users are handled in chunks. Each chunk's subscriptions get cancelled
+        concurrently and then every user whose subscription is gone gets
+        deleted with 1 statement, their subscription, credit card, invoices
+        and bets cascade with them. Users whose subscription could not be
+        cancelled are kept so they can be deleted again later.
 
         :param ids: List of ids to be deleted
         :type ids: list
+        :param progress: Called with how many ids were handled so far and
+                         how many there are in total after every chunk
+        :type progress: function
         :return: int
         """
+        # Prevent circular imports.
+        from snakeeyes.blueprints.user import cache as user_cache
+
+        ids = [int(id) for id in ids]
+        chunk_size = current_app.config['USER_DELETE_CHUNK_SIZE']
         delete_count = 0
 
-        for id in ids:
-            user = User.query.get(id)
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
 
-            if user is None:
-                continue
+            payment_ids = dict(db.session.query(User.id, User.payment_id)
+                               .filter(User.id.in_(chunk)).all())
+            subscribed = dict((id, (payment_id,))
+                              for id, payment_id in payment_ids.items()
+                              if payment_id is not None)
 
-            if user.payment_id is None:
-                user.delete()
-            else:
-                subscription = Subscription()
-                cancelled = subscription.cancel(user=user)
+            cancelled, failed = bulk.call_each(
+                _cancel_subscription, subscribed,
+                workers=current_app.config['PAYMENT_GATEWAY_WORKERS'],
+                retries=current_app.config['PAYMENT_GATEWAY_RETRIES'],
+                backoff=current_app.config['PAYMENT_GATEWAY_BACKOFF'])
 
-                # If successful, delete it locally.
-                if cancelled:
-                    user.delete()
+            for id, error in failed.items():
+                current_app.logger.error(
+                    'Could not cancel the subscription of user %s: %s',
+                    id, error)
 
-            delete_count += 1
+            deletable = [id for id in payment_ids if id not in failed]
+
+            if deletable:
+                delete_count += User.query \
+                    .filter(User.id.in_(deletable)) \
+                    .delete(synchronize_session=False)
+                db.session.commit()
+
+                user_cache.invalidate(*deletable)
+                leaderboard.remove_user(*deletable)
+
+            if progress:
+                progress(min(start + chunk_size, len(ids)), len(ids))
 
         return delete_count
 
@@ -229,19 +269,16 @@ class User(UserMixin, ResourceMixin, db.Model):
         """
         Return the user's auth token. Use their password as part of the token
         because if the user changes their password we will want to invalidate
-        all of their logins across devices. It is completely fine to use
-        md5 here as nothing leaks.
+        all of their logins across devices.
 
         This satisfies Flask-Login by providing a means to create a token.
 
         :return: str
         """
-        private_key = current_app.config['SECRET_KEY']
-
-        serializer = URLSafeTimedSerializer(private_key)
-        data = [str(self.id), md5(self.password.encode('utf-8')).hexdigest()]
+        # Prevent circular imports.
+        from snakeeyes.blueprints.user import auth_tokens
 
-        return serializer.dumps(data)
+        return auth_tokens.dump(self)
 
     def authenticated(self, with_password=True, password=''):
         """
@@ -254,7 +291,7 @@ class User(UserMixin, ResourceMixin, db.Model):
         :return: bool
         """
         if with_password:
-            return check_password_hash(self.password, password)
+            return passwords.check_password(self.password, password)
 
         return True
 
@@ -299,6 +336,35 @@ class User(UserMixin, ResourceMixin, db.Model):
         :type plan: str
         :return: SQLAlchemy commit results
         """
-        self.coins += plan['metadata']['coins']
+        self.coins = User.coins + plan['metadata']['coins']
+        saved = self.save()
 
-        return self.save()
+        leaderboard.record_coins(self.id, self.coins)
+
+        return saved
+
+
+def _cancel_subscription(payment_id):
+    """
+    Cancel a customer's subscription on Stripe before deleting them. There is
+    nothing to cancel if the customer or their subscription is already gone.
+
+    :param payment_id: Stripe customer id
+    :type payment_id: str
+    :return: Stripe subscription object or None
+    """
+    try:
+        return PaymentSubscription.cancel(payment_id)
+    except IndexError:
+        return None
+    except stripe.error.InvalidRequestError as e:
+        if e.http_status == 404:
+            return None
+
+        raise
+
+
+# The trigram indexes need pg_trgm, migrations enable it on their own but
+# databases created straight from the models need it enabled too.
+event.listen(User.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
@@ -0,0 +1,214 @@
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+
+from flask import current_app, has_app_context
+from redis import RedisError
+from werkzeug.exceptions import TooManyRequests
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from config import settings
+from snakeeyes.extensions import redis
+
+
+class PasswordHashingBusy(TooManyRequests):
+    """
+    Too many passwords are waiting to be hashed. It is a 429 so it renders
+    the same error page as being rate limited.
+    """
+    description = 'Too many people are signing in right now, try again soon.'
+
+
+def _setting(name):
+    """
+    Read a setting from the current app, falling back to the default settings
+    when there is no app context such as in CLI scripts.
+
+    :param name: Setting name
+    :type name: str
+    :return: Setting value
+    """
+    if has_app_context():
+        return current_app.config[name]
+
+    return getattr(settings, name)
+
+
+class PasswordHasher(object):
+    """
+    Hash and check passwords in a small pool of processes. PBKDF2 is slow on
+    purpose, so capping how many processes do it at once keeps a storm of
+    sign ins from eating every CPU that bets need.
+
+    Only PASSWORD_HASH_MAX_PENDING passwords can be waiting to be hashed
+    across every app worker, anything beyond that is turned away immediately
+    instead of piling up. The slots are kept in Redis so the limit holds no
+    matter how many workers gunicorn runs, each worker falls back to its own
+    limit while Redis is unreachable. Set PASSWORD_HASH_WORKERS to 0 to hash
+    inline.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def _start(self, workers, max_pending):
+        """
+        Start the pool, each forked process must start its own.
+
+        :param workers: How many processes to hash with
+        :type workers: int
+        :param max_pending: How many passwords can wait on the pool
+        :type max_pending: int
+        :return: Tuple of the pool and its semaphore
+        """
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = multiprocessing.Pool(workers)
+                self._pid = os.getpid()
+                self._slots = threading.BoundedSemaphore(max_pending)
+
+        return self._pool, self._slots
+
+    def reset(self):
+        """
+        Stop the pool, it gets started again on demand.
+
+        :return: None
+        """
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.terminate()
+
+            self._pool = None
+            self._pid = None
+
+        return None
+
+    def _claim_slot(self, max_pending, timeout):
+        """
+        Claim 1 of the slots shared by every app worker. A slot that was
+        never given back, such as by a worker that got killed, expires once
+        its hash would have timed out anyway.
+
+        :param max_pending: How many passwords can wait across every worker
+        :type max_pending: int
+        :param timeout: Seconds a hash can take
+        :type timeout: int
+        :return: Slot id, None when there is no free slot or False when
+          Redis is unreachable
+        """
+        slots_key = _setting('PASSWORD_HASH_SLOTS_KEY')
+        slot = uuid.uuid4().hex
+        now = time.time()
+
+        try:
+            pipeline = redis.pipeline()
+            pipeline.zremrangebyscore(slots_key, '-inf', now - timeout)
+            pipeline.zadd(slots_key, now, slot)
+            pipeline.zrank(slots_key, slot)
+            pipeline.expire(slots_key, int(timeout) + 1)
+            rank = pipeline.execute()[2]
+
+            if rank < max_pending:
+                return slot
+
+            redis.zrem(slots_key, slot)
+        except RedisError:
+            current_app.logger.exception('Could not claim a hashing slot.')
+            return False
+
+        return None
+
+    def _release_slot(self, slot):
+        """
+        Give back a slot claimed with _claim_slot.
+
+        :param slot: Slot id
+        :type slot: str
+        :return: None
+        """
+        try:
+            redis.zrem(_setting('PASSWORD_HASH_SLOTS_KEY'), slot)
+        except RedisError:
+            current_app.logger.exception('Could not release a hashing slot.')
+
+        return None
+
+    def run(self, func, *args):
+        """
+        Run a hashing function in the pool and wait for its result.
+
+        :param func: Function to run, it must be importable
+        :type func: function
+        :return: The function's result
+        """
+        workers = _setting('PASSWORD_HASH_WORKERS')
+
+        if not workers or not has_app_context():
+            return func(*args)
+
+        max_pending = _setting('PASSWORD_HASH_MAX_PENDING')
+        timeout = _setting('PASSWORD_HASH_TIMEOUT')
+        pool, slots = self._start(workers, max_pending)
+
+        slot = self._claim_slot(max_pending, timeout)
+
+        if slot is None or (slot is False and not slots.acquire(False)):
+            raise PasswordHashingBusy()
+
+        try:
+            return pool.apply_async(func, args).get(timeout)
+        except multiprocessing.TimeoutError:
+            raise PasswordHashingBusy()
+        finally:
+            if slot is False:
+                slots.release()
+            else:
+                self._release_slot(slot)
+
+
+hasher = PasswordHasher()
+
+
+def hash_password(plaintext_password):
+    """
+    Hash a password with the configured method.
+
+    :param plaintext_password: Password in plain text
+    :type plaintext_password: str
+    :return: str
+    """
+    return hasher.run(generate_password_hash, plaintext_password,
+                      _setting('PASSWORD_HASH_METHOD'))
+
+
+def check_password(password, plaintext_password):
+    """
+    Check a password against its hash.
+
+    :param password: Password hash
+    :type password: str
+    :param plaintext_password: Password in plain text
+    :type plaintext_password: str
+    :return: bool
+    """
+    return hasher.run(check_password_hash, password, plaintext_password)
+
+
+def needs_rehash(password):
+    """
+    Determine if a password was hashed with an outdated method or work
+    factor, such as before PASSWORD_HASH_METHOD was changed.
+
+    :param password: Password hash
+    :type password: str
+    :return: bool
+    """
+    method = (password or '').split('$', 1)[0]
+
+    return method != _setting('PASSWORD_HASH_METHOD')
@@ -1,14 +1,14 @@
-from lib.flask_mailplus import send_template_message
-from snakeeyes.app import create_celery_app
-from snakeeyes.blueprints.user.models import User
+from celery import shared_task
+from flask import current_app
 
-celery = create_celery_app()
+from lib.flask_mailplus import deliver_queued_messages, queue_template_message
+from snakeeyes.blueprints.user.models import User
 
 
-@celery.task()
+@shared_task()
 def deliver_password_reset_email(user_id, reset_token):
     """
-    Send a reset password e-mail to a user.
+    Queue up a reset password e-mail to a user.
 
     :param user_id: The user id
     :type user_id: int
@@ -23,8 +23,30 @@ def deliver_password_reset_email(user_id, reset_token):
 
     ctx = {'user': user, 'reset_token': reset_token}
 
-    send_template_message(subject='Password reset from Snake Eyes',
-                          recipients=[user.email],
-                          template='user/mail/password_reset', ctx=ctx)
+    queue_template_message(subject='Password reset from Snake Eyes',
+                           recipients=[user.email],
+                           template='user/mail/password_reset', ctx=ctx,
+                           schedule=deliver_queued_mail.apply_async)
 
     return None
+
+
+@shared_task(ignore_result=True)
+def deliver_queued_mail():
+    """
+    Send every queued up e-mail, a batch at a time.
+
+    :return: dict of how many e-mails were sent, retried and failed
+    """
+    batch_size = current_app.config['MAIL_BATCH_SIZE']
+    totals = {'sent': 0, 'retried': 0, 'failed': 0}
+
+    while True:
+        outcome = deliver_queued_messages(batch_size)
+
+        for status, count in outcome.items():
+            totals[status] += count
+
+        # Retries are parked, so a short batch means the queue is empty.
+        if sum(outcome.values()) < batch_size:
+            return totals
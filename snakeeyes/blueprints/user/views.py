@@ -12,6 +12,7 @@ from flask_login import (
     logout_user)
 
 from lib.safe_next_url import safe_next_url
+from snakeeyes.blueprints.user import passwords
 from snakeeyes.blueprints.user.decorators import anonymous_required
 from snakeeyes.blueprints.user.models import User
 from snakeeyes.blueprints.user.forms import (
@@ -45,6 +46,11 @@ def login():
             # 2) Uncomment the 'remember' field in user/forms.py#LoginForm
             # 3) Add a checkbox to the login form with the id/name 'remember'
             if login_user(u, remember=True) and u.is_active():
+                # Upgrade the hash now while the plain password is known.
+                if passwords.needs_rehash(u.password):
+                    u.password = User.encrypt_password(
+                        request.form.get('password'))
+
                 u.update_activity_tracking(request.remote_addr)
 
                 # Handle optionally redirecting to the next URL safely.
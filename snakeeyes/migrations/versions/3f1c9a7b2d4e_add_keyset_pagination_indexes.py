@@ -0,0 +1,39 @@
+import sqlalchemy as sa
+
+from alembic import op
+
+from lib.util_datetime import tzware_datetime
+from lib.util_sqlalchemy import AwareDateTime
+
+
+"""
+add keyset pagination indexes
+
+Revision ID: 3f1c9a7b2d4e
+Revises: None
+Create Date: 2026-10-17 09:12:44.318207
+"""
+
+# Revision identifiers, used by Alembic.
+revision = '3f1c9a7b2d4e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_bets_user_id_created_on_id', 'bets',
+                    ['user_id', 'created_on', 'id'], unique=False)
+    op.create_index('ix_users_created_on_id', 'users',
+                    ['created_on', 'id'], unique=False)
+    op.create_index('ix_coupons_created_on_id', 'coupons',
+                    ['created_on', 'id'], unique=False)
+    op.create_index('ix_invoices_created_on_id', 'invoices',
+                    ['created_on', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_invoices_created_on_id', table_name='invoices')
+    op.drop_index('ix_coupons_created_on_id', table_name='coupons')
+    op.drop_index('ix_users_created_on_id', table_name='users')
+    op.drop_index('ix_bets_user_id_created_on_id', table_name='bets')
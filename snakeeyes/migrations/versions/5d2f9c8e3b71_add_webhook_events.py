@@ -0,0 +1,56 @@
+import sqlalchemy as sa
+
+from alembic import op
+
+from lib.util_datetime import tzware_datetime
+from lib.util_sqlalchemy import AwareDateTime
+
+
+"""
+add webhook events
+
+Revision ID: 5d2f9c8e3b71
+Revises: e6b3d8a1f47c
+Create Date: 2026-10-17 17:05:48.913524
+"""
+
+# Revision identifiers, used by Alembic.
+revision = '5d2f9c8e3b71'
+down_revision = 'e6b3d8a1f47c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('webhook_events',
+                    sa.Column('created_on', AwareDateTime(),
+                              nullable=True),
+                    sa.Column('updated_on', AwareDateTime(),
+                              nullable=True),
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('event_id', sa.String(length=255),
+                              nullable=False),
+                    sa.Column('status',
+                              sa.Enum('pending', 'processing', 'processed',
+                                      'failed',
+                                      name='webhook_event_status',
+                                      native_enum=False),
+                              server_default='pending', nullable=False),
+                    sa.Column('attempts', sa.Integer(), server_default='0',
+                              nullable=False),
+                    sa.Column('error', sa.Text(), nullable=True),
+                    sa.Column('processed_on', AwareDateTime(),
+                              nullable=True),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index(op.f('ix_webhook_events_event_id'), 'webhook_events',
+                    ['event_id'], unique=True)
+    op.create_index(op.f('ix_webhook_events_status'), 'webhook_events',
+                    ['status'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_webhook_events_status'),
+                  table_name='webhook_events')
+    op.drop_index(op.f('ix_webhook_events_event_id'),
+                  table_name='webhook_events')
+    op.drop_table('webhook_events')
@@ -0,0 +1,123 @@
+import sqlalchemy as sa
+
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+from lib.util_datetime import tzware_datetime
+from lib.util_sqlalchemy import AwareDateTime
+
+
+"""
+add bet stats
+
+Revision ID: 8b2e4d6f1a3c
+Revises: 3f1c9a7b2d4e
+Create Date: 2026-10-17 11:02:17.904511
+"""
+
+# Revision identifiers, used by Alembic.
+revision = '8b2e4d6f1a3c'
+down_revision = '3f1c9a7b2d4e'
+branch_labels = None
+depends_on = None
+
+# Copied from the model as it was at this revision, so later changes to the
+# model never change what this migration runs. Guesses 0-12 get a slot.
+BACKFILL_BET_STATS_SQL = """
+INSERT INTO bet_stats (created_on, updated_on, user_id, bets, wagered, net,
+                       wins, biggest_win, current_streak, longest_win_streak,
+                       guess_counts, guess_wins)
+WITH ordered AS (
+    SELECT user_id, guess, wagered, net, guess = roll AS won,
+           row_number() OVER (PARTITION BY user_id
+                              ORDER BY created_on, id) AS position
+    FROM bets
+), runs AS (
+    SELECT user_id, won, count(*) AS length, max(position) AS last
+    FROM (
+        SELECT user_id, won, position,
+               position - row_number() OVER (PARTITION BY user_id, won
+                                             ORDER BY position) AS run
+        FROM ordered
+    ) AS r
+    GROUP BY user_id, won, run
+), streaks AS (
+    SELECT DISTINCT ON (user_id) user_id,
+           CASE WHEN won THEN length ELSE -length END AS current_streak
+    FROM runs
+    ORDER BY user_id, last DESC
+), longest AS (
+    SELECT user_id, max(length) AS longest_win_streak
+    FROM runs
+    WHERE won
+    GROUP BY user_id
+), totals AS (
+    SELECT user_id, count(*) AS bets, sum(wagered) AS wagered,
+           sum(net) AS net, count(*) FILTER (WHERE won) AS wins,
+           coalesce(max(net) FILTER (WHERE won), 0) AS biggest_win
+    FROM ordered
+    GROUP BY user_id
+), per_guess AS (
+    SELECT user_id, guess, count(*) AS bets,
+           count(*) FILTER (WHERE won) AS wins
+    FROM ordered
+    GROUP BY user_id, guess
+), histograms AS (
+    SELECT t.user_id,
+           array_agg(coalesce(g.bets, 0) ORDER BY slot.guess)
+             AS guess_counts,
+           array_agg(coalesce(g.wins, 0) ORDER BY slot.guess) AS guess_wins
+    FROM totals AS t
+    CROSS JOIN generate_series(0, 12) AS slot(guess)
+    LEFT JOIN per_guess AS g
+           ON g.user_id = t.user_id AND g.guess = slot.guess
+    GROUP BY t.user_id
+)
+SELECT now(), now(), t.user_id, t.bets, t.wagered, t.net, t.wins,
+       t.biggest_win, streaks.current_streak,
+       coalesce(longest.longest_win_streak, 0), h.guess_counts, h.guess_wins
+FROM totals AS t
+JOIN streaks USING (user_id)
+JOIN histograms AS h USING (user_id)
+LEFT JOIN longest USING (user_id)
+"""
+
+
+def upgrade():
+    op.create_table('bet_stats',
+                    sa.Column('created_on', AwareDateTime(),
+                              nullable=True),
+                    sa.Column('updated_on', AwareDateTime(),
+                              nullable=True),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('bets', sa.BigInteger(), nullable=False,
+                              server_default='0'),
+                    sa.Column('wagered', sa.BigInteger(), nullable=False,
+                              server_default='0'),
+                    sa.Column('net', sa.BigInteger(), nullable=False,
+                              server_default='0'),
+                    sa.Column('wins', sa.BigInteger(), nullable=False,
+                              server_default='0'),
+                    sa.Column('biggest_win', sa.BigInteger(),
+                              nullable=False, server_default='0'),
+                    sa.Column('current_streak', sa.Integer(),
+                              nullable=False, server_default='0'),
+                    sa.Column('longest_win_streak', sa.Integer(),
+                              nullable=False, server_default='0'),
+                    sa.Column('guess_counts',
+                              postgresql.ARRAY(sa.BigInteger()),
+                              nullable=False),
+                    sa.Column('guess_wins',
+                              postgresql.ARRAY(sa.BigInteger()),
+                              nullable=False),
+                    sa.ForeignKeyConstraint(['user_id'], ['users.id'],
+                                            onupdate='CASCADE',
+                                            ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('user_id'))
+
+    # Backfill the stats of every user who has already placed bets.
+    op.execute(BACKFILL_BET_STATS_SQL)
+
+
+def downgrade():
+    op.drop_table('bet_stats')
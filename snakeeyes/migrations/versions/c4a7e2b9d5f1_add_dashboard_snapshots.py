@@ -0,0 +1,37 @@
+import sqlalchemy as sa
+
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+from lib.util_datetime import tzware_datetime
+from lib.util_sqlalchemy import AwareDateTime
+
+
+"""
+add dashboard snapshots
+
+Revision ID: c4a7e2b9d5f1
+Revises: 8b2e4d6f1a3c
+Create Date: 2026-10-17 13:41:05.227390
+"""
+
+# Revision identifiers, used by Alembic.
+revision = 'c4a7e2b9d5f1'
+down_revision = '8b2e4d6f1a3c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('dashboard_snapshots',
+                    sa.Column('created_on', AwareDateTime(),
+                              nullable=True),
+                    sa.Column('updated_on', AwareDateTime(),
+                              nullable=True),
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('data', postgresql.JSON(), nullable=False),
+                    sa.PrimaryKeyConstraint('id'))
+
+
+def downgrade():
+    op.drop_table('dashboard_snapshots')
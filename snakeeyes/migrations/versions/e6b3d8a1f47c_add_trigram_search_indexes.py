@@ -0,0 +1,36 @@
+import sqlalchemy as sa
+
+from alembic import op
+
+from lib.util_datetime import tzware_datetime
+from lib.util_sqlalchemy import AwareDateTime
+
+
+"""
+add trigram search indexes
+
+Revision ID: e6b3d8a1f47c
+Revises: c4a7e2b9d5f1
+Create Date: 2026-10-17 16:22:31.604118
+"""
+
+# Revision identifiers, used by Alembic.
+revision = 'e6b3d8a1f47c'
+down_revision = 'c4a7e2b9d5f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_users_email_trgm', 'users', ['email'],
+                    unique=False, postgresql_using='gin',
+                    postgresql_ops={'email': 'gin_trgm_ops'})
+    op.create_index('ix_users_username_trgm', 'users', ['username'],
+                    unique=False, postgresql_using='gin',
+                    postgresql_ops={'username': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_users_username_trgm', table_name='users')
+    op.drop_index('ix_users_email_trgm', table_name='users')
@@ -1,4 +1,6 @@
+from snakeeyes.blueprints.admin.models import DashboardSnapshot
 from snakeeyes.blueprints.billing.models.coupon import Coupon
+from snakeeyes.blueprints.user.models import User
 
 
 class TestCoupon(object):
@@ -19,3 +21,24 @@ class TestCoupon(object):
         new_amount = coupon.apply_discount_to(amount)
 
         assert new_amount == 67
+
+
+class TestDashboardSnapshot(object):
+    def test_refresh(self, users):
+        """ Refreshing stores the latest aggregates in a single snapshot. """
+        first = DashboardSnapshot.refresh()
+        total = first.data['group_and_count_users']['total']
+
+        User(email='snapshot@local.host', password='password').save()
+        second = DashboardSnapshot.refresh()
+
+        assert first.id == second.id
+        assert DashboardSnapshot.query.count() == 1
+        assert second.data['group_and_count_users']['total'] == total + 1
+        assert DashboardSnapshot.latest().updated_on >= first.created_on
+
+    def test_latest_before_first_refresh(self, session):
+        """ There is no snapshot until the first refresh. """
+        DashboardSnapshot.query.delete()
+
+        assert DashboardSnapshot.latest() is None
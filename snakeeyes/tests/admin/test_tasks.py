@@ -0,0 +1,72 @@
+import time
+
+from lib.error_digest import DigestHandler
+from snakeeyes.extensions import mail, redis
+from snakeeyes.blueprints.admin.tasks import deliver_error_digest
+from snakeeyes.blueprints.user.tasks import deliver_queued_mail
+
+
+class TestErrorDigest(object):
+    def setup_method(self, method):
+        redis.delete('test:errors:counts', 'test:errors:samples',
+                     'test:errors:scheduled', 'test:mail',
+                     'test:mail:scheduled')
+
+    def flood(self, app, errors):
+        """
+        Log the same exception many times, like a failing view under load.
+
+        :return: List of the countdowns a digest got scheduled with
+        """
+        handler = [handler for handler in app.logger.handlers
+                   if isinstance(handler, DigestHandler)][0]
+        original, scheduled = handler.schedule, []
+        handler.schedule = lambda countdown: scheduled.append(countdown)
+
+        try:
+            for i in range(errors):
+                try:
+                    1 / 0
+                except ZeroDivisionError:
+                    app.logger.exception('Something broke.')
+        finally:
+            handler.schedule = original
+
+        return scheduled
+
+    def test_flood_does_not_block(self, app):
+        """ A flood of errors stays fast and schedules a single digest. """
+        start = time.time()
+        scheduled = self.flood(app, 500)
+        elapsed = time.time() - start
+
+        assert elapsed / 500 < 0.01
+        assert scheduled == [app.config['ERROR_DIGEST_WINDOW']]
+        assert redis.hlen('test:errors:counts') == 1
+
+    def test_deliver_error_digest(self, app):
+        """ Identical errors are e-mailed once along with their count. """
+        self.flood(app, 20)
+
+        with mail.record_messages() as outbox:
+            assert deliver_error_digest() == 20
+            deliver_queued_mail()
+
+            assert len(outbox) == 1
+            assert 'Logged 20 times' in outbox[0].body
+            assert 'ZeroDivisionError' in outbox[0].body
+
+        assert deliver_error_digest() == 0
+
+    def test_byte_string_message(self, app):
+        """ A non-ASCII byte string message gets counted like any other. """
+        handler = [handler for handler in app.logger.handlers
+                   if isinstance(handler, DigestHandler)][0]
+        original, handler.schedule = handler.schedule, lambda countdown: None
+
+        try:
+            app.logger.error(b'Caf\xc3\xa9 is closed.')
+        finally:
+            handler.schedule = original
+
+        assert redis.hlen('test:errors:counts') == 1
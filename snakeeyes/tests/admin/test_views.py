@@ -1,16 +1,51 @@
+import json
+
 from flask import url_for
+from mock import patch
 
 from lib.tests import ViewTestMixin, assert_status_with_message
+from snakeeyes.blueprints.admin.models import DashboardSnapshot
+from snakeeyes.blueprints.admin.tasks import export_resource, refresh_dashboard
 from snakeeyes.blueprints.user.models import User
 
 
+def export_right_away(args, task_id):
+    """ Write an export in the test instead of sending it to Celery. """
+    return export_resource(*args)
+
+
 class TestDashboard(ViewTestMixin):
     def test_dashboard_page(self):
+        DashboardSnapshot.refresh()
+
         self.login()
         response = self.client.get(url_for('admin.dashboard'))
 
         assert bytes('User'.encode('utf-8')) in response.data
 
+    def test_dashboard_page_before_first_snapshot(self):
+        """ Without a snapshot the aggregates get queued, not run inline. """
+        DashboardSnapshot.query.delete()
+
+        self.login()
+
+        with patch.object(refresh_dashboard, 'delay') as delay:
+            response = self.client.get(url_for('admin.dashboard'))
+
+        assert_status_with_message(200, response,
+                                   'The dashboard is being calculated')
+        assert delay.call_count == 1
+        assert DashboardSnapshot.query.count() == 0
+
+    def test_dashboard_refresh(self):
+        """ Refreshing the dashboard gets scheduled. """
+        self.login()
+        response = self.client.post(url_for('admin.dashboard_refresh'),
+                                    follow_redirects=True)
+
+        assert_status_with_message(200, response,
+                                   'The dashboard is being refreshed')
+
 
 class TestUsers(ViewTestMixin):
     def test_index_page(self):
@@ -20,6 +55,14 @@ class TestUsers(ViewTestMixin):
 
         assert response.status_code == 200
 
+    def test_index_page_search(self):
+        """ Index renders search results sorted by another field. """
+        self.login()
+        response = self.client.get(url_for('admin.users', q='disabled',
+                                           sort='email'))
+
+        assert_status_with_message(200, response, 'disabled@local.host')
+
     def test_edit_page(self):
         """ Edit page renders successfully. """
         self.login()
@@ -60,6 +103,87 @@ class TestUsers(ViewTestMixin):
         new_count = User.query.count()
         assert old_count == new_count
 
+    def test_export_search_results_csv(self, users):
+        """ Search results get exported as CSV. """
+        self.login()
+
+        with patch.object(export_resource, 'apply_async', export_right_away):
+            response = self.client.post(url_for('admin.users_export',
+                                                format='csv', q='disabled'),
+                                        follow_redirects=True)
+        lines = response.data.decode('utf-8').splitlines()
+
+        assert response.status_code == 200
+        assert response.mimetype == 'text/csv'
+        assert lines[0].startswith('id,created_on,role')
+        assert len(lines) == 2
+        assert 'disabled@local.host' in lines[1]
+
+    def test_export_selected_items_ndjson(self, users):
+        """ Selected items get exported as NDJSON. """
+        user = User.find_by_identity('admin@local.host')
+        params = {
+            'bulk_ids': [user.id],
+            'scope': 'all_selected_items'
+        }
+
+        self.login()
+
+        with patch.object(export_resource, 'apply_async', export_right_away):
+            response = self.client.post(url_for('admin.users_export',
+                                                format='ndjson'),
+                                        data=params, follow_redirects=True)
+        rows = [json.loads(line) for line in
+                response.data.decode('utf-8').splitlines()]
+
+        assert response.status_code == 200
+        assert [row['email'] for row in rows] == ['admin@local.host']
+
+    def test_export_escapes_formulas(self, users):
+        """ Cells that a spreadsheet would run as formulas become text. """
+        user = User.find_by_identity('admin@local.host')
+        user.name = '=HYPERLINK("http://evil.local")'
+        user.save()
+
+        self.login()
+
+        with patch.object(export_resource, 'apply_async', export_right_away):
+            response = self.client.post(url_for('admin.users_export',
+                                                format='csv', q='admin'),
+                                        follow_redirects=True)
+
+        assert '"\'=HYPERLINK(""http://evil.local"")"' in \
+            response.data.decode('utf-8')
+
+    def test_export_while_pending(self, users):
+        """ An export that is not written yet asks to check back later. """
+        self.login()
+
+        with patch.object(export_resource, 'apply_async'):
+            response = self.client.post(url_for('admin.users_export',
+                                                format='csv'),
+                                        follow_redirects=True)
+
+        assert_status_with_message(200, response,
+                                   'Your export is being created')
+        assert response.headers['Refresh'] == '3'
+
+    def test_export_needs_post(self):
+        """ Asking for an export is a form submission, not a link. """
+        self.login()
+        response = self.client.get(url_for('admin.users_export',
+                                           format='csv'))
+
+        assert response.status_code == 405
+
+    def test_export_download_unknown_file(self):
+        """ Only exports can be downloaded. """
+        self.login()
+        response = self.client.get(url_for('admin.exports_download',
+                                           filename='../settings.py'))
+
+        assert response.status_code == 404
+
     def test_cancel_subscription(self, subscriptions, mock_stripe):
         """ User subscription gets cancelled. """
         user = User.find_by_identity('subscriber@local.host')
@@ -126,6 +250,18 @@ class TestCoupon(ViewTestMixin):
                                    '{0} coupons(s)'
                                    ' were scheduled to be deleted.'.format(3))
 
+    def test_export(self, coupons):
+        """ Coupons get exported. """
+        self.login()
+
+        with patch.object(export_resource, 'apply_async', export_right_away):
+            response = self.client.post(url_for('admin.coupons_export',
+                                                format='csv'),
+                                        follow_redirects=True)
+
+        assert response.status_code == 200
+        assert len(response.data.decode('utf-8').splitlines()) == 4
+
 
 class TestInvoices(ViewTestMixin):
     def test_index_page(self):
@@ -134,3 +270,16 @@ class TestInvoices(ViewTestMixin):
         response = self.client.get(url_for('admin.invoices'))
 
         assert response.status_code == 200
+
+    def test_export(self):
+        """ Invoices get exported as CSV. """
+        self.login()
+
+        with patch.object(export_resource, 'apply_async', export_right_away):
+            response = self.client.post(url_for('admin.invoices_export',
+                                                format='csv'),
+                                        follow_redirects=True)
+        lines = response.data.decode('utf-8').splitlines()
+
+        assert response.status_code == 200
+        assert lines[0].startswith('id,created_on,user_id,email')
@@ -1,11 +1,32 @@
 import datetime
 
+import numpy as np
 import pytz
 
-from snakeeyes.blueprints.bet.models.dice import roll
+from config import settings
+from lib.util_sqlalchemy import (
+    decode_cursor,
+    encode_cursor,
+    keyset_paginate
+)
+
+from snakeeyes.blueprints.bet.models.dice import (
+    RollBuffer,
+    roll,
+    roll_pairs
+)
+from snakeeyes.blueprints.bet.models.payout import PayoutTable
 from snakeeyes.blueprints.bet.models.coin import add_subscription_coins
 from snakeeyes.blueprints.bet.models.bet import Bet
+from snakeeyes.extensions import redis
+from snakeeyes.blueprints.bet.models import leaderboard
+from snakeeyes.blueprints.bet.models.stats import BetStats
+from snakeeyes.blueprints.bet.models.settlement import (
+    settle_bet,
+    settle_bets
+)
 from snakeeyes.blueprints.billing.models.subscription import Subscription
+from snakeeyes.blueprints.user.models import User
 
 
 class TestDice(object):
@@ -16,6 +37,70 @@ class TestDice(object):
         for i in range(1, 100):
             assert roll() >= 1 and roll() <= 6
 
+    def test_dice_roll_pairs(self):
+        """ Rolling many pairs of dice should be in bounds. """
+        dice_1, dice_2 = roll_pairs(100000)
+
+        assert len(dice_1) == 100000 and len(dice_2) == 100000
+        assert dice_1.min() >= 1 and dice_1.max() <= 6
+        assert dice_2.min() >= 1 and dice_2.max() <= 6
+
+    def test_dice_roll_buffer_is_fair(self):
+        """ Every face comes up about as often as the others. """
+        counts = np.bincount(RollBuffer().generate(600000), minlength=7)[1:]
+        expected = 600000 / 6.0
+        chi_square = ((counts - expected) ** 2 / expected).sum()
+
+        # Critical value for 5 degrees of freedom at p = 0.000001, a fair die
+        # only fails this about once in a million runs.
+        assert len(counts) == 6
+        assert chi_square < 35.888
+
+    def test_dice_roll_buffer_counters(self):
+        """ Rolls are served from the buffer until it needs a refill. """
+        buffer = RollBuffer(block_size=10)
+
+        for i in range(10):
+            buffer.take_one()
+
+        assert buffer.stats() == {'hits': 10, 'refills': 1, 'buffered': 0}
+
+        buffer.take_one()
+
+        assert buffer.stats() == {'hits': 11, 'refills': 2, 'buffered': 9}
+
+
+class TestPayoutTable(object):
+    def test_payout_lookup(self):
+        """ Payouts are looked up by their guess. """
+        payout_table = PayoutTable(settings.DICE_ROLL_PAYOUT)
+
+        assert payout_table.payout(2) == 36.0
+        assert payout_table.payout(7) == 6.0
+        assert 7 in payout_table
+        assert 1 not in payout_table
+        assert 13 not in payout_table
+
+    def test_settle_matches_scalar_rules(self):
+        """ Settling arrays of bets matches settling them 1 at a time. """
+        payout_table = PayoutTable(settings.DICE_ROLL_PAYOUT)
+
+        guesses = [5, 5, 7, 12, 2]
+        wagered = [5, 5, 3, 1, 7]
+        rolls = [5, 9, 7, 12, 3]
+
+        is_winner, payout, net = payout_table.settle(guesses, wagered, rolls)
+
+        for i, guess in enumerate(guesses):
+            winner = Bet.is_winner(guess, rolls[i])
+            expected_payout = Bet.determine_payout(payout_table.payout(guess),
+                                                   winner)
+
+            assert is_winner[i] == winner
+            assert payout[i] == expected_payout
+            assert net[i] == Bet.calculate_net(wagered[i], expected_payout,
+                                               winner)
+
 
 class TestCoin(object):
     def test_add_coins_to_subscription_upgrade(self):
@@ -80,3 +165,209 @@ class TestBet(object):
     def test_calculate_net_as_loser(self):
         """ Calculate net as loser is correct. """
         assert -5 == Bet.calculate_net(5, 9.0, False)
+
+
+class TestSettlement(object):
+    def test_settle_bet(self, session, users):
+        """ Settling a bet saves it and adjusts the user's coins. """
+        user = User.find_by_identity('admin@local.host')
+        coins = user.coins
+
+        bet, new_coins = settle_bet(user.id, 7, 10, 6.0)
+
+        assert bet.id is not None
+        assert new_coins == coins + bet.net
+        assert Bet.query.get(bet.id).net == bet.net
+        assert User.query.get(user.id).coins == new_coins
+
+    def test_settle_bet_cannot_overdraw(self, session, users):
+        """ Wagering more coins than the user has is rejected. """
+        user = User.find_by_identity('admin@local.host')
+        coins = user.coins
+
+        assert settle_bet(user.id, 7, coins + 1, 6.0) is None
+        assert User.query.get(user.id).coins == coins
+        assert Bet.query.filter(Bet.user_id == user.id).count() == 0
+
+    def test_settle_bets(self, session, users):
+        """ Settling a batch of bets applies the net of all of them. """
+        user = User.find_by_identity('admin@local.host')
+        coins = user.coins
+
+        payout_table = PayoutTable(settings.DICE_ROLL_PAYOUT)
+        bets, new_coins = settle_bets(user.id, [(7, 10), (2, 5), (12, 1)],
+                                      payout_table)
+
+        assert len(bets) == 3
+        assert new_coins == coins + sum(bet.net for bet in bets)
+        assert Bet.query.filter(Bet.user_id == user.id).count() == 3
+
+    def test_settle_bets_must_cover_every_wager(self, session, users):
+        """ A batch the user cannot fully cover is rejected. """
+        user = User.find_by_identity('admin@local.host')
+        coins = user.coins
+
+        payout_table = PayoutTable(settings.DICE_ROLL_PAYOUT)
+
+        assert settle_bets(user.id, [(7, coins), (7, 1)],
+                           payout_table) is None
+        assert User.query.get(user.id).coins == coins
+
+
+class TestBetStats(object):
+    def test_tally(self):
+        """ A batch is summarized into totals, streaks and histograms. """
+        is_winner = [True, True, False, True, True, True]
+        stats = BetStats.tally([7, 7, 2, 7, 12, 7], is_winner,
+                               [60, 60, -5, 60, 300, 60])
+
+        assert stats['stats_bets'] == 6
+        assert stats['stats_wins'] == 5
+        assert stats['stats_biggest_win'] == 300
+        assert stats['stats_streak'] == 3
+        assert stats['stats_unbroken'] is False
+        assert stats['stats_leading_wins'] == 2
+        assert stats['stats_longest_win_streak'] == 3
+        assert stats['stats_guess_counts'][7] == 4
+        assert stats['stats_guess_wins'][2] == 0
+        assert len(stats['stats_guess_counts']) == 13
+
+    def test_tally_losing_streak(self):
+        """ Losing streaks are negative. """
+        stats = BetStats.tally([2, 3], [False, False], [-1, -1])
+
+        assert stats['stats_streak'] == -2
+        assert stats['stats_unbroken'] is True
+        assert stats['stats_leading_wins'] == 0
+        assert stats['stats_longest_win_streak'] == 0
+        assert stats['stats_biggest_win'] == 0
+
+    def test_stats_follow_settled_bets(self, session, users):
+        """ Stats updated per bet match stats rebuilt from every bet. """
+        user = User.find_by_identity('admin@local.host')
+        user.coins = 100000
+        user.save()
+
+        payout_table = PayoutTable(settings.DICE_ROLL_PAYOUT)
+        for _ in range(5):
+            settle_bet(user.id, 7, 1, 6.0)
+        settle_bets(user.id, [(7, 1), (8, 2), (9, 3)] * 20, payout_table)
+        settle_bets(user.id, [(7, 1)] * 5, payout_table)
+
+        bets = Bet.query.filter(Bet.user_id == user.id).all()
+        stats = BetStats.query.get(user.id)
+        incremental = (stats.bets, stats.wagered, stats.net, stats.wins,
+                       stats.biggest_win, stats.current_streak,
+                       stats.longest_win_streak, list(stats.guess_counts),
+                       list(stats.guess_wins))
+
+        assert stats.bets == len(bets)
+        assert stats.net == sum(bet.net for bet in bets)
+
+        BetStats.rebuild()
+        session.expire_all()
+        stats = BetStats.query.get(user.id)
+        rebuilt = (stats.bets, stats.wagered, stats.net, stats.wins,
+                   stats.biggest_win, stats.current_streak,
+                   stats.longest_win_streak, list(stats.guess_counts),
+                   list(stats.guess_wins))
+
+        assert incremental == rebuilt
+
+
+class TestLeaderboard(object):
+    def setup_method(self, method):
+        keys = redis.keys('test:leaderboard*')
+        if keys:
+            redis.delete(*keys)
+
+    def test_window_start(self):
+        """ Weeks start on Monday at midnight. """
+        when = datetime.datetime(2016, 6, 16, 13, 30, tzinfo=pytz.utc)
+
+        daily = leaderboard.window_start('daily', when)
+        weekly = leaderboard.window_start('weekly', when)
+
+        assert daily == datetime.datetime(2016, 6, 16, tzinfo=pytz.utc)
+        assert weekly == datetime.datetime(2016, 6, 13, tzinfo=pytz.utc)
+
+    def test_record_bet_and_rank(self, session, users):
+        """ Settled bets are ranked by net winnings and coins. """
+        leaderboard.record_bet(1, 50, 150)
+        leaderboard.record_bet(2, -10, 90)
+        leaderboard.record_bet(1, 25, 175)
+
+        assert leaderboard.rank(1, 'net', 'daily') == (1, 75)
+        assert leaderboard.rank(2, 'net', 'weekly') == (2, -10)
+        assert leaderboard.rank(2, 'coins') == (2, 90)
+        assert leaderboard.rank(3) is None
+
+        standings = leaderboard.top('net', 'all', page=1, per_page=1)
+
+        assert standings.total == 2
+        assert standings.has_next
+        assert standings.items[0]['rank'] == 1
+        assert standings.items[0]['score'] == 75
+
+    def test_rebuild(self, session, users):
+        """ Rebuilding from Postgres matches the incremental updates. """
+        user = User.find_by_identity('admin@local.host')
+        user.coins = 1000
+        user.save()
+
+        payout_table = PayoutTable(settings.DICE_ROLL_PAYOUT)
+        _, coins = settle_bets(user.id, [(7, 1)] * 10, payout_table)
+        net = coins - 1000
+
+        redis.delete(leaderboard.key('net'), leaderboard.key('coins'))
+        leaderboard.rebuild(chunk_size=1)
+
+        assert leaderboard.rank(user.id, 'net')[1] == net
+        assert leaderboard.rank(user.id, 'net', 'daily')[1] == net
+        assert leaderboard.rank(user.id, 'coins')[1] == coins
+
+
+class TestKeysetPagination(object):
+    def test_cursor_round_trip(self):
+        """ Cursors decode back to what they were encoded from. """
+        created_on = datetime.datetime(2016, 5, 1, 12, 30, 15, 250,
+                                       tzinfo=pytz.utc)
+        cursor = encode_cursor(True, created_on, 42)
+
+        assert decode_cursor(cursor) == (True, created_on, 42)
+        assert decode_cursor('not a cursor') is None
+
+    def test_cursor_rejects_tampering(self):
+        """ Well formed cursors with the wrong kind of values are rejected. """
+        created_on = datetime.datetime(2016, 5, 1, tzinfo=pytz.utc)
+
+        assert decode_cursor(encode_cursor(True, 'foo', 42)) is None
+        assert decode_cursor(encode_cursor(True, created_on, 'x')) is None
+        assert decode_cursor(encode_cursor(
+            False, '2016-13-01T00:00:00+00:00', 42)) is None
+
+    def test_seek_forwards_and_backwards(self, session, users):
+        """ Seeking through pages visits every bet once, in order. """
+        user = User.find_by_identity('admin@local.host')
+        user.coins = 1000
+        user.save()
+
+        payout_table = PayoutTable(settings.DICE_ROLL_PAYOUT)
+        for i in range(3):
+            settle_bets(user.id, [(7, 1)] * 10, payout_table)
+
+        query = Bet.query.filter(Bet.user_id == user.id)
+        expected = query.order_by(Bet.created_on.desc(), Bet.id.desc()).all()
+
+        first = keyset_paginate(query, Bet.created_on, Bet.id, per_page=12)
+        second = keyset_paginate(query, Bet.created_on, Bet.id,
+                                 cursor=first.next_cursor, per_page=12)
+        third = keyset_paginate(query, Bet.created_on, Bet.id,
+                                cursor=second.next_cursor, per_page=12)
+        back = keyset_paginate(query, Bet.created_on, Bet.id,
+                               cursor=third.prev_cursor, per_page=12)
+
+        assert first.items + second.items + third.items == expected
+        assert not first.has_prev and first.has_next
+        assert third.has_prev and not third.has_next
+        assert back.items == second.items
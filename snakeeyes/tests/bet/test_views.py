@@ -1,8 +1,11 @@
 from time import sleep
 
 from flask import url_for, json
+from mock import patch
+from redis import RedisError
 
 from lib.tests import ViewTestMixin, assert_status_with_message
+from snakeeyes.blueprints.billing.gateways import breaker
 
 
 class TestBetting(ViewTestMixin):
@@ -21,6 +24,32 @@ class TestBetting(ViewTestMixin):
         assert_status_with_message(200, response,
                                    'Betting history')
 
+    def test_leaderboard(self):
+        """ Leaderboard should render successfully. """
+        self.login()
+        response = self.client.get(url_for('bet.leaderboard_standings',
+                                           board='net', window='daily'))
+
+        assert_status_with_message(200, response, 'Leaderboard')
+
+    def test_leaderboard_without_redis(self):
+        """ Leaderboard shows up as unavailable when Redis is down. """
+        self.login()
+
+        with patch('redis.client.BasePipeline.execute',
+                   side_effect=RedisError('Redis is down.')):
+            response = self.client.get(url_for('bet.leaderboard_standings'))
+
+        assert_status_with_message(200, response, 'unavailable right now')
+
+    def test_betting_history_bad_cursor(self):
+        """ Betting history ignores a cursor that was tampered with. """
+        self.login()
+        response = self.client.get(url_for('bet.history', cursor='nope'))
+
+        assert_status_with_message(200, response,
+                                   'Betting history')
+
     def test_bet_create(self):
         """ Bet create works. """
         self.login()
@@ -47,6 +76,20 @@ class TestBetting(ViewTestMixin):
         assert 'net' in data
         assert 'is_winner' in data
 
+    def test_bet_create_while_payment_gateway_is_down(self):
+        """ Betting never waits on the payment gateway. """
+        self.login()
+        breaker.trip()
+
+        try:
+            response = self.client.post(url_for('bet.place_bet'),
+                                        data={'guess': 5, 'wagered': 10},
+                                        follow_redirects=True)
+        finally:
+            breaker.reset()
+
+        assert 'roll' in json.loads(response.data)['data']
+
     def test_bet_create_fails_due_to_not_enough_coins(self):
         """ Bet create fails due to not enough coins. """
         self.login()
@@ -87,3 +130,69 @@ class TestBetting(ViewTestMixin):
         data = json.loads(response.data)
 
         assert 'You need to wager at least 1 coin.' in data['error']
+
+    def test_bet_batch_create(self):
+        """ Batch bet create works. """
+        sleep(1)
+
+        self.login()
+
+        params = {'bets': [[5, 1], [7, 2], [12, 1]]}
+        response = self.client.post(url_for('bet.place_batch'),
+                                    data=json.dumps(params),
+                                    content_type='application/json')
+
+        data = json.loads(response.data)
+
+        assert response.status_code == 200
+        assert len(data['data']) == 3
+        assert 'is_winner' in data['data'][0]
+        assert 'coins' in data
+
+    def test_bet_batch_create_fails_due_to_invalid_bet(self):
+        """ Batch bet create fails due to an invalid guess. """
+        sleep(1)
+
+        self.login()
+
+        params = {'bets': [[5, 1], [13, 1]]}
+        response = self.client.post(url_for('bet.place_batch'),
+                                    data=json.dumps(params),
+                                    content_type='application/json')
+
+        data = json.loads(response.data)
+
+        assert response.status_code == 400
+        assert 'Each bet needs a guess' in data['error']
+
+    def test_bet_batch_create_fails_due_to_non_object_body(self):
+        """ Batch bet create fails when the JSON body is not an object. """
+        sleep(1)
+
+        self.login()
+
+        response = self.client.post(url_for('bet.place_batch'),
+                                    data=json.dumps([[5, 1]]),
+                                    content_type='application/json')
+
+        data = json.loads(response.data)
+
+        assert response.status_code == 406
+        assert 'Expected a JSON list of bets' in data['error']
+
+    def test_bet_batch_create_fails_due_to_coerced_bets(self):
+        """ Batch bet create only accepts bets made of JSON integers. """
+        self.login()
+
+        for bets in (['57'], [[7.9, 10.5]], [[True, True]], [[7, '10']],
+                     [[7, 10, 1]], [[7, 10 ** 20]]):
+            sleep(1)
+
+            response = self.client.post(url_for('bet.place_batch'),
+                                        data=json.dumps({'bets': bets}),
+                                        content_type='application/json')
+
+            data = json.loads(response.data)
+
+            assert response.status_code == 400
+            assert 'Each bet needs a guess' in data['error']
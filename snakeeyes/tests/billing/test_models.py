@@ -1,12 +1,26 @@
 import datetime
+import time
+from multiprocessing.pool import ThreadPool
 
+import pytest
 import pytz
+import stripe
 
+from lib.fakes import FakeStripe
 from lib.money import cents_to_dollars, dollars_to_cents
+from snakeeyes.extensions import redis
 from snakeeyes.blueprints.user.models import User
 from snakeeyes.blueprints.billing.models.credit_card import CreditCard
 from snakeeyes.blueprints.billing.models.coupon import Coupon
 from snakeeyes.blueprints.billing.models.invoice import Invoice
+from snakeeyes.blueprints.billing.models.webhook_event import WebhookEvent
+from snakeeyes.blueprints.billing.gateways import breaker, transport
+from snakeeyes.blueprints.billing.gateways import cache as gateway_cache
+from snakeeyes.blueprints.billing.gateways.transport import GatewayClient
+from snakeeyes.blueprints.billing.gateways.stripecom import (
+    Coupon as PaymentCoupon,
+    Event as PaymentEvent
+)
 
 
 class TestMoney(object):
@@ -116,6 +130,31 @@ class TestCoupon(object):
         coupon = Coupon.query.filter(Coupon.redeem_by.is_(None))
         assert coupon.first().valid is True
 
+    def test_bulk_delete(self, session, coupons, mock_stripe):
+        """ Coupons deleted on Stripe get deleted, the rest are returned. """
+        deleted, failed, missing = Coupon.query.order_by(Coupon.id).all()
+        ids = [deleted.id, failed.id, missing.id]
+
+        def delete(code):
+            if code == failed.code:
+                raise stripe.error.APIConnectionError('Stripe is down.')
+            elif code == missing.code:
+                raise stripe.error.InvalidRequestError('No such coupon.',
+                                                       'id', http_status=404)
+
+            return {'deleted': True}
+
+        PaymentCoupon.delete.side_effect = delete
+
+        try:
+            delete_count, failed_ids = Coupon.bulk_delete(ids)
+        finally:
+            PaymentCoupon.delete.side_effect = None
+
+        assert delete_count == 2
+        assert failed_ids == [ids[1]]
+        assert Coupon.query.count() == 1
+
 
 class TestInvoice(object):
     def test_parse_payload_from_event(self):
@@ -238,3 +277,343 @@ class TestInvoice(object):
                        coupon=None, token='cus_000')
 
         assert user.coins == 1100
+
+
+class TestWebhookEvent(object):
+    def test_record_event_once(self, webhook_events):
+        """ An event is only recorded the first time it is delivered. """
+        assert WebhookEvent.record('evt_000') is True
+        assert WebhookEvent.record('evt_000') is False
+        assert WebhookEvent.query.count() == 1
+
+    def test_process_pending(self, users, webhook_events, mock_stripe):
+        """ Processed events save their invoice, failures are recorded. """
+        WebhookEvent.record('evt_000')
+        WebhookEvent.record('evt_fake')
+
+        payload = {
+            'data': {
+                'object': {
+                    'lines': {
+                        'data': [
+                            {
+                                'period': {
+                                    'start': 1433162255,
+                                    'end': 1434371855
+                                },
+                                'plan': {
+                                    'name': 'Gold',
+                                    'statement_descriptor': 'GOLD MONTHLY'
+                                }
+                            }
+                        ]
+                    },
+                    'total': 0,
+                    'customer': 'cus_nobody',
+                    'currency': 'usd',
+                    'tax_percent': None,
+                    'tax': None,
+                    'receipt_number': '0009000'
+                }
+            }
+        }
+
+        def retrieve(event_id):
+            if event_id == 'evt_fake':
+                raise stripe.error.InvalidRequestError('No such event.', 'id',
+                                                       http_status=404)
+
+            return payload
+
+        PaymentEvent.retrieve.side_effect = retrieve
+
+        try:
+            outcome = WebhookEvent.process_pending()
+        finally:
+            PaymentEvent.retrieve.side_effect = None
+
+        processed = WebhookEvent.query.filter(
+            WebhookEvent.event_id == 'evt_000').first()
+        failed = WebhookEvent.query.filter(
+            WebhookEvent.event_id == 'evt_fake').first()
+
+        assert outcome == {'processed': 1, 'failed': 1}
+        assert processed.status == 'processed'
+        assert processed.attempts == 1
+        assert failed.status == 'failed'
+        assert 'No such event' in failed.error
+
+        assert WebhookEvent.process_pending() == {'processed': 0, 'failed': 0}
+
+    def test_replay(self, webhook_events):
+        """ Failed events can be queued up again. """
+        WebhookEvent.record('evt_000')
+        event = WebhookEvent.query.first()
+        event.status = 'failed'
+        event.save()
+
+        assert WebhookEvent.replay() == 1
+        assert WebhookEvent.query.first().status == 'pending'
+
+
+class TestGatewayCache(object):
+    @pytest.yield_fixture(autouse=True)
+    def enable_cache(self, app):
+        app.config['GATEWAY_CACHE_TTL'] = 60
+        customer_id = 'cus_cache'
+        lock_key = '{0}:refreshing'.format(
+            gateway_cache.key('upcoming_invoice', customer_id))
+        redis.delete(lock_key)
+        gateway_cache.invalidate(customer_id)
+
+        yield customer_id
+
+        redis.delete(lock_key)
+        gateway_cache.invalidate(customer_id)
+        app.config['GATEWAY_CACHE_TTL'] = 0
+        app.config['GATEWAY_CACHE_FRESH_FOR'] = 300
+
+    def test_fetch_caches_response(self, enable_cache):
+        """ The gateway is only called when nothing is cached. """
+        calls = []
+
+        def upcoming(customer_id):
+            calls.append(customer_id)
+            return {'amount_due': 500}
+
+        for _ in range(2):
+            response = gateway_cache.fetch('upcoming_invoice', enable_cache,
+                                           upcoming)
+            assert response == {'amount_due': 500}
+
+        assert calls == [enable_cache]
+
+        gateway_cache.invalidate(enable_cache)
+        gateway_cache.fetch('upcoming_invoice', enable_cache, upcoming)
+
+        assert len(calls) == 2
+
+    def test_fetch_refreshes_stale_response(self, app, enable_cache):
+        """ Stale responses are returned while 1 refresh gets queued up. """
+        app.config['GATEWAY_CACHE_FRESH_FOR'] = 0
+        refreshes = []
+
+        gateway_cache.store('upcoming_invoice', enable_cache,
+                            {'amount_due': 500})
+
+        for _ in range(2):
+            response = gateway_cache.fetch('upcoming_invoice', enable_cache,
+                                           None, refresh=refreshes.append)
+            assert response == {'amount_due': 500}
+
+        assert refreshes == [enable_cache]
+
+
+class TestGatewayClient(object):
+    @pytest.yield_fixture(autouse=True)
+    def fake_stripe(self):
+        original = stripe.default_http_client
+        stripe.default_http_client = GatewayClient(timeouts={'default': 1},
+                                                   retries=2, backoff=0)
+        transport.reset_latency_stats()
+
+        with FakeStripe() as fake:
+            yield fake
+
+        transport.reset_latency_stats()
+        stripe.default_http_client = original
+
+    def test_operation_name(self):
+        """ Operations are named after their resources, not their ids. """
+        url = 'https://api.stripe.com/v1/customers/cus_1/subscriptions/sub_1'
+
+        assert transport.operation_name('DELETE', url) == \
+            'customers.subscriptions.delete'
+        assert transport.operation_name(
+            'get', 'https://api.stripe.com/v1/invoices/upcoming?customer=c') \
+            == 'invoices.get'
+
+    def test_reuses_connections_under_load(self, fake_stripe):
+        """ Concurrent calls share a pool of keep-alive connections. """
+        fake_stripe.latency = 0.01
+        pool = ThreadPool(4)
+
+        try:
+            pool.map(stripe.Event.retrieve, ['evt_{0}'.format(i)
+                                             for i in range(100)])
+        finally:
+            pool.close()
+            pool.join()
+
+        assert len(fake_stripe.requests) == 100
+        assert fake_stripe.connections <= 4
+
+    def test_retries_idempotent_requests(self, fake_stripe):
+        """ Failed GET requests are sent again. """
+        fake_stripe.fail(503, 503)
+
+        stripe.Event.retrieve('evt_000')
+
+        assert len(fake_stripe.requests) == 3
+
+    def test_does_not_retry_requests_without_idempotency_key(self,
+                                                            fake_stripe):
+        """ A failed POST may have gone through, so it is not sent again. """
+        fake_stripe.fail(500)
+
+        with pytest.raises(stripe.error.APIError):
+            stripe.Customer.create(email='foo@bar.com')
+
+        assert len(fake_stripe.requests) == 1
+
+    def test_retries_requests_with_idempotency_key(self, fake_stripe):
+        """ A failed POST is sent again with the same idempotency key. """
+        fake_stripe.fail(503)
+
+        stripe.Charge.create(amount=500, currency='usd',
+                             idempotency_key='charge-tok_000')
+
+        assert fake_stripe.requests == [('POST', '/v1/charges',
+                                         'charge-tok_000')] * 2
+
+    def test_times_out(self, fake_stripe):
+        """ A slow Stripe gives up after the operation's timeout. """
+        stripe.default_http_client.retries = 0
+        stripe.default_http_client.timeouts = {'events.get': 0.1}
+        fake_stripe.latency = 0.5
+
+        start = time.time()
+        with pytest.raises(stripe.error.APIConnectionError):
+            stripe.Event.retrieve('evt_000')
+
+        assert time.time() - start < 0.5
+
+    def test_records_latency(self, fake_stripe):
+        """ Every request counts towards its operation's metrics. """
+        fake_stripe.fail(503)
+
+        for _ in range(3):
+            stripe.Event.retrieve('evt_000')
+
+        stats = transport.latency_stats()['events.get']
+
+        assert stats['count'] == 4
+        assert stats['errors'] == 1
+        assert stats['p50_ms'] <= transport.LATENCY_BUCKETS[-1]
+
+
+class TestCircuitBreaker(object):
+    @pytest.yield_fixture(autouse=True)
+    def fake_stripe(self, app):
+        original = stripe.default_http_client
+        stripe.default_http_client = GatewayClient(timeouts={'default': 1},
+                                                   retries=0, backoff=0)
+        app.config['PAYMENT_GATEWAY_BREAKER_ERROR_RATE'] = 0.5
+        app.config['PAYMENT_GATEWAY_BREAKER_MIN_CALLS'] = 4
+        app.config['PAYMENT_GATEWAY_SLOW_CALL'] = 0.2
+        breaker.reset()
+
+        with FakeStripe() as fake:
+            yield fake
+
+        breaker.reset()
+        app.config['PAYMENT_GATEWAY_BREAKER_ERROR_RATE'] = 0
+        app.config['PAYMENT_GATEWAY_BREAKER_MIN_CALLS'] = 10
+        app.config['PAYMENT_GATEWAY_SLOW_CALL'] = 5
+        stripe.default_http_client = original
+
+    def outage(self, fake_stripe, calls=4):
+        fake_stripe.down = 503
+
+        for _ in range(calls):
+            with pytest.raises(stripe.error.APIError):
+                stripe.Event.retrieve('evt_000')
+
+        fake_stripe.down = None
+
+    def test_opens_after_failures(self, fake_stripe):
+        """ Once enough calls failed the rest fail without being sent. """
+        self.outage(fake_stripe)
+
+        assert breaker.state() == 'open'
+
+        with pytest.raises(breaker.CircuitOpen):
+            stripe.Event.retrieve('evt_000')
+
+        assert len(fake_stripe.requests) == 4
+
+    def test_opens_after_slow_calls(self, fake_stripe):
+        """ Calls that go through slowly count as failed. """
+        fake_stripe.latency = 0.25
+
+        for _ in range(4):
+            stripe.Event.retrieve('evt_000')
+
+        assert breaker.state() == 'open'
+
+    def test_fails_fast_while_open(self, fake_stripe):
+        """ A slow gateway is not waited on while the breaker is open. """
+        breaker.trip()
+        fake_stripe.latency = 0.5
+
+        start = time.time()
+        with pytest.raises(breaker.CircuitOpen):
+            stripe.Event.retrieve('evt_000')
+
+        assert time.time() - start < 0.1
+        assert fake_stripe.requests == []
+
+    def test_closes_after_trial_call(self, fake_stripe):
+        """ A trial call that succeeds after the cooldown closes it. """
+        self.outage(fake_stripe)
+        redis.delete(breaker._key('open'))
+
+        assert breaker.state() == 'half_open'
+
+        stripe.Event.retrieve('evt_000')
+
+        assert breaker.state() == 'closed'
+
+    def test_reopens_after_failed_trial_call(self, fake_stripe):
+        """ A trial call that fails after the cooldown opens it again. """
+        self.outage(fake_stripe)
+        redis.delete(breaker._key('open'))
+
+        self.outage(fake_stripe, calls=1)
+
+        assert breaker.state() == 'open'
+
+    def test_trial_claim_outlives_slowest_call(self, app, fake_stripe):
+        """ Only 1 trial call can be waiting on the slowest operation. """
+        breaker.trip()
+        redis.delete(breaker._key('open'))
+
+        assert breaker._claim_trial() is True
+        assert breaker._claim_trial() is False
+
+        slowest = app.config['PAYMENT_GATEWAY_CONNECT_TIMEOUT'] + \
+            max(app.config['PAYMENT_GATEWAY_TIMEOUTS'].values())
+
+        assert redis.ttl(breaker._key('trial')) >= int(slowest)
+
+    def test_webhook_events_wait_while_open(self, webhook_events,
+                                            mock_stripe):
+        """ Events stay pending while the gateway is unavailable. """
+        WebhookEvent.record('evt_breaker')
+        breaker.trip()
+
+        assert WebhookEvent.process_pending() == {'processed': 0, 'failed': 0}
+
+        breaker.reset()
+        PaymentEvent.retrieve.side_effect = breaker.CircuitOpen('Down.')
+
+        try:
+            outcome = WebhookEvent.process_pending()
+        finally:
+            PaymentEvent.retrieve.side_effect = None
+
+        event = WebhookEvent.query \
+            .filter(WebhookEvent.event_id == 'evt_breaker').first()
+
+        assert outcome == {'processed': 0, 'failed': 0}
+        assert event.status == 'pending'
@@ -1,6 +1,10 @@
 from flask import url_for, json
 
 from lib.tests import ViewTestMixin, assert_status_with_message
+from snakeeyes.blueprints.billing.models.webhook_event import WebhookEvent
+from snakeeyes.blueprints.billing.gateways import breaker
+from snakeeyes.blueprints.billing.gateways.stripecom import \
+    Invoice as PaymentInvoice
 
 
 class TestBilling(ViewTestMixin):
@@ -184,6 +188,34 @@ class TestBilling(ViewTestMixin):
         assert_status_with_message(200, response,
                                    'Billing details and history')
 
+    def test_subscription_billing_details_while_gateway_is_down(
+            self, subscriptions, mock_stripe):
+        """ Billing history still renders without the upcoming invoice. """
+        self.login(identity='subscriber@local.host')
+        PaymentInvoice.upcoming.side_effect = breaker.CircuitOpen('Down.')
+
+        try:
+            response = self.client.get(url_for('billing.billing_details'))
+        finally:
+            PaymentInvoice.upcoming.side_effect = None
+
+        assert_status_with_message(200, response,
+                                   'Upcoming payment unavailable')
+
+    def test_purchase_coins_while_gateway_is_down(self, users):
+        """ Payment pages fail fast while the gateway breaker is open. """
+        self.login()
+        breaker.trip()
+
+        try:
+            response = self.client.get(url_for('billing.purchase_coins'),
+                                       follow_redirects=True)
+        finally:
+            breaker.reset()
+
+        assert_status_with_message(200, response,
+                                   'experiencing connectivity issues')
+
     def test_purchase_coins(self, users, mock_stripe):
         """ Purchase coins requires JavaScript. """
         self.login()
@@ -200,3 +232,40 @@ class TestBilling(ViewTestMixin):
         assert_status_with_message(200, response,
                                    'You must enable JavaScript'
                                    ' for this request.')
+
+
+class TestStripeWebhook(ViewTestMixin):
+    def test_event_requires_json(self):
+        """ Events must be sent as JSON. """
+        response = self.client.post(url_for('stripe_webhook.event'),
+                                    data={'id': 'evt_000'})
+
+        assert response.status_code == 406
+
+    def test_event_requires_string_id(self, webhook_events):
+        """ Events without a string id are rejected. """
+        for event_id in (12345, ['evt_000'], {'id': 'evt_000'}):
+            response = self.client.post(url_for('stripe_webhook.event'),
+                                        data=json.dumps({'id': event_id}),
+                                        content_type='application/json')
+
+            assert response.status_code == 406
+
+        assert WebhookEvent.query.count() == 0
+
+    def test_event_is_queued_once(self, webhook_events):
+        """ Events are recorded once, duplicate deliveries are ignored. """
+        for duplicate in (False, True):
+            response = self.client.post(url_for('stripe_webhook.event'),
+                                        data=json.dumps({'id': 'evt_000'}),
+                                        content_type='application/json')
+
+            assert response.status_code == 200
+            assert json.loads(response.data.decode('utf-8')).get(
+                'duplicate', False) is duplicate
+
+        events = WebhookEvent.query.all()
+
+        assert len(events) == 1
+        assert events[0].event_id == 'evt_000'
+        assert events[0].status == 'pending'
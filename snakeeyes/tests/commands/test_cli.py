@@ -0,0 +1,95 @@
+import json
+import os
+import subprocess
+import sys
+
+from click.testing import CliRunner
+from mock import patch
+
+from cli.cli import cli
+
+# Runs the CLI in a fresh interpreter and reports which of the modules that
+# are slow to import got imported along the way.
+IMPORTS_SCRIPT = """
+import json
+import sys
+
+from click.testing import CliRunner
+
+from cli.cli import cli
+
+result = CliRunner().invoke(cli, sys.argv[1:])
+heavy = ['numpy', 'pytest', 'snakeeyes.app', 'sqlalchemy', 'stripe']
+print(json.dumps({'exit_code': result.exit_code,
+                  'imported': [name for name in heavy
+                               if name in sys.modules]}))
+"""
+
+
+def invoke(*args):
+    """
+    Run the CLI and fail if it creates the app.
+
+    :return: Click result
+    """
+    runner = CliRunner()
+
+    with patch('snakeeyes.app.create_app',
+               side_effect=AssertionError('The app got created.')):
+        return runner.invoke(cli, args)
+
+
+def imported_modules(*args):
+    """
+    Run the CLI in a fresh interpreter, the test run already imported
+    everything there is.
+
+    :return: Dict of the exit code and the heavy modules that got imported
+    """
+    root = os.path.dirname(os.path.dirname(sys.modules['cli'].__file__))
+    output = subprocess.check_output(
+        [sys.executable, '-c', IMPORTS_SCRIPT] + list(args), cwd=root)
+
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+class TestCLI(object):
+    def test_help(self):
+        """ Listing commands neither imports them nor creates the app. """
+        result = invoke('--help')
+
+        assert result.exit_code == 0
+        assert 'Run performance benchmarks.' in result.output
+        assert 'Generate a random secret token.' in result.output
+
+    def test_command_without_app(self):
+        """ A command that does not need the app never creates it. """
+        result = invoke('secret', '16')
+
+        assert result.exit_code == 0
+        assert len(result.output.strip()) == 32
+
+    def test_help_stays_light(self):
+        """ Listing commands does not import any heavy modules. """
+        result = imported_modules('--help')
+
+        assert result == {'exit_code': 0, 'imported': []}
+
+    def test_command_without_app_stays_light(self):
+        """ A command that does not need the app imports no heavy modules. """
+        result = imported_modules('secret', '16')
+
+        assert result == {'exit_code': 0, 'imported': []}
+
+    def test_subcommand_help(self):
+        """ The help of a command that needs the app does not create it. """
+        result = invoke('bench', 'settle', '--help')
+
+        assert result.exit_code == 0
+        assert '--bets' in result.output
+
+    def test_unknown_command(self):
+        """ An unknown command is a usage error. """
+        result = invoke('nope')
+
+        assert result.exit_code == 2
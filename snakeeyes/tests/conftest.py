@@ -1,5 +1,7 @@
 import datetime
 import json
+import os
+import tempfile
 
 import pytest
 import pytz
@@ -13,6 +15,7 @@ from snakeeyes.blueprints.user.models import User
 from snakeeyes.blueprints.billing.models.credit_card import CreditCard
 from snakeeyes.blueprints.billing.models.coupon import Coupon
 from snakeeyes.blueprints.billing.models.subscription import Subscription
+from snakeeyes.blueprints.billing.models.webhook_event import WebhookEvent
 from snakeeyes.blueprints.billing.gateways.stripecom import (
     Coupon as PaymentCoupon,
     Event as PaymentEvent,
@@ -36,7 +39,21 @@ def app():
         'DEBUG': False,
         'TESTING': True,
         'WTF_CSRF_ENABLED': False,
-        'SQLALCHEMY_DATABASE_URI': db_uri
+        'SQLALCHEMY_DATABASE_URI': db_uri,
+        'LEADERBOARD_KEY_PREFIX': 'test:leaderboard',
+        'USER_CACHE_TTL': 0,
+        'PASSWORD_HASH_WORKERS': 0,
+        'PASSWORD_HASH_SLOTS_KEY': 'test:password_hashing',
+        'PAYMENT_GATEWAY_BACKOFF': 0,
+        'PAYMENT_GATEWAY_BREAKER_ERROR_RATE': 0,
+        'PAYMENT_GATEWAY_BREAKER_KEY_PREFIX': 'test:gateway:breaker',
+        'PAYMENT_GATEWAY_LATENCY_KEY_PREFIX': 'test:gateway:latency',
+        'GATEWAY_CACHE_TTL': 0,
+        'MAIL_QUEUE_KEY': 'test:mail',
+        'MAIL_RETRY_DELAY': 0,
+        'ERROR_DIGEST_KEY': 'test:errors',
+        'EXPORT_FOLDER': os.path.join(tempfile.gettempdir(),
+                                      'snakeeyes-test-exports')
     }
 
     _app = create_app(settings_override=params)
@@ -276,6 +293,20 @@ def subscriptions(db):
     return db
 
 
+@pytest.fixture(scope='function')
+def webhook_events(db):
+    """
+    Forget every delivered webhook event.
+
+    :param db: Pytest fixture
+    :return: SQLAlchemy database session
+    """
+    db.session.query(WebhookEvent).delete()
+    db.session.commit()
+
+    return db
+
+
 @pytest.fixture(scope='session')
 def mock_stripe():
     """
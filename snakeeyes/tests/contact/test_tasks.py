@@ -1,5 +1,6 @@
 from snakeeyes.extensions import mail
 from snakeeyes.blueprints.contact.tasks import deliver_contact_email
+from snakeeyes.blueprints.user.tasks import deliver_queued_mail
 
 
 class TestTasks(object):
@@ -12,6 +13,7 @@ class TestTasks(object):
 
         with mail.record_messages() as outbox:
             deliver_contact_email(form.get('email'), form.get('message'))
+            deliver_queued_mail()
 
             assert len(outbox) == 1
             assert form.get('email') in outbox[0].body
@@ -1,5 +1,20 @@
+import json
+import time
+
+import pytest
+import stripe
+from sqlalchemy import event
+
+from lib.util_sqlalchemy import estimate_count, estimated_paginate
+from snakeeyes.extensions import redis
+from snakeeyes.blueprints.user import auth_tokens
+from snakeeyes.blueprints.user import cache as user_cache
+from snakeeyes.blueprints.user import passwords
 from snakeeyes.blueprints.user.models import User
 from snakeeyes.blueprints.billing.models.subscription import Subscription
+from snakeeyes.blueprints.billing.gateways.stripecom import (
+    Subscription as PaymentSubscription
+)
 
 
 class TestUser(object):
@@ -23,3 +38,238 @@ class TestUser(object):
         user.add_coins(Subscription.get_plan_by_id('bronze'))
 
         assert user.coins == 210
+
+
+class TestUserBulkDelete(object):
+    def test_bulk_delete(self, app, users, subscriptions, mock_stripe):
+        """ Users are deleted in chunks, cancelling subscriptions first. """
+        app.config['USER_DELETE_CHUNK_SIZE'] = 1
+        ids = [user.id for user in User.query.filter(User.role == 'member')]
+        subscriber_id = User.find_by_identity('subscriber@local.host').id
+        ids.append(subscriber_id)
+
+        reported = []
+
+        def progress(done, total):
+            reported.append((done, total))
+
+        try:
+            deleted = User.bulk_delete(ids + [999999], progress=progress)
+        finally:
+            app.config['USER_DELETE_CHUNK_SIZE'] = 500
+
+        assert deleted == 2
+        assert reported == [(1, 3), (2, 3), (3, 3)]
+        assert User.query.filter(User.id.in_(ids)).count() == 0
+        assert Subscription.query.filter(
+            Subscription.user_id == subscriber_id).count() == 0
+
+    def test_bulk_delete_keeps_users_that_could_not_cancel(self, users,
+                                                           subscriptions,
+                                                           mock_stripe):
+        """ A user is kept if their subscription could not be cancelled. """
+        subscriber = User.find_by_identity('subscriber@local.host')
+        member = User.find_by_identity('disabled@local.host')
+
+        PaymentSubscription.cancel.side_effect = \
+            stripe.error.APIConnectionError('Stripe is down.')
+
+        try:
+            deleted = User.bulk_delete([subscriber.id, member.id])
+        finally:
+            PaymentSubscription.cancel.side_effect = None
+
+        assert deleted == 1
+        assert User.find_by_identity('subscriber@local.host') is not None
+        assert User.find_by_identity('disabled@local.host') is None
+
+
+class TestUserSearch(object):
+    def _search(self, query):
+        return [user.email for user in
+                User.query.filter(User.search(query)).order_by(User.email)]
+
+    def test_search_anywhere(self, users):
+        """ Long enough queries match anywhere inside of a field. """
+        assert self._search('local.host') == ['admin@local.host',
+                                              'disabled@local.host']
+        assert self._search('ADMIN@') == ['admin@local.host']
+
+    def test_search_short_query_matches_prefix(self, users):
+        """ Queries too short for trigrams only match the start of a field. """
+        assert self._search('di') == ['disabled@local.host']
+        assert self._search('lo') == []
+
+    def test_search_escapes_wildcards(self, users):
+        """ LIKE wildcards in a query are matched literally. """
+        assert self._search('%') == []
+        assert self._search('_dmin') == []
+
+    def test_estimate_count(self, users):
+        """ Small results are counted exactly instead of estimated. """
+        assert estimate_count(User.query) == 2
+
+    def test_estimated_paginate(self, users):
+        """ Pages know if there is a next page without counting. """
+        first = estimated_paginate(User.query.order_by(User.email), 1, 1)
+        last = estimated_paginate(User.query.order_by(User.email), 2, 1)
+
+        assert [user.email for user in first.items] == ['admin@local.host']
+        assert first.has_next
+        assert [user.email for user in last.items] == ['disabled@local.host']
+        assert not last.has_next
+
+
+class TestPasswords(object):
+    def test_hash_and_check_password(self):
+        """ A hashed password checks out with the right plain text only. """
+        password = passwords.hash_password('hunter2')
+
+        assert passwords.check_password(password, 'hunter2')
+        assert not passwords.check_password(password, 'hunter3')
+
+    def test_needs_rehash(self):
+        """ Only hashes made with an outdated method need a rehash. """
+        assert not passwords.needs_rehash(passwords.hash_password('hunter2'))
+        assert passwords.needs_rehash('pbkdf2:sha1:500$salt$hash')
+        assert passwords.needs_rehash(None)
+
+    def test_hash_password_when_busy(self, app):
+        """ Hashing is turned away once too many passwords are waiting. """
+        app.config['PASSWORD_HASH_WORKERS'] = 1
+        app.config['PASSWORD_HASH_MAX_PENDING'] = 0
+
+        try:
+            with pytest.raises(passwords.PasswordHashingBusy):
+                passwords.hash_password('hunter2')
+        finally:
+            passwords.hasher.reset()
+            app.config['PASSWORD_HASH_WORKERS'] = 0
+            app.config['PASSWORD_HASH_MAX_PENDING'] = 8
+
+    def test_hash_password_when_other_workers_are_busy(self, app):
+        """ The limit is shared by every app worker through Redis. """
+        app.config['PASSWORD_HASH_WORKERS'] = 1
+        app.config['PASSWORD_HASH_MAX_PENDING'] = 2
+        slots_key = app.config['PASSWORD_HASH_SLOTS_KEY']
+        redis.zadd(slots_key, time.time(), 'worker-1')
+        redis.zadd(slots_key, time.time(), 'worker-2')
+
+        try:
+            with pytest.raises(passwords.PasswordHashingBusy):
+                passwords.hash_password('hunter2')
+
+            redis.zrem(slots_key, 'worker-2')
+            assert passwords.hash_password('hunter2')
+        finally:
+            redis.delete(slots_key)
+            passwords.hasher.reset()
+            app.config['PASSWORD_HASH_WORKERS'] = 0
+            app.config['PASSWORD_HASH_MAX_PENDING'] = 8
+
+
+class TestAuthTokens(object):
+    def test_load_auth_token(self, users):
+        """ Remember me tokens load their user, also once cached. """
+        user = User.find_by_identity('admin@local.host')
+        token = user.get_auth_token()
+
+        assert auth_tokens.load(token, User.query.get).id == user.id
+        assert redis.get(auth_tokens.key(token)) is not None
+        assert auth_tokens.load(token, User.query.get).id == user.id
+
+    def test_load_auth_token_tampered(self, users):
+        """ Tampered remember me tokens are rejected. """
+        user = User.find_by_identity('admin@local.host')
+        token = '{0}1337'.format(user.get_auth_token())
+
+        assert auth_tokens.load(token, User.query.get) is None
+
+    def test_password_change_revokes_auth_token(self, users):
+        """ Changing the password revokes remember me tokens. """
+        user = User.find_by_identity('admin@local.host')
+        token = user.get_auth_token()
+        auth_tokens.load(token, User.query.get)
+
+        user.password = User.encrypt_password('newpassword')
+        user.save()
+
+        assert redis.get(auth_tokens.key(token)) is None
+        assert auth_tokens.load(token, User.query.get) is None
+
+
+class TestUserCache(object):
+    @pytest.yield_fixture(autouse=True)
+    def enable_cache(self, app, users):
+        app.config['USER_CACHE_TTL'] = 60
+        user = User.find_by_identity('admin@local.host')
+        user_cache.invalidate(user.id)
+
+        yield user
+
+        user_cache.invalidate(user.id)
+        app.config['USER_CACHE_TTL'] = 0
+
+    def test_get_caches_user(self, db, enable_cache):
+        """ A cached user loads without touching the database. """
+        user_id = enable_cache.id
+        user_cache.get(user_id)
+        db.session.remove()
+
+        statements = []
+
+        def count_statement(*args):
+            statements.append(args[2])
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            user = user_cache.get(user_id)
+            subscription = user.subscription
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+        assert user.email == 'admin@local.host'
+        assert subscription is None
+        assert statements == []
+
+    def test_cached_user_can_be_saved(self, db, enable_cache):
+        """ Saving a cached user persists it and invalidates the cache. """
+        user_id = enable_cache.id
+        user_cache.get(user_id)
+        db.session.remove()
+
+        user = user_cache.get(user_id)
+        user.locale = 'es'
+        user.save()
+
+        assert redis.get(user_cache.key(user_id)) is None
+        db.session.remove()
+
+        assert User.query.get(user_id).locale == 'es'
+
+    def test_cache_leaves_out_password(self, db, enable_cache):
+        """ The password hash never ends up in Redis. """
+        user_id = enable_cache.id
+        user_cache.get(user_id)
+
+        data = redis.get(user_cache.key(user_id))
+        snapshot = json.loads(data.decode('utf-8'))
+
+        assert snapshot['user']['email'] == 'admin@local.host'
+        assert 'password' not in snapshot['user']
+
+        db.session.remove()
+        user = user_cache.get(user_id)
+
+        assert user.authenticated(password='password')
+
+    def test_stale_populate_is_dropped(self, db, enable_cache):
+        """ A snapshot read before an invalidation never gets cached. """
+        user_id = enable_cache.id
+        version = redis.get(user_cache.version_key(user_id))
+
+        user_cache.invalidate(user_id)
+        user_cache._populate(user_id, version, 60,
+                             user_cache.dump(enable_cache))
+
+        assert redis.get(user_cache.key(user_id)) is None
@@ -1,5 +1,12 @@
-from snakeeyes.extensions import mail
-from snakeeyes.blueprints.user.tasks import deliver_password_reset_email
+import json
+
+from lib.fakes import FakeSMTP
+from lib.flask_mailplus import deliver_queued_messages, queue_template_message
+from snakeeyes.extensions import mail, redis
+from snakeeyes.blueprints.user.tasks import (
+    deliver_password_reset_email,
+    deliver_queued_mail
+)
 from snakeeyes.blueprints.user.models import User
 
 
@@ -9,6 +16,78 @@ class TestTasks(object):
         with mail.record_messages() as outbox:
             user = User.find_by_identity('admin@local.host')
             deliver_password_reset_email(user.id, token)
+            deliver_queued_mail()
 
             assert len(outbox) == 1
             assert token in outbox[0].body
+
+
+class TestMailQueue(object):
+    def teardown_method(self, method):
+        redis.delete('test:mail', 'test:mail:retry', 'test:mail:scheduled',
+                     'test:mail:processing', 'test:mail:processing:stale')
+
+    def test_batch_uses_one_connection(self):
+        """ Queued e-mails are sent in batches over one connection each. """
+        with FakeSMTP() as fake:
+            for i in range(25):
+                queue_template_message(subject='Hi', body='Hello',
+                                       recipients=['{0}@local.host'.format(i)])
+
+            assert deliver_queued_mail() == {'sent': 25, 'retried': 0,
+                                             'failed': 0}
+
+        assert len(fake.messages) == 25
+        assert fake.connections == 1
+
+    def test_retry_temporary_failures(self):
+        """ Recipients refused with a 4xx are retried, 5xx ones are not. """
+        refuse = {'busy@local.host': 450, 'gone@local.host': 550}
+
+        with FakeSMTP(refuse=refuse) as fake:
+            for recipient in ('busy@local.host', 'gone@local.host',
+                              'ok@local.host'):
+                queue_template_message(subject='Hi', body='Hello',
+                                       recipients=[recipient])
+
+            outcome = deliver_queued_messages()
+            assert outcome == {'sent': 1, 'retried': 1, 'failed': 1}
+
+            del fake.refuse['busy@local.host']
+            outcome = deliver_queued_messages()
+            assert outcome == {'sent': 1, 'retried': 0, 'failed': 0}
+
+        assert [recipients for recipients, _ in fake.messages] == \
+            [['ok@local.host'], ['busy@local.host']]
+
+    def test_unexpected_error_is_retried(self):
+        """ An e-mail that fails for any reason does not sink its batch. """
+        with FakeSMTP() as fake:
+            queue_template_message(subject='Hi', body='Hello',
+                                   recipients=['broken@local.host'],
+                                   not_a_message_field=True)
+            queue_template_message(subject='Hi', body='Hello',
+                                   recipients=['ok@local.host'])
+
+            outcome = deliver_queued_messages()
+
+        assert outcome == {'sent': 1, 'retried': 1, 'failed': 0}
+        assert [recipients for recipients, _ in fake.messages] == \
+            [['ok@local.host']]
+        assert redis.zcard('test:mail:retry') == 1
+
+    def test_stale_batch_is_queued_again(self, app):
+        """ E-mails claimed by a worker that died get sent by another. """
+        entry = json.dumps({'queued_on': 0, 'attempts': 0,
+                            'message': {'subject': 'Hi', 'body': 'Hello',
+                                        'recipients': ['late@local.host']}})
+        redis.lpush('test:mail:processing:stale', entry)
+        redis.zadd('test:mail:processing', 0, 'test:mail:processing:stale')
+
+        with FakeSMTP() as fake:
+            outcome = deliver_queued_messages()
+
+        assert outcome == {'sent': 1, 'retried': 0, 'failed': 0}
+        assert [recipients for recipients, _ in fake.messages] == \
+            [['late@local.host']]
+        assert redis.zcard('test:mail:processing') == 0
@@ -1,4 +1,5 @@
 from flask import url_for
+from werkzeug.security import generate_password_hash
 
 from lib.tests import assert_status_with_message, ViewTestMixin
 from snakeeyes.blueprints.user.models import User
@@ -27,6 +28,21 @@ class TestLogin(ViewTestMixin):
         assert response.status_code == 200
         assert (old_sign_in_count + 1) == new_sign_in_count
 
+    def test_login_rehashes_outdated_password(self, users):
+        """ Login upgrades a password hashed with an outdated method. """
+        outdated = generate_password_hash('password', 'pbkdf2:sha1:500')
+        user = User.find_by_identity('admin@local.host')
+        user.password = outdated
+        user.save()
+
+        response = self.login()
+
+        user = User.find_by_identity('admin@local.host')
+
+        assert response.status_code == 200
+        assert user.password != outdated
+        assert user.authenticated(password='password')
+
     def test_login_disable(self):
         """ Login failure due to account being disabled. """
         response = self.login(identity='disabled@local.host')
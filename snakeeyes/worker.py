@@ -0,0 +1,9 @@
+"""
+Celery workers and beat start from here, so the Flask app only gets built
+once per worker process:
+
+  celery worker -B -l info -A snakeeyes.worker
+"""
+from snakeeyes.app import create_celery_app
+
+celery = create_celery_app()